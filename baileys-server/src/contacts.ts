@@ -70,6 +70,45 @@ export async function getJidFromPhone(phone: string) {
   };
 }
 
+/**
+ * Resolve many phone numbers with a single onWhatsApp query
+ */
+export async function getJidsFromPhones(phones: string[]) {
+  const sock = getSock();
+  if (!sock) throw new Error("WhatsApp not connected");
+
+  const results =
+    (await sock.onWhatsApp(...phones.map((phone) => `${phone}@s.whatsapp.net`))) ?? [];
+
+  // Only numbers on WhatsApp are answered, keyed by their canonical jid.
+  const byPhone = new Map<string, any>();
+  for (const result of results) {
+    byPhone.set(result.jid.split("@")[0], result);
+  }
+  const unmatched = results.length > phones.filter((phone) => byPhone.has(phone)).length;
+
+  const resolved: any[] = [];
+  for (const phone of phones) {
+    const result = byPhone.get(phone);
+    if (result) {
+      resolved.push({
+        phone,
+        jid: result.jid,
+        exists: result.exists,
+        isBusiness: (result as any).isBusiness ?? false
+      });
+    } else if (unmatched) {
+      // Some answer came back under a different number than asked for
+      // (canonical form); ask for the remaining numbers one by one.
+      resolved.push(await getJidFromPhone(phone));
+    } else {
+      resolved.push({ phone, jid: `${phone}@s.whatsapp.net`, exists: false });
+    }
+  }
+
+  return resolved;
+}
+
 
 /**
  * Get all joined WhatsApp groups
@@ -5,7 +5,7 @@ import { startWhatsApp, getQR,getSock,
 import { getMessages } from "./messages.js";
 import { getReceipts } from "./receipts.js";
 import { getUserDetails, getGroupDetails, 
-        getJidFromPhone,getAllJoinedGroups
+        getJidFromPhone,getJidsFromPhones,getAllJoinedGroups
  } from "./contacts.js";
 import { getAllChats } from "./chats.js";
 const app = express();
@@ -63,6 +63,19 @@ const PORT = process.env.NODE_PORT ? Number(process.env.NODE_PORT) : 3000;
         res.status(500).json({ error: e.message });
       }
     });
+    // Resolve many phone numbers in one query
+    app.post("/jid/batch", async (req, res) => {
+      try {
+        const phones = req.body?.phones;
+        if (!Array.isArray(phones) || !phones.every((p) => typeof p === "string")) {
+          return res.status(400).json({ error: "phones must be an array of strings" });
+        }
+        const results = await getJidsFromPhones(phones);
+        res.json(results);
+      } catch (e: any) {
+        res.status(500).json({ error: e.message });
+      }
+    });
     // Get all joined groups
       app.get("/groups", async (req, res) => {
         try {
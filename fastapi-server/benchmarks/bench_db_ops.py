@@ -0,0 +1,321 @@
+"""Microbenchmarks for the db_ops hot paths.
+
+Runs format_timestamp, upsert_contact, insert_message, update_message_status,
+update_contact_presence and apply_events against a throw-away SQLite file
+and, optionally, a local Postgres. Each case is parametrised by contact
+cardinality (how many distinct jids the traffic spreads over) and table
+size (messages already stored before timing starts).
+
+    python benchmarks/bench_db_ops.py
+    python benchmarks/bench_db_ops.py --contacts 10,10000 --rows 0,100000 --save before
+    python benchmarks/bench_db_ops.py --compare before --fail-threshold 15
+
+Postgres runs only when --postgres-dsn (or BENCH_POSTGRES_DSN) is given.
+Point it at a scratch database: its tables are truncated between cases.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+FASTAPI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(FASTAPI_DIR, "benchmarks", "baselines")
+
+# db.py reads db_config.json relative to the working directory.
+os.chdir(FASTAPI_DIR)
+sys.path.insert(0, FASTAPI_DIR)
+
+import db  # noqa: E402
+import db_ops  # noqa: E402
+import migrations  # noqa: E402
+from contact_cache import contact_cache  # noqa: E402
+
+PREFILL_BATCH = 1000
+
+
+def jid_for(i: int) -> str:
+    return f"91{9000000000 + i}@s.whatsapp.net"
+
+
+def use_engine(engine: str, sqlite_path: str, postgres_dsn: str | None):
+    db.close_all_connections()
+    contact_cache.clear()
+
+    db.DB_PATH = sqlite_path
+    db.POSTGRES_DSN = postgres_dsn if engine == "postgres" else None
+    db.ENGINE = engine
+
+    if os.path.exists(sqlite_path):
+        os.remove(sqlite_path)
+
+    migrations.init_db()
+
+    if engine == "postgres":
+        pg = db.get_pg_db()
+        cur = pg.cursor()
+        cur.execute("TRUNCATE messages, contacts, outbox RESTART IDENTITY CASCADE")
+        pg.commit()
+        pg.close()
+
+
+def prefill(rows: int, contacts: int):
+    now = int(time.time() * 1000)
+    for start in range(0, rows, PREFILL_BATCH):
+        db_ops.apply_events([
+            ("message", {
+                "message_id": f"prefill-{i}",
+                "jid": jid_for(i % contacts),
+                "direction": "in",
+                "message_type": "text",
+                "content": "prefill",
+                "media_path": None,
+                "timestamp": now + i,
+                "status": "delivered",
+            })
+            for i in range(start, min(start + PREFILL_BATCH, rows))
+        ])
+    contact_cache.clear()
+
+
+def measure(fn, ops: int) -> dict:
+    """Call fn(i) ops times; per-call latencies in milliseconds"""
+    latencies = []
+    started = time.perf_counter()
+    for i in range(ops):
+        t0 = time.perf_counter_ns()
+        fn(i)
+        latencies.append((time.perf_counter_ns() - t0) / 1e6)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "ops": ops,
+        "ops_per_sec": round(ops / elapsed, 1) if elapsed else None,
+        "p50_ms": round(statistics.median(latencies), 4),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 4),
+    }
+
+
+def case_format_timestamp(contacts, ops):
+    base = int(time.time() * 1000)
+    return lambda i: db_ops.format_timestamp(base + i)
+
+
+def case_upsert_contact(contacts, ops):
+    return lambda i: db_ops.upsert_contact(jid_for(i % contacts), name=f"Name {i % contacts}")
+
+
+def case_insert_message(contacts, ops):
+    base = int(time.time() * 1000)
+    return lambda i: db_ops.insert_message(
+        message_id=f"bench-{i}",
+        jid=jid_for(i % contacts),
+        direction="in",
+        message_type="text",
+        content="hello from the benchmark",
+        media_path=None,
+        timestamp=base + i,
+        status="delivered",
+        name=f"Name {i % contacts}",
+    )
+
+
+def case_update_message_status(contacts, ops):
+    # Needs rows to update: seed them untimed, then walk them to "read".
+    prefill_ids = [f"status-{i}" for i in range(ops)]
+    db_ops.apply_events([
+        ("message", {
+            "message_id": message_id,
+            "jid": jid_for(i % contacts),
+            "direction": "out",
+            "message_type": "text",
+            "content": "x",
+            "media_path": None,
+            "timestamp": i,
+            "status": "sent",
+        })
+        for i, message_id in enumerate(prefill_ids)
+    ])
+    return lambda i: db_ops.update_message_status(prefill_ids[i], "read")
+
+
+def case_update_contact_presence(contacts, ops):
+    return lambda i: db_ops.update_contact_presence(
+        jid=jid_for(i % contacts),
+        phone=None,
+        name=None,
+        is_online=bool(i % 2),
+    )
+
+
+def case_apply_events_100(contacts, ops):
+    base = int(time.time() * 1000)
+
+    def run(i):
+        db_ops.apply_events([
+            ("message", {
+                "message_id": f"batch-{i}-{j}",
+                "jid": jid_for((i * 100 + j) % contacts),
+                "direction": "in",
+                "message_type": "text",
+                "content": "batched",
+                "media_path": None,
+                "timestamp": base + i * 100 + j,
+                "status": "delivered",
+            })
+            for j in range(100)
+        ])
+
+    return run
+
+
+CASES = {
+    "format_timestamp": (case_format_timestamp, False),
+    "upsert_contact": (case_upsert_contact, True),
+    "insert_message": (case_insert_message, True),
+    "update_message_status": (case_update_message_status, True),
+    "update_contact_presence": (case_update_contact_presence, True),
+    "apply_events[100]": (case_apply_events_100, True),
+}
+
+
+def case_key(result: dict) -> str:
+    return "{name} engine={engine} contacts={contacts} rows={rows}".format(**result)
+
+
+def run(args) -> list[dict]:
+    engines = ["sqlite"] + (["postgres"] if args.postgres_dsn else [])
+    contact_counts = [int(x) for x in args.contacts.split(",")]
+    row_counts = [int(x) for x in args.rows.split(",")]
+    selected = args.cases.split(",") if args.cases else list(CASES)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_path = os.path.join(tmp, "bench.db")
+
+        for name in selected:
+            factory, uses_db = CASES[name]
+            matrix = [
+                (engine, contacts, rows)
+                for engine in (engines if uses_db else ["-"])
+                for contacts in (contact_counts if uses_db else [0])
+                for rows in (row_counts if uses_db else [0])
+            ]
+
+            for engine, contacts, rows in matrix:
+                if uses_db:
+                    use_engine(engine, sqlite_path, args.postgres_dsn)
+                    prefill(rows, contacts)
+
+                fn = factory(max(contacts, 1), args.ops)
+                ops = args.ops // 100 if name == "apply_events[100]" else args.ops
+
+                # update_message_status only has `ops` seeded rows to walk.
+                if name != "update_message_status":
+                    for i in range(min(args.warmup, ops)):
+                        fn(ops + i)
+
+                result = {
+                    "name": name,
+                    "engine": engine,
+                    "contacts": contacts,
+                    "rows": rows,
+                    **measure(fn, max(ops, 1)),
+                }
+                results.append(result)
+                print(
+                    f"{case_key(result):<72} "
+                    f"{result['ops_per_sec']:>10} ops/s  "
+                    f"p50 {result['p50_ms']:.4f} ms  p99 {result['p99_ms']:.4f} ms",
+                    flush=True,
+                )
+
+    db.close_all_connections()
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=FASTAPI_DIR, text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except Exception:
+        return None
+
+
+def save_baseline(name: str, results: list[dict]):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "revision": git_revision(),
+                "created_at": int(time.time()),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nBaseline saved to {path}")
+
+
+def compare_baseline(name: str, results: list[dict], threshold: float) -> bool:
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    if not os.path.exists(path):
+        print(f"\nNo baseline at {path}; run with --save {name} first")
+        return False
+
+    with open(path) as f:
+        baseline = json.load(f)
+
+    previous = {case_key(r): r for r in baseline["results"]}
+    regressed = False
+
+    print(f"\nCompared with {name} (revision {baseline.get('revision')}):")
+    for result in results:
+        before = previous.get(case_key(result))
+        if not before or not before["ops_per_sec"]:
+            continue
+        change = (result["ops_per_sec"] - before["ops_per_sec"]) / before["ops_per_sec"] * 100
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{case_key(result):<72} {change:+7.1f}% ops/s{flag}")
+
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000, help="timed calls per case")
+    parser.add_argument("--warmup", type=int, default=50, help="untimed calls before each case")
+    parser.add_argument("--contacts", default="10,1000", help="comma-separated contact cardinalities")
+    parser.add_argument("--rows", default="0,10000", help="comma-separated pre-filled message counts")
+    parser.add_argument("--cases", default="", help="comma-separated subset of: " + ", ".join(CASES))
+    parser.add_argument("--postgres-dsn", default=os.getenv("BENCH_POSTGRES_DSN"))
+    parser.add_argument("--save", metavar="NAME", help="save results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with baselines/NAME.json")
+    parser.add_argument("--fail-threshold", type=float, default=10.0,
+                        help="exit 1 if any case loses more than this %% of ops/s against --compare")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.save:
+        save_baseline(args.save, results)
+    if args.compare and not compare_baseline(args.compare, results, args.fail_threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
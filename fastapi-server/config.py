@@ -1 +1,37 @@
 NODE_BASE_URL = "http://localhost:3000"
+
+# Per-route timeouts (seconds) for calls to the Baileys server
+NODE_TIMEOUT = 5
+NODE_SEND_MEDIA_TIMEOUT = 30
+NODE_SYNC_TIMEOUT = 15
+NODE_JID_BATCH_TIMEOUT = 30
+NODE_CONNECT_TIMEOUT = 3
+
+# Keep-alive pool shared by all Node proxy calls
+NODE_MAX_CONNECTIONS = 100
+NODE_MAX_KEEPALIVE_CONNECTIONS = 20
+NODE_KEEPALIVE_EXPIRY = 30
+
+# /send/bulk fan-out: concurrency per job, and token buckets (messages per
+# second + burst) shared by all jobs and per recipient
+BULK_SEND_DEFAULT_CONCURRENCY = 5
+BULK_SEND_MAX_CONCURRENCY = 20
+BULK_SEND_RATE = 10
+BULK_SEND_BURST = 10
+BULK_RECIPIENT_RATE = 0.5
+BULK_RECIPIENT_BURST = 2
+
+# Outbox dispatch: worker count, retry policy (exponential backoff, then
+# dead-letter) and how long a claimed row stays leased to one worker
+OUTBOX_WORKERS = 4
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 2
+OUTBOX_BACKOFF_MAX = 300
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_POLL_INTERVAL = 1
+
+# /jid/batch: numbers per onWhatsApp query, queries in flight per request,
+# and numbers accepted per request
+JID_BATCH_CHUNK = 50
+JID_BATCH_CONCURRENCY = 2
+JID_BATCH_MAX_PHONES = 10000
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from db import config
+
+CONTACT_CACHE_SIZE = int(config.get("contact_cache_size", 10000))
+
+
+class ContactCache:
+    """Bounded LRU of jid -> (contact_id, phone, name)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(0, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, jid: str):
+        with self._lock:
+            entry = self._entries.get(jid)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(jid)
+            self.hits += 1
+            return entry
+
+    def peek(self, jid: str):
+        with self._lock:
+            return self._entries.get(jid)
+
+    def put(self, jid: str, contact_id: int, phone: str | None, name: str | None):
+        if not self.max_size or jid is None:
+            return
+        with self._lock:
+            self._entries[jid] = (contact_id, phone, name)
+            self._entries.move_to_end(jid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, jid: str):
+        with self._lock:
+            self._entries.pop(jid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+contact_cache = ContactCache(CONTACT_CACHE_SIZE)
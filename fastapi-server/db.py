@@ -1,6 +1,8 @@
 import sqlite3
 import json
 import os
+import threading
+import time
 
 CONFIG_FILE = "db_config.json"
 
@@ -14,6 +16,32 @@ POSTGRES_DSN = (
     or None
 )
 
+# Pools are per process. With pg_pool_max_total set, the connection budget
+# is split across the FASTAPI_WORKERS processes started by run_all.py.
+FASTAPI_WORKERS = max(1, int(os.getenv("FASTAPI_WORKERS", "1")))
+PG_POOL_MAX_TOTAL = int(config.get("pg_pool_max_total", 0))
+PG_POOL_MAX = (
+    max(1, PG_POOL_MAX_TOTAL // FASTAPI_WORKERS)
+    if PG_POOL_MAX_TOTAL > 0
+    else int(config.get("pg_pool_max", 10))
+)
+PG_POOL_MIN = min(int(config.get("pg_pool_min", 1)), PG_POOL_MAX)
+PG_POOL_TIMEOUT = float(config.get("pg_pool_timeout", 10))
+POOL_HEALTH_CHECK_SECONDS = float(config.get("pool_health_check_seconds", 60))
+
+# WAL lets readers run alongside the single writer, and busy_timeout makes a
+# writer wait for the lock instead of failing with "database is locked" when
+# several worker processes share the file.
+SQLITE_JOURNAL_MODE = config.get("sqlite_journal_mode", "WAL")
+SQLITE_SYNCHRONOUS = config.get("sqlite_synchronous", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(config.get("sqlite_busy_timeout_ms", 5000))
+
+# Postgres text search configuration for messages.content_tsv; "simple"
+# does no stemming, which suits mixed-language chats.
+SEARCH_LANGUAGE = config.get("search_language", "simple")
+if not SEARCH_LANGUAGE.replace("_", "").isalpha():
+    raise ValueError(f"Invalid search_language: {SEARCH_LANGUAGE!r}")
+
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 try:
@@ -22,205 +50,371 @@ except ImportError:
     psycopg2 = None  # type: ignore
 
 
+# "sqlite" keeps everything in the local file and "postgres" reads and
+# writes Postgres directly. "tiered" serves reads and writes from SQLite and
+# lets shipper.py copy the changes to Postgres in the background.
+ENGINES = ("sqlite", "postgres", "tiered")
+ENGINE = config.get("engine") or ("postgres" if POSTGRES_DSN else "sqlite")
+if ENGINE not in ENGINES:
+    raise ValueError(f"Invalid engine: {ENGINE!r} (expected one of {', '.join(ENGINES)})")
+
+
+def postgres_configured():
+    """Whether the engine uses Postgres and a DSN and driver are available"""
+    return ENGINE != "sqlite" and bool(POSTGRES_DSN and psycopg2 is not None)
+
+
 def has_postgres():
-    return bool(POSTGRES_DSN and psycopg2 is not None)
+    """Whether requests read and write Postgres directly"""
+    return ENGINE == "postgres" and postgres_configured()
 
 
-def get_db():
-    return sqlite3.connect(DB_PATH)
+def is_tiered():
+    """Whether requests use SQLite and the shipper copies changes to Postgres"""
+    return ENGINE == "tiered" and postgres_configured()
 
 
-def get_pg_db():
-    if not has_postgres():
-        return None
-    return psycopg2.connect(POSTGRES_DSN)  # type: ignore[arg-type]
+# ============================================================
+# CONNECTION POOLING
+# ============================================================
 
+_stats_lock = threading.Lock()
+_pool_stats = {
+    "sqlite": {"created": 0, "checkouts": 0, "checkins": 0, "discarded": 0},
+    "postgres": {
+        "created": 0,
+        "checkouts": 0,
+        "checkins": 0,
+        "discarded": 0,
+        "waits": 0,
+        "timeouts": 0,
+    },
+}
 
-def init_db():
-    db = get_db()
-    cur = db.cursor()
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS login_sessions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        jid TEXT,
-        lid TEXT,
-        phone TEXT,
-        status TEXT,
-        created_at INTEGER
-    )
-    """)
+def _bump(engine: str, key: str, n: int = 1):
+    with _stats_lock:
+        _pool_stats[engine][key] += n
 
-    try:
-        cur.execute("ALTER TABLE login_sessions ADD COLUMN created_at_str TEXT")
-    except Exception:
-        pass
 
-    cur.execute("""
-CREATE TABLE IF NOT EXISTS contacts (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    jid TEXT UNIQUE,
-    phone TEXT,
-    name TEXT,
-    profile_pic TEXT,
-    last_seen_at INTEGER,
-    is_online INTEGER,
-    created_at INTEGER,
-    updated_at INTEGER
-)
-""")
+class PooledConnection:
+    """Proxy around a pooled connection; close() hands it back to the pool."""
 
-    try:
-        cur.execute("ALTER TABLE contacts ADD COLUMN last_seen_at_str TEXT")
-    except Exception:
-        pass
+    _conn = None
 
-    try:
-        cur.execute("ALTER TABLE contacts ADD COLUMN created_at_str TEXT")
-    except Exception:
-        pass
+    def __init__(self, conn, release):
+        self._conn = conn
+        self._release = release
 
-    try:
-        cur.execute("ALTER TABLE contacts ADD COLUMN updated_at_str TEXT")
-    except Exception:
-        pass
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(name)
+        return getattr(self._conn, name)
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        message_id TEXT UNIQUE,
-        contact_id INTEGER,
-        direction TEXT,
-        message_type TEXT,
-        content TEXT,
-        media_path TEXT,
-        timestamp INTEGER,
-        status TEXT,
-        created_at INTEGER,
-        FOREIGN KEY(contact_id) REFERENCES contacts(id)
-    )
-    """)
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._release(conn)
+
+    def __del__(self):
+        # Safety net for code paths that bail out before close().
+        try:
+            self.close()
+        except Exception:
+            pass
 
-    try:
-        cur.execute("ALTER TABLE messages ADD COLUMN timestamp_str TEXT")
-    except Exception:
-        pass
 
+# ---------- SQLite: one reusable connection per thread ----------
+
+_sqlite_local = threading.local()
+_sqlite_conns = []
+_sqlite_conns_lock = threading.Lock()
+_sqlite_generation = 0
+
+
+def _open_sqlite():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+    )
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_JOURNAL_MODE:
+        conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    if SQLITE_SYNCHRONOUS:
+        conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    with _sqlite_conns_lock:
+        _sqlite_conns.append(conn)
+    _bump("sqlite", "created")
+    return conn
+
+
+def _discard_sqlite(conn):
+    with _sqlite_conns_lock:
+        if conn in _sqlite_conns:
+            _sqlite_conns.remove(conn)
     try:
-        cur.execute("ALTER TABLE messages ADD COLUMN created_at_str TEXT")
+        conn.close()
     except Exception:
         pass
+    _bump("sqlite", "discarded")
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS message_comments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        message_id INTEGER,
-        comment TEXT,
-        created_at INTEGER,
-        FOREIGN KEY(message_id) REFERENCES messages(id)
-    )
-    """)
 
+def _sqlite_is_healthy(conn, last_used):
+    if time.monotonic() - last_used < POOL_HEALTH_CHECK_SECONDS:
+        return True
     try:
-        cur.execute("ALTER TABLE message_comments ADD COLUMN created_at_str TEXT")
+        conn.execute("SELECT 1").fetchone()
+        return True
     except Exception:
-        pass
+        return False
 
-    db.commit()
-    db.close()
 
-    if not has_postgres():
-        return
+def _release_sqlite(conn):
+    _sqlite_local.depth = max(getattr(_sqlite_local, "depth", 1) - 1, 0)
 
-    try:
-        pg = get_pg_db()
-        if pg is None:
+    # The same thread may hold nested checkouts of one connection; only
+    # the outermost close() may discard uncommitted work.
+    if _sqlite_local.depth == 0 and conn.in_transaction:
+        try:
+            conn.rollback()
+        except Exception:
+            _discard_sqlite(conn)
+            _sqlite_local.conn = None
+
+    _sqlite_local.last_used = time.monotonic()
+    _bump("sqlite", "checkins")
+
+
+def get_db():
+    conn = getattr(_sqlite_local, "conn", None)
+
+    if conn is not None and _sqlite_local.generation != _sqlite_generation:
+        # close_all_connections() ran since this thread last connected.
+        conn = None
+
+    if conn is not None and not _sqlite_local.depth:
+        if not _sqlite_is_healthy(conn, _sqlite_local.last_used):
+            _discard_sqlite(conn)
+            conn = None
+
+    if conn is None:
+        conn = _open_sqlite()
+        _sqlite_local.conn = conn
+        _sqlite_local.generation = _sqlite_generation
+        _sqlite_local.depth = 0
+        _sqlite_local.last_used = time.monotonic()
+
+    _sqlite_local.depth += 1
+    _bump("sqlite", "checkouts")
+    return PooledConnection(conn, _release_sqlite)
+
+
+# ---------- Postgres: bounded thread-safe pool ----------
+
+class PgPoolTimeout(Exception):
+    pass
+
+
+class PgPool:
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn)
+        self.timeout = timeout
+        self._idle = []  # (conn, last_used) pairs, most recently used last
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)  # type: ignore[union-attr]
+        _bump("postgres", "created")
+        return conn
+
+    def prefill(self):
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < POOL_HEALTH_CHECK_SECONDS:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        _bump("postgres", "discarded")
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            with self._cond:
+                conn = None
+                last_used = None
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        _bump("postgres", "timeouts")
+                        raise PgPoolTimeout(
+                            f"Postgres pool exhausted ({self.maxconn} connections in use)"
+                        )
+                    _bump("postgres", "waits")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+
+            _bump("postgres", "checkouts")
+            return conn
+
+    def putconn(self, conn):
+        _bump("postgres", "checkins")
+
+        if conn.closed:
+            self._discard(conn)
             return
 
-        cur_pg = pg.cursor()
-
-        cur_pg.execute("""
-        CREATE TABLE IF NOT EXISTS login_sessions (
-            id SERIAL PRIMARY KEY,
-            jid TEXT,
-            lid TEXT,
-            phone TEXT,
-            status TEXT,
-            created_at BIGINT,
-            created_at_str TEXT
-        )
-        """)
-
-        cur_pg.execute("""
-        CREATE TABLE IF NOT EXISTS contacts (
-            id SERIAL PRIMARY KEY,
-            jid TEXT UNIQUE,
-            phone TEXT,
-            name TEXT,
-            profile_pic TEXT,
-            last_seen_at BIGINT,
-            is_online BOOLEAN,
-            created_at BIGINT,
-            updated_at BIGINT
-        )
-        """)
-
-        cur_pg.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id SERIAL PRIMARY KEY,
-            message_id TEXT UNIQUE,
-            contact_id INTEGER REFERENCES contacts(id),
-            direction TEXT,
-            message_type TEXT,
-            content TEXT,
-            media_path TEXT,
-            timestamp BIGINT,
-            status TEXT,
-            created_at BIGINT,
-            timestamp_str TEXT,
-            created_at_str TEXT
-        )
-        """)
-
-        cur_pg.execute("""
-        CREATE TABLE IF NOT EXISTS message_comments (
-            id SERIAL PRIMARY KEY,
-            message_id INTEGER REFERENCES messages(id),
-            comment TEXT,
-            created_at BIGINT,
-            created_at_str TEXT
-        )
-        """)
-
-        cur_pg.execute(
-            "ALTER TABLE login_sessions ADD COLUMN IF NOT EXISTS created_at_str TEXT"
-        )
-
-        cur_pg.execute(
-            "ALTER TABLE contacts ADD COLUMN IF NOT EXISTS last_seen_at_str TEXT"
-        )
-
-        cur_pg.execute(
-            "ALTER TABLE contacts ADD COLUMN IF NOT EXISTS created_at_str TEXT"
-        )
-
-        cur_pg.execute(
-            "ALTER TABLE contacts ADD COLUMN IF NOT EXISTS updated_at_str TEXT"
-        )
-
-        cur_pg.execute(
-            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS timestamp_str TEXT"
-        )
-
-        cur_pg.execute(
-            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS created_at_str TEXT"
-        )
-
-        cur_pg.execute(
-            "ALTER TABLE message_comments ADD COLUMN IF NOT EXISTS created_at_str TEXT"
-        )
-
-        pg.commit()
-        pg.close()
-    except Exception as e:
-        print("Postgres init failed:", e)
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max": self.maxconn,
+            }
+
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+
+def _get_pg_pool():
+    global _pg_pool
+    if _pg_pool is not None:
+        return _pg_pool
+
+    with _pg_pool_lock:
+        if _pg_pool is None:
+            pool = PgPool(POSTGRES_DSN, PG_POOL_MIN, PG_POOL_MAX, PG_POOL_TIMEOUT)
+            try:
+                pool.prefill()
+            except Exception as e:
+                print("Postgres pool prefill failed:", e)
+            _pg_pool = pool
+    return _pg_pool
+
+
+def get_pg_db():
+    if not postgres_configured():
+        return None
+    pool = _get_pg_pool()
+    return PooledConnection(pool.getconn(), pool.putconn)
+
+
+def pool_stats():
+    with _stats_lock:
+        stats = {
+            engine: dict(counters) for engine, counters in _pool_stats.items()
+        }
+    with _sqlite_conns_lock:
+        stats["sqlite"]["open"] = len(_sqlite_conns)
+    if _pg_pool is not None:
+        stats["postgres"].update(_pg_pool.stats())
+    return stats
+
+
+def close_all_connections():
+    global _pg_pool, _sqlite_generation
+    with _sqlite_conns_lock:
+        conns = list(_sqlite_conns)
+        _sqlite_conns.clear()
+        _sqlite_generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+
+
+_sqlite_fts = None
+
+
+def sqlite_fts_available() -> bool:
+    """Whether the FTS5 messages index exists (checked once per process)"""
+    global _sqlite_fts
+    if _sqlite_fts is None:
+        db = get_db()
+        cur = db.cursor()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        _sqlite_fts = cur.fetchone() is not None
+        db.close()
+    return _sqlite_fts
@@ -1,5 +1,32 @@
+import io
+import json
+import re
 import time
-from db import get_db, get_pg_db, has_postgres
+from functools import wraps
+from db import get_db, get_pg_db, has_postgres, sqlite_fts_available, SEARCH_LANGUAGE
+from contact_cache import contact_cache
+from metrics import DB_OP_SECONDS
+
+try:
+    from psycopg2.extras import execute_batch, execute_values  # type: ignore
+except ImportError:
+    execute_batch = execute_values = None  # type: ignore
+
+
+def timed(fn):
+    """Record the call's latency in db_op_duration_seconds, labelled by engine"""
+    op = fn.__name__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        engine = "postgres" if has_postgres() else "sqlite"
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB_OP_SECONDS.observe(time.perf_counter() - start, op=op, engine=engine)
+
+    return wrapper
 
 
 def format_timestamp(ts_ms: int | None) -> str | None:
@@ -37,100 +64,71 @@ def extract_phone_from_jid(jid: str) -> str | None:
     return None
 
 
-def upsert_contact(jid: str, phone: str | None = None, name: str | None = None):
-    if phone is None:
-        phone = extract_phone_from_jid(jid)
+def _contact_updates(
+    jid: str,
+    existing_phone: str | None,
+    existing_name: str | None,
+    phone: str | None,
+    name: str | None,
+) -> tuple[bool, bool]:
+    should_update_phone = False
+    should_update_name = False
 
-    if has_postgres():
-        try:
-            pg = get_pg_db()
-            if pg is None:
-                return None
+    if phone:
+        if not existing_phone:
+            should_update_phone = True
+        elif jid.endswith("@lid"):
+            lid_local = jid.split("@", 1)[0]
+            if existing_phone == lid_local:
+                should_update_phone = True
 
-            cur_pg = pg.cursor()
-            cur_pg.execute(
-                "SELECT id, phone, name FROM contacts WHERE jid = %s",
-                (jid,),
-            )
-            row_pg = cur_pg.fetchone()
-
-            if row_pg:
-                contact_id = row_pg[0]
-                existing_phone = row_pg[1]
-                existing_name = row_pg[2]
-                should_update_phone = False
-                should_update_name = False
-
-                if phone:
-                    if not existing_phone:
-                        should_update_phone = True
-                    elif jid.endswith("@lid"):
-                        lid_local = jid.split("@", 1)[0]
-                        if existing_phone == lid_local:
-                            should_update_phone = True
-
-                if name and not existing_name:
-                    should_update_name = True
-
-                if phone and should_update_phone:
-                    try:
-                        cur_pg.execute(
-                            "UPDATE contacts SET phone = %s WHERE id = %s",
-                            (phone, contact_id),
-                        )
-                    except Exception:
-                        pass
-
-                if name and should_update_name:
-                    try:
-                        cur_pg.execute(
-                            "UPDATE contacts SET name = %s WHERE id = %s",
-                            (name, contact_id),
-                        )
-                    except Exception:
-                        pass
-            else:
-                cur_pg.execute(
-                    "INSERT INTO contacts (jid, phone, name) VALUES (%s, %s, %s) RETURNING id",
-                    (jid, phone, name),
-                )
-                contact_id = cur_pg.fetchone()[0]
+    if name and not existing_name:
+        should_update_name = True
 
-            pg.commit()
-            pg.close()
-            return contact_id
-        except Exception as e:
-            print("Postgres upsert_contact failed:", e)
-            return None
+    return should_update_phone, should_update_name
 
-    db = get_db()
-    cur = db.cursor()
 
-    cur.execute("SELECT id, phone, name FROM contacts WHERE jid = ?", (jid,))
+def _resolve_contact(cur, jid: str, phone: str | None, name: str | None, pg: bool,
+                     staged: dict | None = None):
+    """Contact id for ``jid``, creating the contact or filling in phone/name.
+
+    The row read here may come from an earlier write of the same, still
+    uncommitted transaction, so it is not cached directly: it is added to
+    ``staged`` and the caller caches it with ``_cache_staged`` after commit.
+    """
+    ph = "%s" if pg else "?"
+
+    if phone is None:
+        phone = extract_phone_from_jid(jid)
+
+    cached = contact_cache.get(jid)
+    if cached is not None:
+        contact_id, existing_phone, existing_name = cached
+        if not any(_contact_updates(jid, existing_phone, existing_name, phone, name)):
+            return contact_id
+
+    cur.execute(f"SELECT id, phone, name FROM contacts WHERE jid = {ph}", (jid,))
     row = cur.fetchone()
 
     if row:
         contact_id = row[0]
         existing_phone = row[1]
         existing_name = row[2]
-        should_update_phone = False
-        should_update_name = False
-
-        if phone:
-            if not existing_phone:
-                should_update_phone = True
-            elif jid.endswith("@lid"):
-                lid_local = jid.split("@", 1)[0]
-                if existing_phone == lid_local:
-                    should_update_phone = True
+        should_update_phone, should_update_name = _contact_updates(
+            jid, existing_phone, existing_name, phone, name
+        )
 
-        if name and not existing_name:
-            should_update_name = True
+        if should_update_phone or should_update_name:
+            contact_cache.invalidate(jid)
+            if staged is not None:
+                staged.pop(jid, None)
+        elif staged is not None:
+            staged[jid] = (contact_id, existing_phone, existing_name)
 
         if phone and should_update_phone:
             try:
                 cur.execute(
-                    "UPDATE contacts SET phone = ? WHERE id = ?",
+                    f"UPDATE contacts SET phone = {ph} WHERE id = {ph}",
                     (phone, contact_id),
                 )
             except Exception:
@@ -139,26 +137,78 @@ def upsert_contact(jid: str, phone: str | None = None, name: str | None = None):
         if name and should_update_name:
             try:
                 cur.execute(
-                    "UPDATE contacts SET name = ? WHERE id = ?",
+                    f"UPDATE contacts SET name = {ph} WHERE id = {ph}",
                     (name, contact_id),
                 )
             except Exception:
                 pass
     else:
+        # Another worker process may insert the same jid between the SELECT
+        # above and this INSERT; fall back to its row instead of failing.
         cur.execute(
-            "INSERT INTO contacts (jid, phone, name) VALUES (?, ?, ?)",
+            f"INSERT INTO contacts (jid, phone, name) VALUES ({ph}, {ph}, {ph}) "
+            "ON CONFLICT (jid) DO NOTHING" + (" RETURNING id" if pg else ""),
             (jid, phone, name),
         )
-        contact_id = cur.lastrowid
+        if pg:
+            row = cur.fetchone()
+            contact_id = row[0] if row else None
+        else:
+            contact_id = cur.lastrowid if cur.rowcount == 1 else None
+        if contact_id is None:
+            cur.execute(f"SELECT id FROM contacts WHERE jid = {ph}", (jid,))
+            contact_id = cur.fetchone()[0]
+
+    return contact_id
+
+
+def _cache_staged(staged: dict):
+    """Cache contacts read by a transaction that has now committed"""
+    for jid, (contact_id, phone, name) in staged.items():
+        contact_cache.put(jid, contact_id, phone, name)
+
+
+@timed
+def upsert_contact(jid: str, phone: str | None = None, name: str | None = None):
+    if has_postgres():
+        try:
+            pg = get_pg_db()
+            if pg is None:
+                return None
+
+            staged = {}
+            contact_id = _resolve_contact(pg.cursor(), jid, phone, name, pg=True, staged=staged)
+
+            pg.commit()
+            pg.close()
+            _cache_staged(staged)
+            return contact_id
+        except Exception as e:
+            print("Postgres upsert_contact failed:", e)
+            return None
+
+    db = get_db()
+    staged = {}
+    contact_id = _resolve_contact(db.cursor(), jid, phone, name, pg=False, staged=staged)
 
     db.commit()
     db.close()
+    _cache_staged(staged)
 
     return contact_id
 
 
+MESSAGE_COLUMNS = (
+    "message_id, contact_id, direction, message_type, content, media_path, "
+    "timestamp, status, created_at, timestamp_str, created_at_str"
+)
+
+# Message inserts use ON CONFLICT DO NOTHING without a conflict target: a
+# partitioned Postgres messages table has no unique index on message_id and
+# drops duplicates in a trigger instead (see partitions.py).
 
 
+@timed
 def insert_message(
     message_id: str,
     jid: str,
@@ -171,98 +221,49 @@ def insert_message(
     phone: str | None = None,
     name: str | None = None,
 ):
-    created_at_ms = int(time.time() * 1000)
-    timestamp_str = format_timestamp(timestamp)
-    created_at_str = format_timestamp(created_at_ms)
-
-    if has_postgres():
-        contact_id_pg = upsert_contact(jid, phone, name)
+    """Store one message; same path as the webhook batches (apply_events)"""
+    row = {
+        "message_id": message_id,
+        "jid": jid,
+        "direction": direction,
+        "message_type": message_type,
+        "content": content,
+        "media_path": media_path,
+        "timestamp": timestamp,
+        "status": status,
+        "phone": phone,
+        "name": name,
+    }
+    _store_message(row)
 
-        if contact_id_pg is None:
-            print("Postgres insert_message skipped: contact upsert failed")
-            return
 
+def _store_message(row: dict):
+    # Untimed so insert_media_message is recorded once, under its own name.
+    if has_postgres():
         try:
             pg = get_pg_db()
             if pg is None:
                 return
 
-            cur_pg = pg.cursor()
-
-            cur_pg.execute(
-                """
-                INSERT INTO messages (
-                    message_id,
-                    contact_id,
-                    direction,
-                    message_type,
-                    content,
-                    media_path,
-                    timestamp,
-                    status,
-                    created_at,
-                    timestamp_str,
-                    created_at_str
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (message_id) DO NOTHING
-                """,
-                (
-                    message_id,
-                    contact_id_pg,
-                    direction,
-                    message_type,
-                    content,
-                    media_path,
-                    timestamp,
-                    status,
-                    created_at_ms,
-                    timestamp_str,
-                    created_at_str,
-                ),
-            )
-
+            staged = {}
+            _insert_messages(pg.cursor(), [row], pg=True, staged=staged)
             pg.commit()
             pg.close()
+            _cache_staged(staged)
         except Exception as e:
             print("Postgres insert_message failed:", e)
-
         return
 
-    contact_id = upsert_contact(jid, phone, name)
-
+    staged = {}
     db = get_db()
-    cur = db.cursor()
-
-    cur.execute(
-        """
-    INSERT OR IGNORE INTO messages (
-        message_id, contact_id, direction,
-        message_type, content, media_path,
-        timestamp, status, created_at,
-        timestamp_str, created_at_str
-    )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            message_id,
-            contact_id,
-            direction,
-            message_type,
-            content,
-            media_path,
-            timestamp,
-            status,
-            created_at_ms,
-            timestamp_str,
-            created_at_str,
-        ),
-    )
+    _insert_messages(db.cursor(), [row], pg=False, staged=staged)
 
     db.commit()
     db.close()
+    _cache_staged(staged)
 
 
+@timed
 def update_message_status(message_id: str, status: str):
     if has_postgres():
         try:
@@ -270,15 +271,7 @@ def update_message_status(message_id: str, status: str):
             if pg is None:
                 return
 
-            cur_pg = pg.cursor()
-            cur_pg.execute(
-                """
-                UPDATE messages
-                SET status = %s
-                WHERE message_id = %s
-                """,
-                (status, message_id),
-            )
+            _update_message_statuses(pg.cursor(), [(message_id, status)], pg=True)
             pg.commit()
             pg.close()
         except Exception as e:
@@ -286,19 +279,12 @@ def update_message_status(message_id: str, status: str):
         return
 
     db = get_db()
-    cur = db.cursor()
-
-    cur.execute(
-        """
-    UPDATE messages SET status = ?
-    WHERE message_id = ?
-    """,
-        (status, message_id),
-    )
+    _update_message_statuses(db.cursor(), [(message_id, status)], pg=False)
 
     db.commit()
     db.close()
 
+@timed
 def update_contact_presence(
     jid: str,
     phone: str | None,
@@ -306,8 +292,13 @@ def update_contact_presence(
     is_online: bool,
     last_seen_at: int | None = None,
 ):
-    now = last_seen_at if last_seen_at is not None else int(time.time() * 1000)
-    now_str = format_timestamp(now)
+    row = {
+        "jid": jid,
+        "phone": phone,
+        "name": name,
+        "is_online": is_online,
+        "last_seen_at": last_seen_at,
+    }
 
     if has_postgres():
         try:
@@ -315,39 +306,7 @@ def update_contact_presence(
             if pg is None:
                 return
 
-            cur_pg = pg.cursor()
-            cur_pg.execute(
-                """
-                INSERT INTO contacts (
-                    jid, phone, name,
-                    last_seen_at, is_online,
-                    created_at, updated_at,
-                    last_seen_at_str, created_at_str, updated_at_str
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (jid) DO UPDATE SET
-                    phone = COALESCE(EXCLUDED.phone, contacts.phone),
-                    name = COALESCE(EXCLUDED.name, contacts.name),
-                    last_seen_at = EXCLUDED.last_seen_at,
-                    is_online = EXCLUDED.is_online,
-                    updated_at = EXCLUDED.updated_at,
-                    last_seen_at_str = EXCLUDED.last_seen_at_str,
-                    created_at_str = COALESCE(contacts.created_at_str, EXCLUDED.created_at_str),
-                    updated_at_str = EXCLUDED.updated_at_str
-                """,
-                (
-                    jid,
-                    phone,
-                    name,
-                    now,
-                    is_online,
-                    now,
-                    now,
-                    now_str,
-                    now_str,
-                    now_str,
-                ),
-            )
+            _update_contact_presences(pg.cursor(), [row], pg=True)
             pg.commit()
             pg.close()
         except Exception as e:
@@ -355,10 +314,120 @@ def update_contact_presence(
         return
 
     db = get_db()
-    cur = db.cursor()
+    _update_contact_presences(db.cursor(), [row], pg=False)
 
+    db.commit()
+    db.close()
+
+
+@timed
+def insert_media_message(
+    message_id: str,
+    jid: str,
+    direction: str,
+    message_type: str,
+    content: str | None,
+    media_path: str,
+    timestamp: int,
+    status: str = "delivered",
+    phone: str | None = None,
+):
+    _store_message({
+        "message_id": message_id,
+        "jid": jid,
+        "direction": direction,
+        "message_type": message_type,
+        "content": content,
+        "media_path": media_path,
+        "timestamp": timestamp,
+        "status": status,
+        "phone": phone,
+        "name": None,
+    })
+
+
+# ============================================================
+# BATCH WRITES
+# ============================================================
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cur, table: str, columns: str, rows) -> int:
+    """Bulk-load rows into a Postgres table with COPY (text format)"""
+    buf = io.StringIO()
+    count = 0
+    for row in rows:
+        buf.write("\t".join(_copy_value(value) for value in row))
+        buf.write("\n")
+        count += 1
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buf)
+    return count
+
+
+# Per-session staging table for COPY loads into messages; emptied at every
+# commit. COPY cannot skip duplicates itself, the INSERT ... SELECT does.
+MESSAGE_STAGING_PG = """
+    CREATE TEMP TABLE IF NOT EXISTS staging_messages (
+        message_id TEXT,
+        contact_id INTEGER,
+        direction TEXT,
+        message_type TEXT,
+        content TEXT,
+        media_path TEXT,
+        timestamp BIGINT,
+        status TEXT,
+        created_at BIGINT,
+        timestamp_str TEXT,
+        created_at_str TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+
+
+def copy_messages_pg(cur, rows) -> int:
+    """COPY message tuples (MESSAGE_COLUMNS order) into messages; returns rows inserted"""
+    cur.execute(MESSAGE_STAGING_PG)
+    copy_rows(cur, "staging_messages", MESSAGE_COLUMNS, rows)
     cur.execute(
-        """
+        f"INSERT INTO messages ({MESSAGE_COLUMNS}) "
+        f"SELECT {MESSAGE_COLUMNS} FROM staging_messages ON CONFLICT DO NOTHING"
+    )
+    return cur.rowcount
+
+
+PRESENCE_UPSERT_PG = """
+    INSERT INTO contacts (
+        jid, phone, name,
+        last_seen_at, is_online,
+        created_at, updated_at,
+        last_seen_at_str, created_at_str, updated_at_str
+    )
+    VALUES %s
+    ON CONFLICT (jid) DO UPDATE SET
+        phone = COALESCE(EXCLUDED.phone, contacts.phone),
+        name = COALESCE(EXCLUDED.name, contacts.name),
+        last_seen_at = EXCLUDED.last_seen_at,
+        is_online = EXCLUDED.is_online,
+        updated_at = EXCLUDED.updated_at,
+        last_seen_at_str = EXCLUDED.last_seen_at_str,
+        created_at_str = COALESCE(contacts.created_at_str, EXCLUDED.created_at_str),
+        updated_at_str = EXCLUDED.updated_at_str
+    WHERE contacts.last_seen_at IS NULL OR contacts.last_seen_at <= EXCLUDED.last_seen_at
+"""
+
+PRESENCE_UPSERT_SQLITE = """
     INSERT INTO contacts (
         jid, phone, name,
         last_seen_at, is_online,
@@ -375,45 +444,1131 @@ def update_contact_presence(
         created_at_str = COALESCE(created_at_str, excluded.created_at_str),
         updated_at = excluded.updated_at,
         updated_at_str = excluded.updated_at_str
-    """,
-        (
-            jid,
-            phone,
-            name,
-            now,
-            1 if is_online else 0,
-            now,
-            now,
-            now_str,
-            now_str,
-            now_str,
-        ),
-    )
+    WHERE contacts.last_seen_at IS NULL OR contacts.last_seen_at <= excluded.last_seen_at
+"""
+
+
+def _insert_messages(cur, rows: list[dict], pg: bool, staged: dict | None = None):
+    if not rows:
+        return
+
+    created_at_ms = int(time.time() * 1000)
+    created_at_str = format_timestamp(created_at_ms)
+    contact_ids = {}
+    values = []
+
+    for row in rows:
+        key = (row["jid"], row.get("phone"), row.get("name"))
+        if key not in contact_ids:
+            contact_ids[key] = _resolve_contact(cur, *key, pg=pg, staged=staged)
+
+        values.append(
+            (
+                row["message_id"],
+                contact_ids[key],
+                row["direction"],
+                row["message_type"],
+                row.get("content"),
+                row.get("media_path"),
+                row["timestamp"],
+                row["status"],
+                created_at_ms,
+                format_timestamp(row["timestamp"]),
+                created_at_str,
+            )
+        )
+
+    if pg:
+        execute_values(
+            cur,
+            f"INSERT INTO messages ({MESSAGE_COLUMNS}) VALUES %s "
+            "ON CONFLICT DO NOTHING",
+            values,
+        )
+    else:
+        cur.executemany(
+            f"INSERT OR IGNORE INTO messages ({MESSAGE_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            values,
+        )
+
+
+# Receipts only move a message forward: sent < delivered < read. A status
+# outside this ladder never overwrites one through the receipt path.
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3}
+
+STATUS_RANK_SQL = (
+    "CASE {column} "
+    + " ".join(f"WHEN '{status}' THEN {rank}" for status, rank in STATUS_RANK.items())
+    + " ELSE 0 END"
+)
+
+
+def _update_message_statuses(cur, updates: list[tuple[str, str]], pg: bool):
+    # Many receipts (e.g. one per group member) usually target the same
+    # message; keep only the furthest status per message id.
+    best = {}
+    for message_id, status in updates:
+        rank = STATUS_RANK.get(status, 0)
+        if not message_id or rank == 0:
+            continue
+        if rank > best.get(message_id, (None, 0))[1]:
+            best[message_id] = (status, rank)
+
+    if not best:
+        return
+
+    params = [(message_id, status, rank) for message_id, (status, rank) in best.items()]
+
+    if pg:
+        execute_values(
+            cur,
+            f"""
+            UPDATE messages AS m
+            SET status = v.status
+            FROM (VALUES %s) AS v(message_id, status, rank)
+            WHERE m.message_id = v.message_id
+              AND v.rank > {STATUS_RANK_SQL.format(column="m.status")}
+            """,
+            params,
+            page_size=1000,
+        )
+    else:
+        cur.executemany(
+            f"""
+            UPDATE messages SET status = ?2
+            WHERE message_id = ?1
+              AND ?3 > {STATUS_RANK_SQL.format(column="status")}
+            """,
+            params,
+        )
+
+
+def _update_contact_presences(cur, rows: list[dict], pg: bool):
+    if not rows:
+        return
+
+    # Only the newest state per jid matters; a multi-row ON CONFLICT upsert
+    # on Postgres also refuses to touch the same row twice.
+    latest = {}
+    for row in rows:
+        previous = latest.get(row["jid"])
+        if previous is not None:
+            row = {
+                **row,
+                "phone": row.get("phone") or previous.get("phone"),
+                "name": row.get("name") or previous.get("name"),
+            }
+        latest[row["jid"]] = row
+
+    values = []
+    for row in latest.values():
+        # The upsert overwrites phone/name whenever they are given, so drop
+        # cache entries this batch is about to change.
+        cached = contact_cache.peek(row["jid"])
+        if cached is not None and (
+            (row.get("phone") is not None and row.get("phone") != cached[1])
+            or (row.get("name") is not None and row.get("name") != cached[2])
+        ):
+            contact_cache.invalidate(row["jid"])
+
+        last_seen_at = row.get("last_seen_at")
+        now = last_seen_at if last_seen_at is not None else int(time.time() * 1000)
+        now_str = format_timestamp(now)
+        is_online = bool(row.get("is_online"))
+
+        values.append(
+            (
+                row["jid"],
+                row.get("phone"),
+                row.get("name"),
+                now,
+                is_online if pg else (1 if is_online else 0),
+                now,
+                now,
+                now_str,
+                now_str,
+                now_str,
+            )
+        )
+
+    if pg:
+        execute_values(cur, PRESENCE_UPSERT_PG, values)
+    else:
+        cur.executemany(PRESENCE_UPSERT_SQLITE, values)
+
+
+EVENT_LOG_LOCK_KEY = "event_log"
+
+
+def _log_events(cur, events: list[tuple[str, dict]], pg: bool):
+    """Append the batch to event_log, which the /events hubs tail"""
+    if not events:
+        return
+
+    now = int(time.time())
+    values = [
+        (kind, row.get("jid"), row.get("phone"),
+         json.dumps(row, ensure_ascii=False, default=str), now)
+        for kind, row in events
+    ]
+    if pg:
+        # Sequence values are not handed out in commit order. Holding this
+        # lock until commit keeps a tailer reading "id > last" from skipping
+        # a batch that commits after a higher id became visible.
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (EVENT_LOG_LOCK_KEY,))
+        execute_values(
+            cur,
+            "INSERT INTO event_log (kind, jid, phone, data, created_at) VALUES %s",
+            values,
+        )
+    else:
+        cur.executemany(
+            "INSERT INTO event_log (kind, jid, phone, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            values,
+        )
+
+
+@timed
+def apply_events(events: list[tuple[str, dict]]):
+    """Store a mixed batch of webhook events in a single transaction.
+
+    Each event is ``(kind, row)`` with kind one of ``"message"``,
+    ``"receipt"`` or ``"presence"``. Messages are written before receipts
+    so a receipt can refer to a message from the same batch. The events are
+    appended to event_log in the same transaction. Returns True once the
+    batch is committed.
+    """
+    messages = [row for kind, row in events if kind == "message"]
+    receipts = [
+        (row["message_id"], row["status"]) for kind, row in events if kind == "receipt"
+    ]
+    presences = [row for kind, row in events if kind == "presence"]
+
+    if has_postgres():
+        try:
+            pg = get_pg_db()
+            if pg is None:
+                return False
+
+            staged = {}
+            cur_pg = pg.cursor()
+            _insert_messages(cur_pg, messages, pg=True, staged=staged)
+            _update_message_statuses(cur_pg, receipts, pg=True)
+            _update_contact_presences(cur_pg, presences, pg=True)
+            _log_events(cur_pg, events, pg=True)
+
+            pg.commit()
+            pg.close()
+            _cache_staged(staged)
+            return True
+        except Exception as e:
+            print("Postgres apply_events failed:", e)
+        return False
+
+    staged = {}
+    db = get_db()
+    cur = db.cursor()
+
+    _insert_messages(cur, messages, pg=False, staged=staged)
+    _update_message_statuses(cur, receipts, pg=False)
+    _update_contact_presences(cur, presences, pg=False)
+    _log_events(cur, events, pg=False)
 
     db.commit()
     db.close()
+    _cache_staged(staged)
+    return True
 
 
-def insert_media_message(
-    message_id: str,
-    jid: str,
-    direction: str,
-    message_type: str,
-    content: str | None,
-    media_path: str,
-    timestamp: int,
-    status: str = "delivered",
+# ============================================================
+# BULK IMPORT
+# ============================================================
+
+def _select_contact_ids(cur, jids: list[str], pg: bool) -> dict:
+    if pg:
+        cur.execute("SELECT jid, id FROM contacts WHERE jid = ANY(%s)", (jids,))
+        return dict(cur.fetchall())
+
+    ids = {}
+    for i in range(0, len(jids), 900):
+        chunk = jids[i:i + 900]
+        cur.execute(
+            f"SELECT jid, id FROM contacts WHERE jid IN ({', '.join('?' for _ in chunk)})",
+            chunk,
+        )
+        ids.update(cur.fetchall())
+    return ids
+
+
+def _resolve_contacts_bulk(cur, contacts: dict, pg: bool) -> dict:
+    """Map each jid to its contact id, creating the missing contacts.
+
+    ``contacts`` maps jid to ``(phone, name)``. Existing contacts are left
+    as they are: historical rows must not overwrite what live traffic stored.
+    """
+    ids = {}
+    missing = []
+    for jid in contacts:
+        cached = contact_cache.get(jid)
+        if cached is not None:
+            ids[jid] = cached[0]
+        else:
+            missing.append(jid)
+
+    if missing:
+        ids.update(_select_contact_ids(cur, missing, pg))
+
+    new = [jid for jid in missing if jid not in ids]
+    if new:
+        values = [
+            (jid, contacts[jid][0] or extract_phone_from_jid(jid), contacts[jid][1])
+            for jid in new
+        ]
+        if pg:
+            execute_values(
+                cur,
+                "INSERT INTO contacts (jid, phone, name) VALUES %s "
+                "ON CONFLICT (jid) DO NOTHING",
+                values,
+            )
+        else:
+            cur.executemany(
+                "INSERT OR IGNORE INTO contacts (jid, phone, name) VALUES (?, ?, ?)",
+                values,
+            )
+        ids.update(_select_contact_ids(cur, new, pg))
+
+    return ids
+
+
+@timed
+def import_message_batch(rows: list[dict]) -> int:
+    """Store one batch of validated import rows in a single transaction.
+
+    Messages whose message_id is already stored are skipped; returns the
+    number of rows inserted. Errors propagate.
+    """
+    created_at_ms = int(time.time() * 1000)
+    created_at_str = format_timestamp(created_at_ms)
+
+    def run(cur, pg):
+        contacts = {}
+        for row in rows:
+            contacts.setdefault(row["jid"], (row.get("phone"), row.get("name")))
+        contact_ids = _resolve_contacts_bulk(cur, contacts, pg)
+
+        values = (
+            (
+                row["message_id"],
+                contact_ids.get(row["jid"]),
+                row["direction"],
+                row["message_type"],
+                row.get("content"),
+                row.get("media_path"),
+                row["timestamp"],
+                row["status"],
+                created_at_ms,
+                format_timestamp(row["timestamp"]),
+                created_at_str,
+            )
+            for row in rows
+        )
+
+        if pg:
+            return copy_messages_pg(cur, values)
+        cur.executemany(
+            f"INSERT OR IGNORE INTO messages ({MESSAGE_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            values,
+        )
+        return cur.rowcount
+
+    return _write(run)
+
+
+# ============================================================
+# READS
+# ============================================================
+
+HISTORY_MAX_LIMIT = 500
+
+
+def _fetch_rows(sql: str, params: list) -> list[dict]:
+    """Run a read query written with {ph} placeholders on the active engine"""
+    if has_postgres():
+        conn = get_pg_db()
+        ph = "%s"
+    else:
+        conn = get_db()
+        ph = "?"
+
+    try:
+        cur = conn.cursor()
+        cur.execute(sql.format(ph=ph), params)
+        columns = [col[0] for col in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+PRESENCE_COLUMNS = "jid, phone, name, is_online, last_seen_at"
+
+
+def _presence_row(row: dict) -> dict:
+    return {**row, "is_online": bool(row["is_online"])}
+
+
+def fetch_online_presences(max_age_seconds: float) -> list[dict]:
+    """Contacts stored as online whose presence is newer than ``max_age_seconds``"""
+    since = int((time.time() - max_age_seconds) * 1000)
+    # A literal, so the query matches the partial idx_contacts_online.
+    online = "TRUE" if has_postgres() else "1"
+    rows = _fetch_rows(
+        f"SELECT {PRESENCE_COLUMNS} FROM contacts "
+        f"WHERE is_online = {online} AND last_seen_at >= {{ph}}",
+        [since],
+    )
+    return [_presence_row(row) for row in rows]
+
+
+def fetch_presence(jid: str, max_age_seconds: float) -> dict | None:
+    """A contact's stored presence if it is newer than ``max_age_seconds``"""
+    since = int((time.time() - max_age_seconds) * 1000)
+    rows = _fetch_rows(
+        f"SELECT {PRESENCE_COLUMNS} FROM contacts "
+        "WHERE jid = {ph} AND is_online IS NOT NULL AND last_seen_at >= {ph}",
+        [jid, since],
+    )
+    return _presence_row(rows[0]) if rows else None
+
+
+def fetch_event_log(after_id: int, limit: int) -> list[dict]:
+    """event_log rows after ``after_id``, oldest first"""
+    return _fetch_rows(
+        "SELECT id, kind, jid, phone, data FROM event_log WHERE id > {ph} ORDER BY id LIMIT {ph}",
+        [after_id, limit],
+    )
+
+
+def fetch_recent_event_log(limit: int) -> list[dict]:
+    """The newest ``limit`` event_log rows, oldest first"""
+    rows = _fetch_rows(
+        "SELECT id, kind, jid, phone, data FROM event_log ORDER BY id DESC LIMIT {ph}",
+        [limit],
+    )
+    rows.reverse()
+    return rows
+
+
+def trim_event_log(keep: int):
+    """Delete all but the newest ``keep`` event_log rows"""
+    def run(cur, pg):
+        ph = "%s" if pg else "?"
+        cur.execute(
+            f"DELETE FROM event_log WHERE id <= (SELECT MAX(id) FROM event_log) - {ph}",
+            (keep,),
+        )
+
+    _write(run)
+
+
+def encode_cursor(timestamp: int, row_id: int) -> str:
+    return f"{timestamp}:{row_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        timestamp, row_id = cursor.split(":", 1)
+        return int(timestamp), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def fetch_message_history(
+    jid: str | None = None,
     phone: str | None = None,
-):
-    insert_message(
-        message_id=message_id,
-        jid=jid,
-        direction=direction,
-        message_type=message_type,
-        content=content,
-        media_path=media_path,
-        timestamp=timestamp,
-        status=status,
-        phone=phone,
-        name=None,
+    contact_id: int | None = None,
+    direction: str | None = None,
+    message_type: str | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+) -> dict:
+    """Newest-first page of stored messages using (timestamp, id) keyset pagination.
+
+    ``cursor`` is the ``next_cursor`` of the previous page. The contacts
+    behind ``jid`` / ``phone`` are looked up first and each is read with
+    ``m.contact_id = ?``, so every page is a range scan on the
+    (contact_id, COALESCE(timestamp, 0), id) / (COALESCE(timestamp, 0), id)
+    indexes and its cost does not grow with the page number or the size of
+    the conversation. Messages without a timestamp sort as 0, after every
+    dated one.
+    """
+    limit = max(1, min(int(limit), HISTORY_MAX_LIMIT))
+    where = []
+    params = []
+
+    contact_ids = None
+    if contact_id is not None:
+        contact_ids = {contact_id}
+    if jid:
+        found = {row["id"] for row in _fetch_rows("SELECT id FROM contacts WHERE jid = {ph}", [jid])}
+        contact_ids = found if contact_ids is None else contact_ids & found
+    if phone:
+        found = {row["id"] for row in _fetch_rows("SELECT id FROM contacts WHERE phone = {ph}", [phone])}
+        contact_ids = found if contact_ids is None else contact_ids & found
+    if contact_ids is not None and not contact_ids:
+        return {"messages": [], "next_cursor": None}
+
+    if direction:
+        where.append("m.direction = {ph}")
+        params.append(direction)
+    if message_type:
+        where.append("m.message_type = {ph}")
+        params.append(message_type)
+    if since is not None:
+        where.append("COALESCE(m.timestamp, 0) >= {ph}")
+        params.append(since)
+    if until is not None:
+        where.append("COALESCE(m.timestamp, 0) < {ph}")
+        params.append(until)
+    if cursor:
+        where.append("(COALESCE(m.timestamp, 0), m.id) < ({ph}, {ph})")
+        params.extend(decode_cursor(cursor))
+
+    sql = """
+        SELECT
+            m.id, m.message_id, m.contact_id,
+            c.jid, c.phone, c.name,
+            m.direction, m.message_type, m.content, m.media_path,
+            m.timestamp, m.timestamp_str, m.status
+        FROM messages m
+        LEFT JOIN contacts c ON c.id = m.contact_id
+    """
+
+    def page(extra: list[str], extra_params: list) -> list[dict]:
+        conditions = extra + where
+        query = sql
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY COALESCE(m.timestamp, 0) DESC, m.id DESC LIMIT {ph}"
+        return _fetch_rows(query, [*extra_params, *params, limit + 1])
+
+    if contact_ids is None:
+        rows = page([], [])
+    else:
+        # A phone can map to several contacts (@lid and phone-number jids);
+        # each is read through the index and the pages are merged.
+        rows = []
+        for cid in sorted(contact_ids):
+            rows.extend(page(["m.contact_id = {ph}"], [cid]))
+        if len(contact_ids) > 1:
+            rows.sort(key=lambda row: (row["timestamp"] or 0, row["id"]), reverse=True)
+            rows = rows[:limit + 1]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["timestamp"] or 0, last["id"])
+
+    return {"messages": rows, "next_cursor": next_cursor}
+
+
+SEARCH_MAX_LIMIT = 100
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+SNIPPET_TOKENS = 16
+
+_SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+_WORDS = re.compile(r"\w+")
+
+
+def parse_search_query(q: str) -> list[tuple[str | None, list[str], bool]]:
+    """Split free text into ``(operator, words, prefix)`` terms.
+
+    Words and "quoted phrases" are all required, ``OR`` between two terms
+    makes either enough, ``-word`` excludes and a trailing ``*`` matches a
+    prefix. The operator joins a term to the previous one (None = AND).
+    """
+    terms = []
+    pending = None
+
+    for phrase, word in _SEARCH_TERM.findall(q):
+        if not phrase and word == "OR":
+            if terms:
+                pending = "OR"
+            continue
+
+        text = phrase if phrase else word
+        negate = not phrase and text.startswith("-")
+        prefix = not phrase and text.endswith("*")
+        words = _WORDS.findall(text)
+        if not words:
+            continue
+
+        if negate:
+            # Both engines express exclusion relative to a previous term.
+            if not terms:
+                continue
+            pending = "NOT"
+
+        terms.append((pending if terms else None, words, prefix))
+        pending = None
+
+    return terms
+
+
+def fts5_query(q: str) -> str:
+    parts = []
+    for op, words, prefix in parse_search_query(q):
+        if op:
+            parts.append(op)
+        parts.append('"' + " ".join(words) + '"' + ("*" if prefix else ""))
+    return " ".join(parts)
+
+
+def pg_tsquery(q: str) -> str:
+    """Same grammar as fts5_query, rendered for to_tsquery()"""
+    parts = []
+    for op, words, prefix in parse_search_query(q):
+        lexemes = [f"'{w}'" for w in words]
+        if prefix:
+            lexemes[-1] += ":*"
+        term = " <-> ".join(lexemes)
+        if parts:
+            parts.append({"OR": "|", "NOT": "& !"}.get(op, "&"))
+        parts.append(f"({term})")
+    return " ".join(parts)
+
+
+def _decode_search_cursor(cursor: str, sort: str) -> tuple[float | int, int]:
+    try:
+        value, row_id = cursor.rsplit(":", 1)
+        return (float(value) if sort == "rank" else int(value)), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def search_messages(
+    q: str,
+    jid: str | None = None,
+    phone: str | None = None,
+    direction: str | None = None,
+    message_type: str | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    sort: str = "rank",
+    cursor: str | None = None,
+    limit: int = 20,
+) -> dict:
+    """Full-text search over messages.content with keyset pagination.
+
+    ``sort="rank"`` orders by relevance (bm25 on SQLite, ts_rank_cd on
+    Postgres), ``sort="recent"`` newest first. Only the rows of the
+    returned page get a highlighted snippet.
+    """
+    if sort not in ("rank", "recent"):
+        raise ValueError("sort must be 'rank' or 'recent'")
+
+    limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+    pg = has_postgres()
+
+    if not pg and not sqlite_fts_available():
+        raise RuntimeError("Full-text search is not available on this SQLite build")
+
+    if not parse_search_query(q):
+        return {"results": [], "next_cursor": None}
+
+    if pg:
+        match_query = pg_tsquery(q)
+        match_sql = "m.content_tsv @@ q.query"
+        score_sql = "(-ts_rank_cd(m.content_tsv, q.query))::float8"
+        from_sql = (
+            "messages m CROSS JOIN to_tsquery("
+            f"'{SEARCH_LANGUAGE}'::regconfig, {{ph}}) AS q(query)"
+        )
+        params = [match_query]
+    else:
+        match_query = fts5_query(q)
+        match_sql = "messages_fts MATCH {ph}"
+        score_sql = "bm25(messages_fts)"
+        from_sql = "messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+        params = []
+
+    where = [match_sql]
+    if not pg:
+        params.append(match_query)
+
+    if jid:
+        where.append("m.contact_id IN (SELECT id FROM contacts WHERE jid = {ph})")
+        params.append(jid)
+    if phone:
+        where.append("m.contact_id IN (SELECT id FROM contacts WHERE phone = {ph})")
+        params.append(phone)
+    if direction:
+        where.append("m.direction = {ph}")
+        params.append(direction)
+    if message_type:
+        where.append("m.message_type = {ph}")
+        params.append(message_type)
+    if since is not None:
+        where.append("m.timestamp >= {ph}")
+        params.append(since)
+    if until is not None:
+        where.append("m.timestamp < {ph}")
+        params.append(until)
+
+    # score is "lower is better" on both engines so one keyset works for both.
+    sql = f"""
+        SELECT * FROM (
+            SELECT
+                m.id, m.message_id, m.contact_id,
+                c.jid, c.phone, c.name,
+                m.direction, m.message_type, m.content, m.media_path,
+                m.timestamp, m.timestamp_str, m.status,
+                {score_sql} AS score
+            FROM {from_sql}
+            LEFT JOIN contacts c ON c.id = m.contact_id
+            WHERE {" AND ".join(where)}
+        ) hits
+    """
+
+    if sort == "rank":
+        if cursor:
+            sql += " WHERE (score, id) > ({ph}, {ph})"
+            params.extend(_decode_search_cursor(cursor, sort))
+        sql += " ORDER BY score, id LIMIT {ph}"
+    else:
+        if cursor:
+            sql += " WHERE (timestamp, id) < ({ph}, {ph})"
+            params.extend(_decode_search_cursor(cursor, sort))
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT {ph}"
+    params.append(limit + 1)
+
+    rows = _fetch_rows(sql, params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        key = repr(last["score"]) if sort == "rank" else last["timestamp"]
+        next_cursor = f"{key}:{last['id']}"
+
+    snippets = _search_snippets(match_query, [row["id"] for row in rows], pg)
+    for row in rows:
+        row["rank"] = -row.pop("score")
+        row["snippet"] = snippets.get(row["id"])
+
+    return {"results": rows, "next_cursor": next_cursor}
+
+
+def _search_snippets(match_query: str, ids: list[int], pg: bool) -> dict:
+    if not ids:
+        return {}
+
+    if pg:
+        options = (
+            f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, "
+            f"MaxWords={SNIPPET_TOKENS}, MinWords=5, MaxFragments=2"
+        )
+        rows = _fetch_rows(
+            f"""
+            SELECT id, ts_headline(
+                '{SEARCH_LANGUAGE}'::regconfig, coalesce(content, ''),
+                to_tsquery('{SEARCH_LANGUAGE}'::regconfig, {{ph}}), {{ph}}
+            ) AS snippet
+            FROM messages WHERE id = ANY({{ph}})
+            """,
+            [match_query, options, ids],
+        )
+    else:
+        rows = _fetch_rows(
+            f"""
+            SELECT rowid AS id,
+                   snippet(messages_fts, 0, {{ph}}, {{ph}}, '…', {SNIPPET_TOKENS}) AS snippet
+            FROM messages_fts
+            WHERE messages_fts MATCH {{ph}} AND rowid IN ({", ".join("{ph}" for _ in ids)})
+            """,
+            [SNIPPET_START, SNIPPET_END, match_query, *ids],
+        )
+
+    return {row["id"]: row["snippet"] for row in rows}
+
+
+def warm_contact_cache(limit: int | None = None) -> int:
+    """Pre-load the most recently created contacts into the contact cache"""
+    if limit is None:
+        limit = contact_cache.max_size
+    if limit <= 0:
+        return 0
+
+    rows = _fetch_rows(
+        "SELECT jid, id, phone, name FROM contacts ORDER BY id DESC LIMIT {ph}",
+        [limit],
+    )
+
+    # Oldest first so the newest contacts end up most recently used.
+    for row in reversed(rows):
+        contact_cache.put(row["jid"], row["id"], row["phone"], row["name"])
+
+    return len(rows)
+
+
+# ============================================================
+# INBOX
+# ============================================================
+
+INBOX_MAX_LIMIT = 200
+
+INBOX_SELECT = """
+    SELECT
+        cv.contact_id, c.jid, c.phone, c.name,
+        cv.last_message_id, cv.last_direction, cv.last_message_type,
+        cv.last_preview, cv.last_status, cv.last_timestamp,
+        cv.unread_count, cv.incoming_count, cv.outgoing_count
+    FROM conversations cv
+    JOIN contacts c ON c.id = cv.contact_id
+"""
+
+
+def _contact_filter(jid: str | None, phone: str | None) -> tuple[str, list]:
+    if jid:
+        return "c.jid = {ph}", [jid]
+    if phone:
+        return "c.phone = {ph}", [phone]
+    raise ValueError("jid or phone is required")
+
+
+def _conversation_row(row: dict) -> dict:
+    row["type"] = "group" if (row.get("jid") or "").endswith("@g.us") else "user"
+    return row
+
+
+def fetch_inbox(unread_only: bool = False, cursor: str | None = None, limit: int = 50) -> dict:
+    """Conversations, most recent message first, from the conversations table.
+
+    Keyset-paginated on (last_timestamp, contact_id), which is indexed, so a
+    page costs the same whatever the number of stored messages.
+    """
+    limit = max(1, min(int(limit), INBOX_MAX_LIMIT))
+    where = []
+    params = []
+
+    if unread_only:
+        where.append("cv.unread_count > 0")
+    if cursor:
+        where.append("(cv.last_timestamp, cv.contact_id) < ({ph}, {ph})")
+        params.extend(decode_cursor(cursor))
+
+    sql = INBOX_SELECT
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY cv.last_timestamp DESC, cv.contact_id DESC LIMIT {ph}"
+    params.append(limit + 1)
+
+    rows = [_conversation_row(row) for row in _fetch_rows(sql, params)]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["last_timestamp"], last["contact_id"])
+
+    return {"conversations": rows, "next_cursor": next_cursor}
+
+
+def fetch_conversation(jid: str | None = None, phone: str | None = None) -> dict | None:
+    """The conversation summary of one contact, or None"""
+    condition, params = _contact_filter(jid, phone)
+    rows = _fetch_rows(
+        INBOX_SELECT + f" WHERE {condition} ORDER BY cv.last_timestamp DESC LIMIT 1",
+        params,
     )
+    return _conversation_row(rows[0]) if rows else None
+
+
+@timed
+def mark_conversation_read(jid: str | None = None, phone: str | None = None) -> int:
+    """Mark a contact's incoming messages as read; returns the messages updated.
+
+    The conversations triggers bring unread_count down in the same transaction.
+    """
+    condition, params = _contact_filter(jid, phone)
+
+    def run(cur, pg):
+        ph = "%s" if pg else "?"
+        cur.execute(
+            f"""
+            UPDATE messages SET status = 'read'
+            WHERE contact_id IN (SELECT c.id FROM contacts c WHERE {condition.format(ph=ph)})
+              AND direction = 'in'
+              AND (status IS NULL OR status <> 'read')
+            """,
+            params,
+        )
+        return cur.rowcount
+
+    return _write(run)
+
+
+# ============================================================
+# WHATSAPP LOOKUPS
+# ============================================================
+
+def _lookup_row(row: dict) -> dict:
+    return {
+        "phone": row["phone"],
+        "jid": row["jid"],
+        "exists": bool(row["on_whatsapp"]),
+        "isBusiness": None if row["is_business"] is None else bool(row["is_business"]),
+        "checked_at": row["checked_at"],
+    }
+
+
+def fetch_whatsapp_lookups(phones: list[str], since_ms: int) -> dict:
+    """Stored onWhatsApp answers for ``phones`` checked since ``since_ms``, by phone"""
+    found = {}
+    for i in range(0, len(phones), 900):
+        chunk = phones[i:i + 900]
+        rows = _fetch_rows(
+            "SELECT phone, jid, on_whatsapp, is_business, checked_at FROM whatsapp_lookups "
+            "WHERE checked_at >= {ph} AND phone IN (" + ", ".join("{ph}" for _ in chunk) + ")",
+            [since_ms, *chunk],
+        )
+        found.update((row["phone"], _lookup_row(row)) for row in rows)
+    return found
+
+
+SAVE_LOOKUPS = """
+    INSERT INTO whatsapp_lookups (phone, jid, on_whatsapp, is_business, checked_at)
+    VALUES {values}
+    ON CONFLICT (phone) DO UPDATE SET
+        jid = excluded.jid,
+        on_whatsapp = excluded.on_whatsapp,
+        is_business = excluded.is_business,
+        checked_at = excluded.checked_at
+"""
+
+
+@timed
+def save_whatsapp_lookups(results: list[dict]) -> int:
+    """Store onWhatsApp answers (phone, jid, exists, isBusiness) under the phone that was asked.
+
+    Negative answers are remembered too; contacts are left alone. Returns the
+    lookups written.
+    """
+    checked_at = int(time.time() * 1000)
+    by_phone = {
+        result["phone"]: (
+            result["phone"],
+            result.get("jid"),
+            bool(result.get("exists")),
+            result.get("isBusiness"),
+            checked_at,
+        )
+        for result in results
+        if result.get("phone")
+    }
+    if not by_phone:
+        return 0
+
+    def run(cur, pg):
+        if pg:
+            execute_values(cur, SAVE_LOOKUPS.format(values="%s"), list(by_phone.values()))
+        else:
+            cur.executemany(SAVE_LOOKUPS.format(values="(?, ?, ?, ?, ?)"), list(by_phone.values()))
+        return len(by_phone)
+
+    return _write(run)
+
+
+# ============================================================
+# OUTBOX
+# ============================================================
+
+def _write(fn):
+    """Run ``fn(cur, pg)`` in one transaction on the active engine; errors propagate"""
+    pg = has_postgres()
+    conn = get_pg_db() if pg else get_db()
+    try:
+        result = fn(conn.cursor(), pg)
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+
+@timed
+def enqueue_outbox(message: dict, kind: str, payload: dict):
+    """Store the outgoing message as "queued" together with its outbox row"""
+    now = int(time.time() * 1000)
+
+    staged = {}
+
+    def run(cur, pg):
+        ph = "%s" if pg else "?"
+        _insert_messages(cur, [{**message, "status": "queued"}], pg=pg, staged=staged)
+        cur.execute(
+            f"""
+            INSERT INTO outbox (
+                message_id, recipient, kind, payload, status, attempts,
+                next_attempt_at, created_at, updated_at, created_at_str
+            )
+            VALUES ({ph}, {ph}, {ph}, {ph}, 'pending', 0, {ph}, {ph}, {ph}, {ph})
+            """,
+            (
+                message["message_id"],
+                message["jid"],
+                kind,
+                json.dumps(payload),
+                now,
+                now,
+                now,
+                format_timestamp(now),
+            ),
+        )
+
+    _write(run)
+    _cache_staged(staged)
+
+
+@timed
+def claim_outbox(limit: int, lease_ms: int) -> list[dict]:
+    """Lease up to ``limit`` due rows to the caller.
+
+    Claimed rows move to "sending" with ``next_attempt_at`` pushed out by the
+    lease, so rows of a worker that died mid-send become due again once the
+    lease runs out. On Postgres, SKIP LOCKED lets concurrent workers claim
+    disjoint rows.
+
+    Only the oldest undelivered row of each recipient is claimable, so a
+    recipient's messages go out one at a time and in order, retries included.
+    """
+    now = int(time.time() * 1000)
+
+    def run(cur, pg):
+        ph = "%s" if pg else "?"
+        skip_locked = "FOR UPDATE SKIP LOCKED" if pg else ""
+        cur.execute(
+            f"""
+            UPDATE outbox
+            SET status = 'sending',
+                attempts = attempts + 1,
+                next_attempt_at = {ph},
+                updated_at = {ph}
+            WHERE id IN (
+                SELECT id FROM outbox o
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= {ph}
+                  AND NOT EXISTS (
+                      SELECT 1 FROM outbox older
+                      WHERE older.recipient = o.recipient
+                        AND older.id < o.id
+                        AND older.status IN ('pending', 'sending')
+                  )
+                ORDER BY next_attempt_at
+                LIMIT {ph}
+                {skip_locked}
+            )
+            RETURNING id, message_id, kind, payload, attempts
+            """,
+            (now + lease_ms, now, now, limit),
+        )
+        return [
+            {
+                "id": row[0],
+                "message_id": row[1],
+                "kind": row[2],
+                "payload": json.loads(row[3]),
+                "attempts": row[4],
+            }
+            for row in cur.fetchall()
+        ]
+
+    return _write(run)
+
+
+def _finish_outbox(row: dict, outbox_status: str, message_status: str | None, error: str | None, next_attempt_at: int | None):
+    now = int(time.time() * 1000)
+
+    def run(cur, pg):
+        ph = "%s" if pg else "?"
+        cur.execute(
+            f"""
+            UPDATE outbox
+            SET status = {ph}, last_error = {ph}, next_attempt_at = {ph}, updated_at = {ph}
+            WHERE id = {ph}
+            """,
+            (outbox_status, error, next_attempt_at, now, row["id"]),
+        )
+        if message_status is not None:
+            cur.execute(
+                f"UPDATE messages SET status = {ph} WHERE message_id = {ph}",
+                (message_status, row["message_id"]),
+            )
+
+    _write(run)
+
+
+@timed
+def complete_outbox(row: dict):
+    _finish_outbox(row, "sent", "sent", None, None)
+
+
+@timed
+def retry_outbox(row: dict, error: str, next_attempt_at: int):
+    _finish_outbox(row, "pending", None, error, next_attempt_at)
+
+
+@timed
+def dead_letter_outbox(row: dict, error: str):
+    _finish_outbox(row, "dead", "failed", error, None)
+
+
+@timed
+def requeue_outbox(message_id: str) -> bool:
+    """Move a dead-lettered message back to pending with a fresh attempt budget"""
+    now = int(time.time() * 1000)
+
+    def run(cur, pg):
+        ph = "%s" if pg else "?"
+        cur.execute(
+            f"""
+            UPDATE outbox
+            SET status = 'pending', attempts = 0, next_attempt_at = {ph}, updated_at = {ph}
+            WHERE message_id = {ph} AND status = 'dead'
+            """,
+            (now, now, message_id),
+        )
+        if cur.rowcount == 0:
+            return False
+        cur.execute(
+            f"UPDATE messages SET status = 'queued' WHERE message_id = {ph}",
+            (message_id,),
+        )
+        return True
+
+    return _write(run)
+
+
+def fetch_outbox_entry(message_id: str) -> dict | None:
+    rows = _fetch_rows(
+        """
+        SELECT message_id, kind, payload, status, attempts,
+               next_attempt_at, last_error, created_at, updated_at
+        FROM outbox WHERE message_id = {ph}
+        """,
+        [message_id],
+    )
+    if not rows:
+        return None
+    row = rows[0]
+    row["payload"] = json.loads(row["payload"])
+    return row
+
+
+def outbox_counts() -> dict:
+    rows = _fetch_rows("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status", [])
+    return {row["status"]: row["n"] for row in rows}
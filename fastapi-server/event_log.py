@@ -0,0 +1,160 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from db import config
+from metrics import registry, Counter
+
+LOG_LEVEL = str(config.get("log_level", "INFO")).upper()
+LOG_EVENT_LEVELS = {
+    "message": "INFO",
+    "media": "INFO",
+    "receipt": "INFO",
+    "presence": "INFO",
+    **config.get("log_event_levels", {}),
+}
+LOG_SAMPLE_RATES = {
+    "receipt": 0.1,
+    "presence": 0.01,
+    **config.get("log_sample_rates", {}),
+}
+# "redact" replaces message text with its length, "truncate" keeps the first
+# log_max_field_chars characters, "full" logs it as received.
+LOG_BODY_MODE = config.get("log_body_mode", "redact")
+LOG_MAX_FIELD_CHARS = int(config.get("log_max_field_chars", 200))
+LOG_QUEUE_SIZE = int(config.get("log_queue_size", 10000))
+
+BODY_FIELDS = ("message", "text", "body", "caption")
+MAX_ITEMS = 20
+MAX_DEPTH = 4
+
+LOG_RECORDS_DROPPED = registry.register(Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+))
+
+logger = logging.getLogger("bridge.events")
+logger.propagate = False
+
+_listener = None
+
+
+def _truncate(value: str) -> str:
+    if len(value) <= LOG_MAX_FIELD_CHARS:
+        return value
+    return value[:LOG_MAX_FIELD_CHARS] + f"...(+{len(value) - LOG_MAX_FIELD_CHARS})"
+
+
+def sanitize(value, depth: int = 0, key: str | None = None):
+    """Bound the size of a payload before it is written to the log"""
+    if key in BODY_FIELDS and isinstance(value, str):
+        if LOG_BODY_MODE == "redact":
+            return f"<redacted {len(value)} chars>"
+        if LOG_BODY_MODE == "full":
+            return value
+        return _truncate(value)
+
+    if isinstance(value, str):
+        return _truncate(value)
+    if depth >= MAX_DEPTH and isinstance(value, (dict, list, tuple)):
+        return "<nested>"
+    if isinstance(value, dict):
+        items = list(value.items())
+        result = {str(k): sanitize(v, depth + 1, str(k)) for k, v in items[:MAX_ITEMS]}
+        if len(items) > MAX_ITEMS:
+            result["..."] = f"+{len(items) - MAX_ITEMS} keys"
+        return result
+    if isinstance(value, (list, tuple)):
+        result = [sanitize(v, depth + 1) for v in value[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            result.append(f"+{len(value) - MAX_ITEMS} items")
+        return result
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return _truncate(repr(value))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the listener thread, not the request"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("event", "sample_rate"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        for key, value in getattr(record, "fields", {}).items():
+            entry[key] = sanitize(value, key=key)
+        if getattr(record, "payload", None) is not None:
+            entry["payload"] = sanitize(record.payload)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens in the listener; only freeze the message here.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def start_logging():
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE))
+    logger.handlers = [DroppingQueueHandler(log_queue)]
+    logger.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(event_type: str, msg: str, payload: dict | None = None, **fields):
+    """Log a webhook event at its configured level and sample rate.
+
+    The payload is only referenced here; redaction, truncation and JSON
+    encoding happen on the listener thread.
+    """
+    level = logging.getLevelName(LOG_EVENT_LEVELS.get(event_type, "INFO"))
+    if not isinstance(level, int) or not logger.isEnabledFor(level):
+        return
+
+    rate = float(LOG_SAMPLE_RATES.get(event_type, 1.0))
+    if rate < 1.0 and random.random() >= rate:
+        return
+
+    extra = {"event": event_type, "payload": payload, "fields": fields}
+    if rate < 1.0:
+        extra["sample_rate"] = rate
+    logger.log(level, msg, extra=extra)
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from db import config
+from db_ops import fetch_event_log, fetch_recent_event_log, trim_event_log
+from metrics import registry, Counter, CallbackMetric
+
+# Events kept for clients resuming with Last-Event-ID.
+EVENT_STREAM_HISTORY = int(config.get("event_stream_history", 2000))
+# Events buffered per client; a slow client loses its oldest events first.
+EVENT_STREAM_CLIENT_BUFFER = int(config.get("event_stream_client_buffer", 500))
+EVENT_STREAM_KEEPALIVE_SECONDS = float(config.get("event_stream_keepalive_seconds", 15))
+# How often each worker reads new rows from event_log.
+EVENT_STREAM_POLL_MS = int(config.get("event_stream_poll_ms", 250))
+# event_log keeps the last event_stream_history rows; older ones are
+# deleted this often.
+EVENT_LOG_TRIM_SECONDS = float(config.get("event_log_trim_seconds", 60))
+EVENT_LOG_BATCH = 1000
+
+EVENT_TYPES = ("message", "receipt", "presence")
+
+EVENTS_PUBLISHED = registry.register(Counter(
+    "event_stream_events_published_total",
+    "Stored webhook events published to /events subscribers",
+    ("type",),
+))
+EVENTS_DROPPED = registry.register(Counter(
+    "event_stream_events_dropped_total",
+    "Events dropped from the buffer of a slow /events subscriber",
+))
+
+
+def parse_filter(value: str | None, allowed: tuple | None = None) -> frozenset:
+    """Comma-separated query parameter -> set; empty means no filter"""
+    items = frozenset(item.strip() for item in (value or "").split(",") if item.strip())
+    if allowed is not None and not items <= set(allowed):
+        raise ValueError(f"type must be among {', '.join(allowed)}")
+    return items
+
+
+def format_sse(event: dict) -> str:
+    data = json.dumps(event["data"], ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+class Subscription:
+    """One /events client: its filters and a bounded drop-oldest buffer.
+
+    ``push`` runs on the hub's tailer thread; the client's coroutine waits
+    on ``wait`` in the event loop.
+    """
+
+    def __init__(self, loop, jids: frozenset, types: frozenset, buffer_size: int):
+        self.jids = jids
+        self.types = types
+        # Events up to this id were already sent, possibly by another worker
+        # whose tailer was ahead of this one.
+        self.after = 0
+        self.dropped = 0
+        # Set when the requested Last-Event-ID is no longer in the history.
+        self.reset = False
+        self._events = deque(maxlen=max(1, buffer_size))
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def matches(self, event: dict) -> bool:
+        if event["seq"] <= self.after:
+            return False
+        if self.types and event["type"] not in self.types:
+            return False
+        if self.jids and event["jid"] not in self.jids and event["phone"] not in self.jids:
+            return False
+        return True
+
+    def push(self, events: list[dict]):
+        with self._lock:
+            for event in events:
+                if len(self._events) == self._events.maxlen:
+                    self.dropped += 1
+                    EVENTS_DROPPED.inc()
+                self._events.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # loop closed during shutdown
+
+    def drain(self) -> tuple[list[dict], int, bool]:
+        """Buffered events, plus how many were dropped and whether history was lost"""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            dropped, self.dropped = self.dropped, 0
+            reset, self.reset = self.reset, False
+            self._ready.clear()
+        return events, dropped, reset
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class EventHub:
+    """Fan-out of stored webhook events to the /events subscribers of a process.
+
+    apply_events appends every event to the event_log table in the same
+    transaction, and each worker tails that table, so every worker sees the
+    events stored by all of them. Event ids are event_log ids, which lets a
+    client resume on any worker.
+    """
+
+    def __init__(self, history: int, buffer_size: int, poll_ms: int,
+                 name: str = "event-log-tailer"):
+        self.buffer_size = buffer_size
+        self.history_size = max(1, history)
+        self.interval = max(1, poll_ms) / 1000.0
+        self.name = name
+        self._last_id = 0
+        self._loaded = False
+        self._history = deque(maxlen=self.history_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.published = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Load the recent history, then tail event_log in the background"""
+        if self.running:
+            return
+        try:
+            self._load()
+        except Exception as e:
+            print("Event log load failed:", e)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _load(self):
+        rows = fetch_recent_event_log(self.history_size)
+        with self._lock:
+            self._history.extend(_event_from_row(row) for row in rows)
+            if rows:
+                self._last_id = max(self._last_id, rows[-1]["id"])
+            self._loaded = True
+
+    def poll(self) -> int:
+        """Publish the event_log rows stored since the last poll"""
+        if not self._loaded:
+            self._load()
+        total = 0
+        while True:
+            rows = fetch_event_log(self._last_id, EVENT_LOG_BATCH)
+            self.publish(rows)
+            total += len(rows)
+            if len(rows) < EVENT_LOG_BATCH:
+                return total
+
+    def _run(self):
+        next_trim = time.monotonic() + EVENT_LOG_TRIM_SECONDS
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+                if time.monotonic() >= next_trim:
+                    next_trim = time.monotonic() + EVENT_LOG_TRIM_SECONDS
+                    trim_event_log(self.history_size)
+            except Exception as e:
+                self.errors += 1
+                print("Event log tail failed:", e)
+
+    def publish(self, rows: list[dict]):
+        """Deliver event_log rows, oldest first, to the matching subscribers"""
+        if not rows:
+            return
+        events = [_event_from_row(row) for row in rows]
+        with self._lock:
+            self._last_id = max(self._last_id, events[-1]["seq"])
+            self._history.extend(events)
+            self.published += len(events)
+            # Delivered under the lock so every client sees ids in order.
+            for subscription in self._subscribers:
+                matching = [event for event in events if subscription.matches(event)]
+                if matching:
+                    subscription.push(matching)
+
+        for event in events:
+            EVENTS_PUBLISHED.inc(type=event["type"])
+
+    def subscribe(self, jids: frozenset = frozenset(), types: frozenset = frozenset(),
+                  last_event_id: str | None = None) -> Subscription:
+        """Register a subscriber, replaying the history after ``last_event_id``"""
+        subscription = Subscription(
+            asyncio.get_running_loop(), jids, types, self.buffer_size
+        )
+        with self._lock:
+            if last_event_id:
+                oldest = self._history[0]["seq"] if self._history else self._last_id + 1
+                if not last_event_id.isdigit() or int(last_event_id) < oldest - 1:
+                    subscription.reset = True
+                    subscription.after = self._last_id
+                else:
+                    subscription.after = int(last_event_id)
+                    missed = [event for event in self._history if subscription.matches(event)]
+                    if missed:
+                        subscription.push(missed)
+            else:
+                subscription.after = self._last_id
+            # Registered under the same lock as the replay, so nothing
+            # published in between is missed or sent twice.
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "last_id": str(self._last_id) if self._last_id else None,
+                "published": self.published,
+                "history": len(self._history),
+                "subscribers": len(self._subscribers),
+                "tail_errors": self.errors,
+            }
+
+
+def _event_from_row(row: dict) -> dict:
+    return {
+        "id": str(row["id"]),
+        "seq": row["id"],
+        "type": row["kind"],
+        "jid": row["jid"],
+        "phone": row["phone"],
+        "data": json.loads(row["data"]),
+    }
+
+
+event_hub = EventHub(EVENT_STREAM_HISTORY, EVENT_STREAM_CLIENT_BUFFER, EVENT_STREAM_POLL_MS)
+
+registry.register(CallbackMetric(
+    "event_stream_subscribers",
+    "Clients connected to /events",
+    (),
+    lambda: {(): event_hub.stats()["subscribers"]},
+))
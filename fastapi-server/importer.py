@@ -0,0 +1,211 @@
+import codecs
+import csv
+import json
+import queue
+import threading
+import time
+from db import config
+from db_ops import import_message_batch
+
+IMPORT_BATCH_ROWS = int(config.get("import_batch_rows", 5000))
+# Request body chunks buffered between the event loop and the import thread.
+IMPORT_QUEUE_CHUNKS = int(config.get("import_queue_chunks", 16))
+IMPORT_MAX_ERRORS = 20
+
+IMPORT_FORMATS = ("ndjson", "csv")
+DEFAULT_STATUS = {"in": "delivered", "out": "sent"}
+
+# Fields larger than the csv module's 128 KiB default are legitimate here
+# (long messages, base64 captions).
+csv.field_size_limit(16 * 1024 * 1024)
+
+
+class ImportAborted(Exception):
+    """The stream could not be read any further; ``result`` has the progress so far"""
+
+    def __init__(self, message: str, result: dict, status_code: int = 400):
+        super().__init__(message)
+        self.result = result
+        self.status_code = status_code
+
+
+def import_format(requested: str | None, content_type: str | None) -> str:
+    """Pick ndjson or csv from the ``format`` parameter or the Content-Type"""
+    if requested:
+        if requested not in IMPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(IMPORT_FORMATS)}")
+        return requested
+    content_type = (content_type or "").lower()
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+        return "ndjson"
+    raise ValueError("Set format=ndjson|csv or a text/csv / application/x-ndjson Content-Type")
+
+
+class ChunkPipe:
+    """Bounded hand-off of body chunks from the event loop to the import thread.
+
+    ``put`` blocks while the importer is behind, so memory stays at
+    ``maxsize`` chunks however large the upload is.
+    """
+
+    def __init__(self, maxsize: int = IMPORT_QUEUE_CHUNKS):
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self.closed = threading.Event()
+
+    def put(self, chunk: bytes | None) -> bool:
+        """Queue a chunk (None marks the end); False once the reader has stopped"""
+        while not self.closed.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+
+def _lines(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _records(lines, fmt: str):
+    """Yield ``(line_no, record_or_error)`` for every row of the stream"""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        if reader.fieldnames is None:
+            return
+        if "message_id" not in reader.fieldnames or "timestamp" not in reader.fieldnames:
+            raise ValueError("CSV header must include message_id and timestamp")
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ValueError(f"invalid JSON: {e.msg}")
+            continue
+        if not isinstance(record, dict):
+            yield line_no, ValueError("each line must be a JSON object")
+            continue
+        yield line_no, record
+
+
+def _text(record: dict, key: str) -> str | None:
+    value = record.get(key)
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def normalize_row(record: dict) -> dict:
+    """Validate one import record and fill in defaults; raises ValueError"""
+    message_id = _text(record, "message_id")
+    if message_id is None:
+        raise ValueError("message_id is required")
+
+    jid = _text(record, "jid")
+    phone = _text(record, "phone")
+    if jid is None:
+        if phone is None:
+            raise ValueError("jid or phone is required")
+        digits = phone.lstrip("+")
+        if not digits.isdigit():
+            raise ValueError(f"invalid phone: {phone!r}")
+        jid = f"{digits}@s.whatsapp.net"
+
+    timestamp = record.get("timestamp")
+    if isinstance(timestamp, bool) or timestamp in (None, ""):
+        raise ValueError("timestamp (milliseconds) is required")
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        raise ValueError(f"timestamp must be an integer in milliseconds, got {timestamp!r}")
+
+    direction = _text(record, "direction") or "in"
+    if direction not in DEFAULT_STATUS:
+        raise ValueError("direction must be 'in' or 'out'")
+
+    media_path = _text(record, "media_path")
+    return {
+        "message_id": message_id,
+        "jid": jid,
+        "phone": phone,
+        "name": _text(record, "name"),
+        "direction": direction,
+        "message_type": _text(record, "message_type") or ("media" if media_path else "text"),
+        "content": _text(record, "content"),
+        "media_path": media_path,
+        "timestamp": timestamp,
+        "status": _text(record, "status") or DEFAULT_STATUS[direction],
+    }
+
+
+def import_stream(chunks, fmt: str, batch_rows: int = IMPORT_BATCH_ROWS) -> dict:
+    """Parse an NDJSON or CSV byte stream and store it batch by batch.
+
+    Only one batch is held in memory. Each batch commits on its own, so a
+    failed import can be re-sent as a whole: rows already stored are skipped
+    by message_id. Bad rows are counted and skipped; unreadable input or a
+    storage failure raises ImportAborted.
+    """
+    started = time.monotonic()
+    result = {"format": fmt, "rows": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "errors": []}
+    batch = []
+
+    def flush():
+        try:
+            inserted = import_message_batch(batch)
+        except Exception as e:
+            raise ImportAborted(f"Storing rows failed: {e}", result, status_code=503)
+        result["inserted"] += inserted
+        result["duplicates"] += len(batch) - inserted
+        batch.clear()
+
+    try:
+        for line_no, record in _records(_lines(chunks), fmt):
+            result["rows"] += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(normalize_row(record))
+            except ValueError as e:
+                result["rejected"] += 1
+                if len(result["errors"]) < IMPORT_MAX_ERRORS:
+                    result["errors"].append({"line": line_no, "error": str(e)})
+                continue
+
+            if len(batch) >= batch_rows:
+                flush()
+
+        if batch:
+            flush()
+    except (UnicodeDecodeError, csv.Error, ValueError) as e:
+        raise ImportAborted(f"Unreadable {fmt} input: {e}", result)
+    finally:
+        if isinstance(chunks, ChunkPipe):
+            chunks.closed.set()
+
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
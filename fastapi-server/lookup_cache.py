@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict
+from db import config
+from metrics import registry, Counter, CallbackMetric
+
+# Seconds a Node lookup result is served from memory, per endpoint.
+LOOKUP_CACHE_TTLS = {
+    "user": 3600,
+    "jid": 3600,
+    "group": 300,
+    "groups": 60,
+    **config.get("lookup_cache_ttls", {}),
+}
+# "Not on WhatsApp" answers are kept for a shorter time.
+LOOKUP_CACHE_NEGATIVE_TTL = float(config.get("lookup_cache_negative_ttl", 300))
+LOOKUP_CACHE_SIZE = int(config.get("lookup_cache_size", 10000))
+# Group entries read during the last part of their TTL are reloaded in the
+# background, so readers keep getting the cached copy.
+LOOKUP_CACHE_REFRESH_AHEAD = float(config.get("lookup_cache_refresh_ahead", 0.2))
+
+LOOKUPS = registry.register(Counter(
+    "lookup_cache_requests_total",
+    "Cached Node lookups by result (hit, miss, coalesced, refresh)",
+    ("cache", "result"),
+))
+
+
+class LookupCache:
+    """TTL cache for Node lookups with single-flight loading.
+
+    Concurrent misses for one key share a single Node call. Failed loads
+    are not cached; every waiter gets the error.
+    """
+
+    def __init__(self, name: str, ttl: float, negative_ttl: float = 0, max_size: int = LOOKUP_CACHE_SIZE,
+                 refresh_ahead: float = 0, is_negative=None):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max(0, max_size)
+        self.refresh_window = ttl * refresh_ahead
+        self.is_negative = is_negative
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    async def get(self, key: str, loader):
+        """Cached value of ``key``, calling ``await loader()`` on a miss"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            self._entries.move_to_end(key)
+            LOOKUPS.inc(cache=self.name, result="hit")
+            if entry[1] - now < self.refresh_window and key not in self._inflight:
+                LOOKUPS.inc(cache=self.name, result="refresh")
+                self._load(key, loader)
+            return entry[0]
+
+        task = self._inflight.get(key)
+        if task is None:
+            LOOKUPS.inc(cache=self.name, result="miss")
+            task = self._load(key, loader)
+        else:
+            LOOKUPS.inc(cache=self.name, result="coalesced")
+        # Shielded: a caller that disconnects does not cancel the others.
+        return await asyncio.shield(task)
+
+    def _load(self, key: str, loader) -> asyncio.Task:
+        async def run():
+            value = await loader()
+            # Skipped when invalidated while loading.
+            if self._inflight.get(key) is task:
+                self._store(key, value)
+            return value
+
+        def done(finished: asyncio.Task):
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+            if not finished.cancelled() and finished.exception() is not None:
+                print(f"{self.name} lookup of {key!r} failed:", finished.exception())
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._inflight[key] = task
+        task.add_done_callback(done)
+        return task
+
+    def _store(self, key: str, value):
+        negative = self.is_negative is not None and self.is_negative(value)
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0 or not self.max_size:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> bool:
+        self._inflight.pop(key, None)
+        return self._entries.pop(key, None) is not None
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self._inflight.clear()
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "loading": len(self._inflight),
+            "ttl": self.ttl,
+        }
+
+
+def not_on_whatsapp(value) -> bool:
+    return not value or (isinstance(value, dict) and value.get("exists") is False)
+
+
+lookup_caches = {
+    "user": LookupCache(
+        "user", LOOKUP_CACHE_TTLS["user"], LOOKUP_CACHE_NEGATIVE_TTL, is_negative=not_on_whatsapp
+    ),
+    "jid": LookupCache(
+        "jid", LOOKUP_CACHE_TTLS["jid"], LOOKUP_CACHE_NEGATIVE_TTL, is_negative=not_on_whatsapp
+    ),
+    "group": LookupCache(
+        "group", LOOKUP_CACHE_TTLS["group"], refresh_ahead=LOOKUP_CACHE_REFRESH_AHEAD
+    ),
+    "groups": LookupCache(
+        "groups", LOOKUP_CACHE_TTLS["groups"], refresh_ahead=LOOKUP_CACHE_REFRESH_AHEAD
+    ),
+}
+
+registry.register(CallbackMetric(
+    "lookup_cache_entries",
+    "Node lookup results held in memory",
+    ("cache",),
+    lambda: {(name,): cache.stats()["size"] for name, cache in lookup_caches.items()},
+))
@@ -1,23 +1,58 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse, Response
 from fastapi.openapi.utils import get_openapi
 from fastapi.openapi.docs import get_swagger_ui_html
-from pydantic import BaseModel
-import requests
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+import httpx
 import base64
 import io
 import os
 import json
-import shutil
+import string
 import time
 import uuid
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from db import init_db
-from db_ops import insert_message, update_message_status
-from db_ops import update_contact_presence
-from config import NODE_BASE_URL
-from db_ops import insert_media_message
+from db import pool_stats, close_all_connections, is_tiered, FASTAPI_WORKERS
+from migrations import init_db
+from starlette.concurrency import run_in_threadpool
+from db_ops import enqueue_outbox, fetch_outbox_entry, outbox_counts, requeue_outbox
+from db_ops import apply_events, fetch_message_history, search_messages, warm_contact_cache
+from db_ops import fetch_inbox, fetch_conversation, mark_conversation_read
+from db_ops import fetch_whatsapp_lookups, save_whatsapp_lookups
+from db_ops import fetch_online_presences, fetch_presence
+from contact_cache import contact_cache
+from lookup_cache import lookup_caches
+from media_store import OutgoingMediaStore
+from presence import PresenceAggregator, PRESENCE_FLUSH_INTERVAL_MS, PRESENCE_IDLE_TTL_SECONDS
+from config import NODE_TIMEOUT, NODE_SEND_MEDIA_TIMEOUT, NODE_SYNC_TIMEOUT, OUTBOX_WORKERS
+from config import NODE_JID_BATCH_TIMEOUT, JID_BATCH_CHUNK, JID_BATCH_CONCURRENCY, JID_BATCH_MAX_PHONES
+from config import (
+    BULK_SEND_DEFAULT_CONCURRENCY,
+    BULK_SEND_MAX_CONCURRENCY,
+    BULK_SEND_RATE,
+    BULK_SEND_BURST,
+    BULK_RECIPIENT_RATE,
+    BULK_RECIPIENT_BURST,
+)
+from rate_limit import TokenBucket, KeyedTokenBuckets
+from outbox import OutboxDispatcher
+from shipper import PostgresShipper
+from importer import ChunkPipe, ImportAborted, import_format, import_stream
+from partitions import PartitionMaintainer, PARTITION_MAINTENANCE_HOURS, list_archives, fetch_archived_messages
+from node_client import get_node_client, close_node_client, node_timeout
+from event_log import start_logging, stop_logging, log_event
+from event_stream import event_hub, parse_filter, format_sse, EVENT_TYPES, EVENT_STREAM_KEEPALIVE_SECONDS
+from metrics import registry, CallbackMetric, HTTP_REQUEST_SECONDS, WEBHOOK_EVENTS
+from write_buffer import (
+    WriteBuffer,
+    WRITE_BUFFER_ENABLED,
+    WRITE_BUFFER_MAX_EVENTS,
+    WRITE_BUFFER_INTERVAL_MS,
+)
 
 
 ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
@@ -45,27 +80,158 @@ else:
 if OUTGOING_BASE_DIR:
     os.makedirs(OUTGOING_BASE_DIR, exist_ok=True)
 
+# Same media root as baileys-server/src/mediaConfig.ts
+if _base_path:
+    MEDIA_BASE_DIR = os.path.join(_base_path, _user_name or "")
+else:
+    MEDIA_BASE_DIR = os.getenv("MEDIA_BASE") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "baileys-server", "media"
+    )
+
+INCOMING_BASE_DIR = os.path.join(MEDIA_BASE_DIR, "incoming")
 
-def normalize_outgoing_path(file_path: str) -> str:
-    src = os.path.abspath(file_path)
+# "disk" serves media files directly (Node proxy only as fallback), "proxy" always asks Node
+MEDIA_SERVE_MODE = _config.get("media_serve_mode", "disk")
+MEDIA_CACHE_MAX_AGE = int(_config.get("media_cache_max_age", 86400))
+# Stored onWhatsApp answers younger than this are served from contacts.
+JID_LOOKUP_MAX_AGE_HOURS = float(_config.get("jid_lookup_max_age_hours", 168))
+
+
+def is_safe_media_name(filename: str) -> bool:
+    return bool(filename) and filename not in (".", "..") and not any(
+        ch in filename for ch in ("/", "\\", "\0")
+    )
+
+
+def resolve_media_file(filename: str) -> str | None:
+    """Find a media file by name under the incoming/outgoing dirs, refusing path traversal.
+
+    Outgoing files live under ``<digest>/<name>`` in the store, so they are
+    found through its name index.
+    """
+    if not is_safe_media_name(filename):
+        return None
+
+    for base_dir in (INCOMING_BASE_DIR, OUTGOING_BASE_DIR):
+        if not base_dir:
+            continue
+
+        root = os.path.realpath(base_dir)
+        candidate = os.path.realpath(os.path.join(root, filename))
 
-    if not OUTGOING_BASE_DIR:
-        return src
+        if os.path.commonpath([root, candidate]) != root:
+            continue
+        if os.path.isfile(candidate):
+            return candidate
+
+    return outgoing_store.find(filename)
 
-    name = os.path.basename(src)
-    dst = os.path.join(OUTGOING_BASE_DIR, name)
 
-    if src == dst:
-        return dst
+outgoing_store = OutgoingMediaStore(OUTGOING_BASE_DIR)
 
+
+def normalize_outgoing_path(file_path: str) -> str:
     try:
-        shutil.copy2(src, dst)
-        return dst
+        return outgoing_store.store(file_path)
     except Exception:
-        return src
+        return os.path.abspath(file_path)
+
+
+def store_events(events: list[tuple[str, dict]]):
+    """Store webhook events; the /events hubs of all workers read them from event_log"""
+    return apply_events(events)
+
+
+webhook_buffer = WriteBuffer(
+    store_events,
+    max_events=WRITE_BUFFER_MAX_EVENTS,
+    interval_ms=WRITE_BUFFER_INTERVAL_MS,
+    name="webhook-buffer",
+)
+
+
+presence_aggregator = PresenceAggregator(
+    store_events,
+    interval_ms=PRESENCE_FLUSH_INTERVAL_MS,
+)
+
+outbox_dispatcher = OutboxDispatcher(OUTBOX_WORKERS)
+
+partition_maintainer = PartitionMaintainer(PARTITION_MAINTENANCE_HOURS)
+
+postgres_shipper = PostgresShipper()
+
+
+def db_connection_counts():
+    stats = pool_stats()
+    counts = {("sqlite", "open"): stats["sqlite"].get("open", 0)}
+    for state in ("size", "idle", "in_use"):
+        if state in stats["postgres"]:
+            counts[("postgres", state)] = stats["postgres"][state]
+    return counts
+
+
+def db_pool_event_counts():
+    return {
+        (engine, event): value
+        for engine, counters in pool_stats().items()
+        for event, value in counters.items()
+        if event not in ("open", "size", "idle", "in_use", "max")
+    }
+
+
+registry.register(CallbackMetric(
+    "db_connections",
+    "Open database connections by engine and state",
+    ("engine", "state"),
+    db_connection_counts,
+))
+registry.register(CallbackMetric(
+    "db_pool_events_total",
+    "Connection pool checkouts, checkins, waits and timeouts",
+    ("engine", "event"),
+    db_pool_event_counts,
+    metric_type="counter",
+))
+registry.register(CallbackMetric(
+    "webhook_buffer_pending_events",
+    "Webhook events waiting in the write-behind buffer",
+    (),
+    lambda: {(): webhook_buffer.pending()},
+))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+
+    try:
+        await run_in_threadpool(warm_contact_cache)
+    except Exception as e:
+        print("Contact cache warm-up failed:", e)
+
+    if WRITE_BUFFER_ENABLED:
+        webhook_buffer.start()
+    presence_aggregator.start()
+    await run_in_threadpool(event_hub.start)
+    outbox_dispatcher.start()
+    partition_maintainer.start()
+    if is_tiered():
+        postgres_shipper.start()
+    yield
+    postgres_shipper.stop()
+    partition_maintainer.stop()
+    await outbox_dispatcher.stop()
+    event_hub.stop()
+    presence_aggregator.stop()
+    webhook_buffer.stop()
+    await close_node_client()
+    close_all_connections()
+    stop_logging()
 
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Baileys FastAPI Bridge",
     description="FastAPI bridge for Baileys WhatsApp server",
     version="1.0.0",
@@ -76,6 +242,25 @@ app = FastAPI(
 init_db()
 
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template keeps phone numbers and jids out of the labels.
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=str(status),
+        )
+
+
 # ============================================================
 # 🔍 HEALTH
 # ============================================================
@@ -86,25 +271,49 @@ def health():
     return {"status": "fastapi-ok"}
 
 
+@app.get("/health/db")
+def health_db():
+    """Connection pool checkout/checkin counters, contact cache, event stream and shipper stats"""
+    stats = {
+        **pool_stats(),
+        "contact_cache": contact_cache.stats(),
+        "presence": presence_aggregator.stats(),
+        "event_stream": event_hub.stats(),
+        "lookup_cache": {name: cache.stats() for name, cache in lookup_caches.items()},
+    }
+    if is_tiered():
+        stats["shipper"] = postgres_shipper.stats()
+    return stats
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of request, db_ops, Node and webhook metrics"""
+    return Response(
+        registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 # ============================================================
 # 📲 QR CODE (LOGIN)
 # ============================================================
 
 @app.get("/qr")
-def fetch_qr():
+async def fetch_qr():
     """Fetch raw QR JSON from Baileys"""
     try:
-        resp = requests.get(f"{NODE_BASE_URL}/qr", timeout=5)
+        resp = await get_node_client().get("/qr", timeout=node_timeout(NODE_TIMEOUT))
         resp.raise_for_status()
         return resp.json()
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=str(e))
 
 
 @app.get("/qr/image")
-def qr_image():
+async def qr_image():
     """Return QR code as PNG image"""
-    data = fetch_qr()
+    data = await fetch_qr()
 
     if "qr" not in data:
         raise HTTPException(status_code=404, detail="QR not available")
@@ -119,9 +328,9 @@ def qr_image():
 
 
 @app.get("/qr/view", response_class=HTMLResponse)
-def qr_view():
+async def qr_view():
     """Render QR code nicely in browser"""
-    data = fetch_qr()
+    data = await fetch_qr()
 
     if "qr" not in data:
         return """
@@ -167,38 +376,225 @@ class SendMessage(BaseModel):
 
 
 @app.post("/send")
-def send_message(data: SendMessage):
-    """Send a text message"""
-    r = requests.post(
-        f"{NODE_BASE_URL}/send",
-        json=data.dict(),
-        timeout=5
-    )
-    message_id =  str(uuid.uuid4())
-    now = int(time.time() * 1000)
-    # 🔹 Save outgoing message FIRST
-    insert_message(
-        message_id=message_id,
-        jid=data.to,
-        direction="out",
-        message_type="text",
-        content=data.message,
-        media_path=None,
-        timestamp=now,
-        status="sent"
+async def send_message(data: SendMessage):
+    """Queue a text message; the outbox workers deliver it to WhatsApp"""
+    message_id = str(uuid.uuid4())
+
+    await run_in_threadpool(
+        enqueue_outbox,
+        {
+            "message_id": message_id,
+            "jid": data.to,
+            "direction": "out",
+            "message_type": "text",
+            "content": data.message,
+            "media_path": None,
+            "timestamp": int(time.time() * 1000),
+        },
+        "text",
+        data.model_dump(),
     )
+    outbox_dispatcher.notify()
 
-    r.raise_for_status()
     return {
-        "status": "sent",
+        "status": "queued",
         "messageId": message_id
     }
 
 
+class BulkRecipient(BaseModel):
+    to: str
+    message: str | None = None
+    variables: dict[str, str] = Field(default_factory=dict)
+
+
+class SendBulk(BaseModel):
+    recipients: list[BulkRecipient]
+    message: str | None = None
+    template: str | None = None
+    concurrency: int = BULK_SEND_DEFAULT_CONCURRENCY
+    rate_per_second: float | None = None
+
+
+# Shared by every bulk job so parallel jobs cannot add up past the limits.
+# Each worker process gets an equal share, so the limits hold for the whole
+# server rather than per worker.
+bulk_send_bucket = TokenBucket(
+    BULK_SEND_RATE / FASTAPI_WORKERS, BULK_SEND_BURST / FASTAPI_WORKERS
+)
+bulk_recipient_buckets = KeyedTokenBuckets(
+    BULK_RECIPIENT_RATE / FASTAPI_WORKERS, BULK_RECIPIENT_BURST / FASTAPI_WORKERS
+)
+
+
+class BulkTemplateFormatter(string.Formatter):
+    """Fills plain ``{name}`` placeholders; attribute, index and format specs are refused"""
+
+    def get_field(self, field_name, args, kwargs):
+        if not field_name.isidentifier():
+            raise ValueError(f"unsupported placeholder {{{field_name}}}")
+        return self.get_value(field_name, args, kwargs), field_name
+
+    def format_field(self, value, format_spec):
+        if format_spec:
+            raise ValueError(f"unsupported format spec {format_spec!r}")
+        return str(value)
+
+
+bulk_template_formatter = BulkTemplateFormatter()
+
+
+def render_bulk_message(data: SendBulk, recipient: BulkRecipient) -> str:
+    if recipient.message is not None:
+        return recipient.message
+    if data.template is not None:
+        return bulk_template_formatter.vformat(
+            data.template, (), {"to": recipient.to, **recipient.variables}
+        )
+    if data.message is not None:
+        return data.message
+    raise ValueError("No message, template or per-recipient message given")
+
+
+async def send_one(index: int, data: SendBulk, recipient: BulkRecipient, job_bucket) -> dict:
+    result = {"index": index, "to": recipient.to}
+    started = time.monotonic()
+
+    try:
+        text = render_bulk_message(data, recipient)
+    except Exception as e:
+        return {**result, "status": "failed", "error": f"template: {e}"}
+
+    if job_bucket is not None:
+        await job_bucket.acquire()
+    await bulk_recipient_buckets.acquire(recipient.to)
+    await bulk_send_bucket.acquire()
+
+    try:
+        r = await get_node_client().post(
+            "/send",
+            json={"to": recipient.to, "message": text},
+            timeout=node_timeout(NODE_TIMEOUT),
+        )
+        r.raise_for_status()
+    except httpx.HTTPError as e:
+        return {
+            **result,
+            "status": "failed",
+            "error": str(e) or e.__class__.__name__,
+            "elapsed_ms": int((time.monotonic() - started) * 1000),
+        }
+
+    message_id = str(uuid.uuid4())
+    await webhook_buffer.put(("message", {
+        "message_id": message_id,
+        "jid": recipient.to,
+        "direction": "out",
+        "message_type": "text",
+        "content": text,
+        "media_path": None,
+        "timestamp": int(time.time() * 1000),
+        "status": "sent",
+    }))
+
+    return {
+        **result,
+        "status": "sent",
+        "messageId": message_id,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+
+
+async def bulk_send_results(data: SendBulk):
+    concurrency = max(1, min(data.concurrency, BULK_SEND_MAX_CONCURRENCY))
+    job_bucket = (
+        TokenBucket(data.rate_per_second, max(1, data.rate_per_second))
+        if data.rate_per_second
+        else None
+    )
+    pending = iter(enumerate(data.recipients))
+    results = asyncio.Queue()
+
+    async def worker():
+        for index, recipient in pending:
+            try:
+                result = await send_one(index, data, recipient, job_bucket)
+            except Exception as e:
+                # Every recipient must yield a line, or the reader below waits forever.
+                result = {
+                    "index": index,
+                    "to": recipient.to,
+                    "status": "failed",
+                    "error": str(e) or e.__class__.__name__,
+                }
+            await results.put(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    started = time.monotonic()
+    counts = {"sent": 0, "failed": 0}
+
+    try:
+        for _ in range(len(data.recipients)):
+            result = await results.get()
+            counts[result["status"]] += 1
+            yield json.dumps(result) + "\n"
+
+        elapsed = time.monotonic() - started
+        yield json.dumps({
+            "summary": {
+                "total": len(data.recipients),
+                **counts,
+                "elapsed_ms": int(elapsed * 1000),
+                "per_second": round(len(data.recipients) / elapsed, 2) if elapsed else None,
+            }
+        }) + "\n"
+    finally:
+        # Client went away or we are done: stop any workers still sending.
+        for task in workers:
+            task.cancel()
+
+
+@app.post("/send/bulk")
+async def send_bulk(data: SendBulk):
+    """Send a text (or per-recipient template) to many recipients, streaming NDJSON results"""
+    if not data.recipients:
+        raise HTTPException(status_code=400, detail="recipients is empty")
+    if data.message is None and data.template is None and any(
+        r.message is None for r in data.recipients
+    ):
+        raise HTTPException(status_code=400, detail="message or template is required")
+
+    return StreamingResponse(bulk_send_results(data), media_type="application/x-ndjson")
+
+
+@app.get("/outbox")
+async def get_outbox():
+    """Number of outbox entries per status (pending, sending, sent, dead)"""
+    return await run_in_threadpool(outbox_counts)
+
+
+@app.get("/outbox/{message_id}")
+async def get_outbox_entry(message_id: str):
+    """Delivery state of a queued message: attempts, next retry and last error"""
+    entry = await run_in_threadpool(fetch_outbox_entry, message_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown messageId")
+    return entry
+
+
+@app.post("/outbox/{message_id}/retry")
+async def retry_outbox_entry(message_id: str):
+    """Re-queue a dead-lettered message"""
+    if not await run_in_threadpool(requeue_outbox, message_id):
+        raise HTTPException(status_code=409, detail="Message is not dead-lettered")
+    outbox_dispatcher.notify()
+    return {"status": "queued", "messageId": message_id}
+
+
 @app.get("/messages")
-def get_messages():
+async def get_messages():
     """Get received messages"""
-    r = requests.get(f"{NODE_BASE_URL}/messages", timeout=5)
+    r = await get_node_client().get("/messages", timeout=node_timeout(NODE_TIMEOUT))
     r.raise_for_status()
     data = r.json()
 
@@ -216,6 +612,175 @@ def get_messages():
     return data
 
 
+# ============================================================
+# 🗂️ HISTORY (STORED MESSAGES)
+# ============================================================
+
+@app.get("/history")
+async def get_history(
+    jid: str | None = None,
+    phone: str | None = None,
+    contact_id: int | None = None,
+    direction: str | None = None,
+    message_type: str | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+):
+    """Stored messages, newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        return await run_in_threadpool(
+            fetch_message_history,
+            jid=jid,
+            phone=phone,
+            contact_id=contact_id,
+            direction=direction,
+            message_type=message_type,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/history/{contact}")
+async def get_contact_history(
+    contact: str,
+    direction: str | None = None,
+    message_type: str | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+):
+    """Stored messages of one contact, given as a JID or a phone number"""
+    lookup = {"jid": contact} if "@" in contact else {"phone": contact}
+    return await get_history(
+        **lookup,
+        direction=direction,
+        message_type=message_type,
+        since=since,
+        until=until,
+        cursor=cursor,
+        limit=limit,
+    )
+
+
+@app.get("/archive")
+async def get_archives():
+    """Archived months (detached partitions or SQLite archive files)"""
+    return {
+        "archives": await run_in_threadpool(list_archives),
+        "last_maintenance": partition_maintainer.last_result,
+    }
+
+
+@app.get("/archive/{period}")
+async def get_archived_messages(period: str, cursor: str | None = None, limit: int = 50):
+    """Messages of one archived month (YYYY-MM), newest first"""
+    try:
+        page = await run_in_threadpool(fetch_archived_messages, period, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if page is None:
+        raise HTTPException(status_code=404, detail=f"No archive for {period}")
+    return page
+
+
+@app.get("/search")
+async def search(
+    q: str,
+    contact: str | None = None,
+    direction: str | None = None,
+    message_type: str | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    sort: str = "rank",
+    cursor: str | None = None,
+    limit: int = 20,
+):
+    """Full-text search over message content with highlighted snippets"""
+    lookup = {}
+    if contact:
+        lookup = {"jid": contact} if "@" in contact else {"phone": contact}
+
+    try:
+        return await run_in_threadpool(
+            search_messages,
+            q,
+            **lookup,
+            direction=direction,
+            message_type=message_type,
+            since=since,
+            until=until,
+            sort=sort,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/inbox")
+async def get_inbox(unread: bool = False, cursor: str | None = None, limit: int = 50):
+    """Conversations with their last message and counters, most recent first"""
+    try:
+        return await run_in_threadpool(fetch_inbox, unread, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/inbox/{contact}")
+async def get_conversation(contact: str):
+    """Conversation summary of one contact, given as a JID or a phone number"""
+    lookup = {"jid": contact} if "@" in contact else {"phone": contact}
+    conversation = await run_in_threadpool(fetch_conversation, **lookup)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="No stored messages for this contact")
+    return conversation
+
+
+@app.post("/inbox/{contact}/read")
+async def read_conversation(contact: str):
+    """Mark the contact's incoming messages as read and reset its unread count"""
+    lookup = {"jid": contact} if "@" in contact else {"phone": contact}
+    updated = await run_in_threadpool(mark_conversation_read, **lookup)
+    return {"status": "ok", "marked_read": updated}
+
+
+@app.post("/import/messages")
+async def import_messages(request: Request, format: str | None = None):
+    """Bulk-load historical messages from an NDJSON or CSV request body.
+
+    The body is streamed to a worker thread through a bounded queue and
+    stored in batches; messages already stored (same message_id) are skipped.
+    """
+    try:
+        fmt = import_format(format, request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    pipe = ChunkPipe()
+    job = asyncio.ensure_future(run_in_threadpool(import_stream, pipe, fmt))
+    try:
+        async for chunk in request.stream():
+            if chunk and not await run_in_threadpool(pipe.put, chunk):
+                break  # the importer stopped; job carries the reason
+    finally:
+        await run_in_threadpool(pipe.put, None)
+
+    try:
+        return await job
+    except ImportAborted as e:
+        raise HTTPException(status_code=e.status_code, detail={"error": str(e), **e.result})
+
+
 # ============================================================
 # 📎 MEDIA
 # ============================================================
@@ -227,56 +792,104 @@ class SendMedia(BaseModel):
 
 
 @app.post("/send/media")
-def send_media(data: SendMedia):
+async def send_media(data: SendMedia):
+    """Queue a media message; the outbox workers deliver it to WhatsApp"""
     message_id = str(uuid.uuid4())
-    now = int(time.time() * 1000)
-    resolved_path = normalize_outgoing_path(data.filePath)
-
-    r = requests.post(
-        f"{NODE_BASE_URL}/send/media",
-        json={
+    resolved_path = await run_in_threadpool(normalize_outgoing_path, data.filePath)
+
+    await run_in_threadpool(
+        enqueue_outbox,
+        {
+            "message_id": message_id,
+            "jid": data.to,
+            "direction": "out",
+            "message_type": "media",
+            "content": data.caption,
+            "media_path": resolved_path,
+            "timestamp": int(time.time() * 1000),
+        },
+        "media",
+        {
             "to": data.to,
             "filePath": resolved_path,
             "caption": data.caption
         },
-        timeout=30
-    )
-    r.raise_for_status()
-    insert_message(
-        message_id=message_id,
-        jid=data.to,
-        direction="out",
-        message_type="media",
-        content=data.caption,
-        media_path=resolved_path,
-        timestamp=now,
-        status="sent"
     )
+    outbox_dispatcher.notify()
+
     return {
-        "status": "sent",
+        "status": "queued",
         "messageId": message_id
     }
 
 
 @app.get("/media/{filename}")
-def download_media(filename: str):
-    """Download received media"""
-    r = requests.get(f"{NODE_BASE_URL}/media/{filename}", stream=True)
+async def download_media(filename: str, request: Request):
+    """Download received media (supports Range, ETag and Last-Modified)"""
+    if not is_safe_media_name(filename):
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    if MEDIA_SERVE_MODE == "disk":
+        path = await run_in_threadpool(resolve_media_file, filename)
+        if path is not None:
+            return await run_in_threadpool(media_file_response, path, request)
+
+    client = get_node_client()
+    r = await client.send(
+        client.build_request(
+            "GET", f"/media/{filename}", timeout=node_timeout(NODE_SEND_MEDIA_TIMEOUT)
+        ),
+        stream=True,
+    )
+    if r.is_error:
+        await r.aclose()
     r.raise_for_status()
     return StreamingResponse(
-        r.raw,
-        media_type=r.headers.get("content-type", "application/octet-stream")
+        r.aiter_raw(),
+        media_type=r.headers.get("content-type", "application/octet-stream"),
+        background=BackgroundTask(r.aclose),
+    )
+
+
+def media_file_response(path: str, request: Request):
+    stat_result = os.stat(path)
+    response = FileResponse(
+        path,
+        stat_result=stat_result,
+        headers={"cache-control": f"private, max-age={MEDIA_CACHE_MAX_AGE}"},
     )
 
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        not_modified = "*" in tags or response.headers["etag"] in tags
+    elif if_modified_since is not None:
+        not_modified = if_modified_since == response.headers["last-modified"]
+    else:
+        not_modified = False
+
+    if not_modified:
+        return Response(
+            status_code=304,
+            headers={
+                key: response.headers[key]
+                for key in ("etag", "last-modified", "cache-control")
+            },
+        )
+
+    return response
+
 
 # ============================================================
 # 📨 RECEIPTS
 # ============================================================
 
 @app.get("/receipts")
-def get_receipts():
+async def get_receipts():
     """Get delivery/read receipts"""
-    r = requests.get(f"{NODE_BASE_URL}/receipts", timeout=5)
+    r = await get_node_client().get("/receipts", timeout=node_timeout(NODE_TIMEOUT))
     r.raise_for_status()
     return r.json()
 
@@ -284,27 +897,69 @@ def get_receipts():
 @app.post("/webhook/receipt")
 async def webhook_receipt(request: Request):
     payload = await request.json()
+    WEBHOOK_EVENTS.inc(type="receipt", source="single")
 
-    update_message_status(
-        message_id=payload.get("messageId"),
-        status=payload.get("status")
-    )
+    await webhook_buffer.put(receipt_event(payload))
 
-    print("📬 Updated receipt:", payload)
+    log_event("receipt", "Updated receipt", payload)
     return {"status": "ok"}
 
 
+# ============================================================
+# 📡 LIVE EVENTS
+# ============================================================
+
+async def event_stream(jids: frozenset, types: frozenset, last_event_id: str | None):
+    subscription = event_hub.subscribe(jids, types, last_event_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            events, dropped, reset = subscription.drain()
+            if reset:
+                yield "event: reset\ndata: {}\n\n"
+            if dropped:
+                yield f"event: dropped\ndata: {json.dumps({'dropped': dropped})}\n\n"
+            if events:
+                yield "".join(format_sse(event) for event in events)
+                continue
+            # Comment lines keep proxies from closing an idle stream.
+            if not await subscription.wait(EVENT_STREAM_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+    finally:
+        event_hub.unsubscribe(subscription)
+
+
+@app.get("/events")
+async def get_events(
+    request: Request,
+    jid: str | None = None,
+    type: str | None = None,
+    last_event_id: str | None = None,
+):
+    """Server-sent events for messages, receipts and presence as they are stored"""
+    try:
+        types = parse_filter(type, EVENT_TYPES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        event_stream(
+            parse_filter(jid),
+            types,
+            request.headers.get("last-event-id") or last_event_id,
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # ============================================================
 # 🌐 WEBHOOKS (INCOMING EVENTS)
 # ============================================================
 
-@app.post("/webhook/message")
-async def webhook_message(request: Request):
-    payload = await request.json()
-
+def message_event(payload: dict):
     if payload.get("type") in ("presence", "media") or payload.get("from") == "status@broadcast":
-        return {"status": "ignored"}
+        return None
 
     content_text = (
         payload.get("message")
@@ -312,80 +967,358 @@ async def webhook_message(request: Request):
         or payload.get("body")
     )
 
-    insert_message(
-        message_id=payload.get("messageId"),
-        jid=payload.get("from"),
-        direction="in",
-        message_type="text",
-        content=content_text,
-        media_path=None,
-        timestamp=payload.get("timestamp"),
-        status="delivered",
-        phone=payload.get("phone"),
-        name=payload.get("name"),
+    return ("message", {
+        "message_id": payload.get("messageId"),
+        "jid": payload.get("from"),
+        "direction": "in",
+        "message_type": "text",
+        "content": content_text,
+        "media_path": None,
+        "timestamp": payload.get("timestamp"),
+        "status": "delivered",
+        "phone": payload.get("phone"),
+        "name": payload.get("name"),
+    })
+
+
+def media_event(payload: dict):
+    caption_text = (
+        payload.get("caption")
+        or payload.get("message")
+        or payload.get("text")
+        or payload.get("body")
     )
 
-    print("📩 Stored message:", payload)
+    return ("message", {
+        "message_id": payload.get("messageId"),
+        "jid": payload.get("from"),
+        "direction": payload.get("direction", "in"),
+        "message_type": payload.get("messageType", "media"),
+        "content": caption_text,
+        "media_path": payload.get("filePath"),
+        "timestamp": payload.get("timestamp"),
+        "status": "delivered",
+        "phone": payload.get("phone"),
+        "name": None,
+    })
+
+
+def receipt_event(payload: dict):
+    return ("receipt", {
+        "message_id": payload.get("messageId"),
+        "status": payload.get("status"),
+        "jid": payload.get("to"),
+        "timestamp": payload.get("timestamp"),
+    })
+
+
+def presence_event(payload: dict):
+    timestamp = payload.get("timestamp")
+
+    return ("presence", {
+        "jid": payload.get("jid"),
+        "phone": payload.get("phone"),
+        "name": payload.get("name"),
+        "is_online": not payload.get("offline", False),
+        "last_seen_at": timestamp if isinstance(timestamp, int) else None,
+    })
+
+
+def webhook_event_type(payload: dict) -> str:
+    event_type = payload.get("type")
+    return event_type if event_type in ("receipt", "presence", "media") else "message"
+
+
+def event_from_payload(payload: dict):
+    """Map a Baileys webhook payload to a db_ops event, same routing as webhook.ts"""
+    event_type = payload.get("type")
+
+    if event_type == "receipt":
+        return receipt_event(payload)
+    if event_type == "presence":
+        return presence_event(payload)
+    if event_type == "media":
+        return media_event(payload)
+    return message_event(payload)
+
+
+@app.post("/webhook/message")
+async def webhook_message(request: Request):
+    payload = await request.json()
+
+    event = message_event(payload)
+    if event is None:
+        WEBHOOK_EVENTS.inc(type="ignored", source="single")
+        return {"status": "ignored"}
+
+    WEBHOOK_EVENTS.inc(type="message", source="single")
+
+    await webhook_buffer.put(event)
+
+    log_event("message", "Stored message", payload)
     return {"status": "ok"}
 
 
+@app.post("/webhook/batch")
+async def webhook_batch(request: Request):
+    """Store an array of mixed message/media/receipt/presence events in one transaction"""
+    payload = await request.json()
+
+    if isinstance(payload, dict):
+        payload = payload.get("events")
+
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+
+    events = []
+    ignored = 0
+
+    presences = 0
+
+    for item in payload:
+        event = event_from_payload(item) if isinstance(item, dict) else None
+        if event is None:
+            WEBHOOK_EVENTS.inc(type="ignored", source="batch")
+            ignored += 1
+            continue
+        WEBHOOK_EVENTS.inc(type=webhook_event_type(item), source="batch")
+        if event[0] == "presence":
+            presence_aggregator.update(event[1])
+            presences += 1
+            continue
+        events.append(event)
+
+    # Nothing was stored, so the sender can retry the whole batch; message
+    # ids that are already stored are skipped on the retry.
+    if events and not await run_in_threadpool(store_events, events):
+        raise HTTPException(status_code=503, detail="Could not store the events, retry the batch")
+
+    return {"status": "ok", "stored": len(events) + presences, "ignored": ignored}
+
+
 # ============================================================
 # 👤 CONTACTS / CHATS
 # ============================================================
 
-@app.get("/user/{phone}")
-def get_user(phone: str):
-    """Get user details by phone"""
-    r = requests.get(f"{NODE_BASE_URL}/user/{phone}", timeout=5)
+async def node_lookup(path: str):
+    r = await get_node_client().get(path, timeout=node_timeout(NODE_TIMEOUT))
     r.raise_for_status()
     return r.json()
 
 
+@app.get("/user/{phone}")
+async def get_user(phone: str):
+    """Get user details by phone (cached)"""
+    return await lookup_caches["user"].get(phone, lambda: node_lookup(f"/user/{phone}"))
+
+
 @app.get("/group/{group_jid}")
-def get_group(group_jid: str):
-    """Get group details"""
-    r = requests.get(f"{NODE_BASE_URL}/group/{group_jid}", timeout=5)
-    r.raise_for_status()
-    return r.json()
+async def get_group(group_jid: str):
+    """Get group details (cached, refreshed ahead of expiry)"""
+    return await lookup_caches["group"].get(group_jid, lambda: node_lookup(f"/group/{group_jid}"))
+
+
+def lookup_since_ms() -> int:
+    return int((time.time() - JID_LOOKUP_MAX_AGE_HOURS * 3600) * 1000)
+
+
+async def resolve_jid(phone: str) -> dict:
+    """Stored onWhatsApp answer if recent enough, otherwise ask Node and store it"""
+    try:
+        stored = await run_in_threadpool(fetch_whatsapp_lookups, [phone], lookup_since_ms())
+    except Exception as e:
+        print("Stored JID lookup failed:", e)
+        stored = {}
+    if phone in stored:
+        result = stored[phone]
+        del result["checked_at"]
+        return result
+
+    result = await node_lookup(f"/jid/{phone}")
+    if isinstance(result, dict):
+        try:
+            await run_in_threadpool(save_whatsapp_lookups, [{**result, "phone": phone}])
+        except Exception as e:
+            print("Saving JID lookup failed:", e)
+    return result
 
 
 @app.get("/jid/{phone}")
-def get_jid(phone: str):
-    """Resolve JID from phone number"""
-    r = requests.get(f"{NODE_BASE_URL}/jid/{phone}", timeout=5)
-    r.raise_for_status()
-    return r.json()
+async def get_jid(phone: str):
+    """Resolve JID from phone number (cached, then stored, then WhatsApp)"""
+    return await lookup_caches["jid"].get(phone, lambda: resolve_jid(phone))
+
+
+class JidBatch(BaseModel):
+    phones: list[str]
+    refresh: bool = False
+
+
+def normalize_phone(phone: str) -> str | None:
+    digits = "".join(ch for ch in phone.strip() if ch not in " -().")
+    if digits.startswith("+"):
+        digits = digits[1:]
+    return digits if digits.isdigit() and 6 <= len(digits) <= 15 else None
+
+
+async def query_jid_chunk(phones: list[str]) -> list[dict]:
+    """One multi-number onWhatsApp query; failures become per-number errors"""
+    try:
+        r = await get_node_client().post(
+            "/jid/batch", json={"phones": phones}, timeout=node_timeout(NODE_JID_BATCH_TIMEOUT)
+        )
+        r.raise_for_status()
+        results = r.json()
+        if not isinstance(results, list) or not all(isinstance(result, dict) for result in results):
+            raise ValueError("Node returned an unexpected /jid/batch body")
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+        return [{"phone": phone, "error": error} for phone in phones]
+
+    # Keyed by the number asked for, which is what later lookups search on.
+    answered = {result.get("phone"): result for result in results}
+    results = [answered[phone] for phone in phones if phone in answered]
+    missing = [
+        {"phone": phone, "error": "no answer from WhatsApp"}
+        for phone in phones if phone not in answered
+    ]
+
+    try:
+        await run_in_threadpool(save_whatsapp_lookups, results)
+    except Exception as e:
+        print(f"Saving {len(results)} JID lookups failed:", e)
+    for phone in phones:
+        lookup_caches["jid"].invalidate(phone)
+        lookup_caches["user"].invalidate(phone)
+    return [{**result, "source": "whatsapp"} for result in results] + missing
+
+
+async def jid_batch_results(data: JidBatch):
+    started = time.monotonic()
+    counts = {"stored": 0, "whatsapp": 0, "invalid": 0, "failed": 0}
+    phones = []
+    seen = set()
+
+    for raw in data.phones:
+        phone = normalize_phone(raw)
+        if phone is None:
+            counts["invalid"] += 1
+            yield json.dumps({"phone": raw, "error": "invalid phone number"}) + "\n"
+        elif phone not in seen:
+            seen.add(phone)
+            phones.append(phone)
+
+    stored = {}
+    if phones and not data.refresh:
+        try:
+            stored = await run_in_threadpool(fetch_whatsapp_lookups, phones, lookup_since_ms())
+        except Exception as e:
+            print("Stored JID lookup failed:", e)
+    for phone in phones:
+        if phone in stored:
+            counts["stored"] += 1
+            yield json.dumps({**stored[phone], "source": "stored"}) + "\n"
+
+    missing = [phone for phone in phones if phone not in stored]
+    chunks = [missing[i:i + JID_BATCH_CHUNK] for i in range(0, len(missing), JID_BATCH_CHUNK)]
+    pending = iter(chunks)
+    results = asyncio.Queue()
+
+    async def worker():
+        for chunk in pending:
+            try:
+                chunk_results = await query_jid_chunk(chunk)
+            except Exception as e:
+                # Every chunk must yield its lines, or the reader below waits forever.
+                error = str(e) or e.__class__.__name__
+                chunk_results = [{"phone": phone, "error": error} for phone in chunk]
+            await results.put(chunk_results)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(JID_BATCH_CONCURRENCY, len(chunks)))]
+
+    try:
+        for _ in range(len(chunks)):
+            lines = []
+            for result in await results.get():
+                counts["failed" if "error" in result else "whatsapp"] += 1
+                lines.append(json.dumps(result) + "\n")
+            yield "".join(lines)
+
+        yield json.dumps({
+            "summary": {
+                "total": len(data.phones),
+                "unique": len(phones),
+                **counts,
+                "elapsed_ms": int((time.monotonic() - started) * 1000),
+            }
+        }) + "\n"
+    finally:
+        # Client went away or we are done: stop any queries still running.
+        for task in workers:
+            task.cancel()
+
+
+@app.post("/jid/batch")
+async def resolve_jids(data: JidBatch):
+    """Resolve many phone numbers, streaming one NDJSON line per number"""
+    if not data.phones:
+        raise HTTPException(status_code=400, detail="phones is empty")
+    if len(data.phones) > JID_BATCH_MAX_PHONES:
+        raise HTTPException(
+            status_code=400, detail=f"At most {JID_BATCH_MAX_PHONES} phones per request"
+        )
+
+    return StreamingResponse(jid_batch_results(data), media_type="application/x-ndjson")
 
 
 @app.get("/groups")
-def get_groups():
-    """Get all joined groups"""
-    r = requests.get(f"{NODE_BASE_URL}/groups", timeout=5)
-    r.raise_for_status()
-    return r.json()
+async def get_groups():
+    """Get all joined groups (cached, refreshed ahead of expiry)"""
+    return await lookup_caches["groups"].get("", lambda: node_lookup("/groups"))
+
+
+def lookup_cache_named(name: str):
+    cache = lookup_caches.get(name)
+    if cache is None:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown cache, expected one of {', '.join(lookup_caches)}"
+        )
+    return cache
+
+
+@app.delete("/cache/{name}")
+async def clear_lookup_cache(name: str):
+    """Drop every cached /user, /jid, /group or /groups result"""
+    return {"cache": name, "removed": lookup_cache_named(name).clear()}
+
+
+@app.delete("/cache/{name}/{key}")
+async def invalidate_lookup(name: str, key: str):
+    """Drop one cached lookup (a phone number or group jid)"""
+    return {"cache": name, "key": key, "removed": lookup_cache_named(name).invalidate(key)}
 
 
 @app.get("/chats")
-def get_chats():
+async def get_chats():
     """Get all chats"""
-    r = requests.get(f"{NODE_BASE_URL}/chats", timeout=5)
+    r = await get_node_client().get("/chats", timeout=node_timeout(NODE_TIMEOUT))
     r.raise_for_status()
     return r.json()
 
 
 @app.post("/sync/contacts")
-def sync_contacts():
+async def sync_contacts():
     try:
-        r = requests.get(f"{NODE_BASE_URL}/chats", timeout=15)
+        r = await get_node_client().get("/chats", timeout=node_timeout(NODE_SYNC_TIMEOUT))
         r.raise_for_status()
         chats = r.json()
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=str(e))
 
     if not isinstance(chats, list):
         return {"synced": 0}
 
-    synced = 0
+    events = []
 
     for chat in chats:
         if not isinstance(chat, dict):
@@ -403,17 +1336,18 @@ def sync_contacts():
         if jid.endswith("@s.whatsapp.net"):
             phone = jid.split("@")[0]
 
-        update_contact_presence(
-            jid=jid,
-            phone=phone,
-            name=name,
-            is_online=False,
-            last_seen_at=last_ts if isinstance(last_ts, int) else None,
-        )
+        events.append(("presence", {
+            "jid": jid,
+            "phone": phone,
+            "name": name,
+            "is_online": False,
+            "last_seen_at": last_ts if isinstance(last_ts, int) else None,
+        }))
 
-        synced += 1
+    if events:
+        await run_in_threadpool(apply_events, events)
 
-    return {"synced": synced}
+    return {"synced": len(events)}
 
 
 # ============================================================
@@ -421,10 +1355,10 @@ def sync_contacts():
 # ============================================================
 
 @app.get("/whatsapp/me")
-def whatsapp_me():
+async def whatsapp_me():
     """Get logged-in WhatsApp user"""
     try:
-        r = requests.get(f"{NODE_BASE_URL}/me", timeout=5)
+        r = await get_node_client().get("/me", timeout=node_timeout(NODE_TIMEOUT))
         if r.status_code == 404:
             return {"logged_in": False}
         r.raise_for_status()
@@ -432,14 +1366,14 @@ def whatsapp_me():
             "logged_in": True,
             "user": r.json()
         }
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/whatsapp/qr")
-def get_qr():
+async def get_qr():
     """Unified QR status endpoint"""
-    r = requests.get(f"{NODE_BASE_URL}/qr", timeout=5)
+    r = await get_node_client().get("/qr", timeout=node_timeout(NODE_TIMEOUT))
     data = r.json()
 
     if data.get("status") == "ready":
@@ -452,55 +1386,81 @@ def get_qr():
 
 
 @app.get("/whatsapp/last-message/{user}")
-def whatsapp_last_message(user: str):
-    """Get last message of a user or group"""
+async def whatsapp_last_message(user: str):
+    """Get last message of a user or group (stored conversations first, then Node)"""
+    lookup = {"jid": user} if "@" in user else {"phone": user}
+    conversation = await run_in_threadpool(fetch_conversation, **lookup)
+    if conversation is not None:
+        return {
+            "jid": conversation["jid"],
+            "name": conversation["name"],
+            "type": conversation["type"],
+            "message": conversation["last_preview"],
+            "timestamp": conversation["last_timestamp"],
+            "direction": conversation["last_direction"],
+            "status": conversation["last_status"],
+        }
+
     try:
-        r = requests.get(f"{NODE_BASE_URL}/last-message/{user}", timeout=5)
+        r = await get_node_client().get(
+            f"/last-message/{user}", timeout=node_timeout(NODE_TIMEOUT)
+        )
         r.raise_for_status()
         return r.json()
-    except requests.HTTPError:
+    except httpx.HTTPStatusError:
         return {"error": "No messages found"}
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/presence")
+def get_online_contacts():
+    """Contacts currently online, from memory or, with several workers, the database"""
+    if FASTAPI_WORKERS == 1:
+        return presence_aggregator.online()
+
+    # Each worker only holds the updates it received; the others reach the
+    # database within one presence flush interval.
+    rows = {row["jid"]: row for row in fetch_online_presences(PRESENCE_IDLE_TTL_SECONDS)}
+    for jid, row in presence_aggregator.recent().items():
+        stored = rows.get(jid)
+        if stored is None or (stored["last_seen_at"] or 0) <= row["last_seen_at"]:
+            rows[jid] = row
+    return [row for row in rows.values() if row.get("is_online")]
+
+
+@app.get("/presence/{jid}")
+def get_presence(jid: str):
+    """Latest known presence of a contact, from memory or, with several workers, the database"""
+    state = presence_aggregator.get(jid)
+    if FASTAPI_WORKERS > 1:
+        stored = fetch_presence(jid, PRESENCE_IDLE_TTL_SECONDS)
+        if stored is not None and (
+            state is None or (stored["last_seen_at"] or 0) > state["last_seen_at"]
+        ):
+            state = stored
+    if state is None:
+        raise HTTPException(status_code=404, detail="No presence seen for this jid")
+    return state
+
+
 @app.post("/webhook/presence")
 async def webhook_presence(request: Request):
     payload = await request.json()
+    WEBHOOK_EVENTS.inc(type="presence", source="single")
 
-    update_contact_presence(
-        jid=payload.get("jid"),
-        phone=payload.get("phone"),
-        name=payload.get("name"),
-        is_online=not payload.get("offline", False)
-    )
+    presence_aggregator.update(presence_event(payload)[1])
 
-    print("👤 Presence updated:", payload)
+    log_event("presence", "Presence updated", payload)
     return {"status": "ok"}
 @app.post("/webhook/media")
 async def webhook_media(request: Request):
     payload = await request.json()
+    WEBHOOK_EVENTS.inc(type="media", source="single")
 
-    caption_text = (
-        payload.get("caption")
-        or payload.get("message")
-        or payload.get("text")
-        or payload.get("body")
-    )
-
-    insert_media_message(
-        message_id=payload.get("messageId"),
-        jid=payload.get("from"),
-        direction=payload.get("direction", "in"),
-        message_type=payload.get("messageType", "media"),
-        content=caption_text,
-        media_path=payload.get("filePath"),
-        timestamp=payload.get("timestamp"),
-        status="delivered",
-        phone=payload.get("phone"),
-    )
+    await webhook_buffer.put(media_event(payload))
 
-    print("🖼️ Media stored:", payload.get("filePath"))
+    log_event("media", "Media stored", file_path=payload.get("filePath"))
     return {"status": "ok"}
 
 
@@ -512,5 +1472,6 @@ if __name__ == "__main__":
         "main:app",
         host=fastapi_host,
         port=fastapi_port,
+        workers=int(os.getenv("FASTAPI_WORKERS", "1")),
         reload=False
     )
@@ -0,0 +1,156 @@
+import hashlib
+import mimetypes
+import os
+import shutil
+import time
+import uuid
+from db import get_db
+from db_ops import format_timestamp
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OutgoingMediaStore:
+    """Content-addressed store for files sent through /send/media.
+
+    Files are kept as ``<base_dir>/<digest>/<original name>`` so Baileys
+    still sees the original file name and extension. A source file is
+    hashed once per (path, size, mtime); the same content under another
+    name is hardlinked instead of copied, and a file already in the store
+    is returned as-is.
+    """
+
+    def __init__(self, base_dir: str | None):
+        self.base_dir = os.path.abspath(base_dir) if base_dir else None
+
+    def store(self, file_path: str) -> str:
+        src = os.path.abspath(file_path)
+
+        if not self.base_dir:
+            return src
+
+        if os.path.commonpath([self.base_dir, src]) == self.base_dir:
+            return src
+
+        stat_result = os.stat(src)
+        digest = self._known_digest(src, stat_result) or hash_file(src)
+
+        dst = os.path.join(self.base_dir, digest, os.path.basename(src))
+
+        if not os.path.isfile(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            existing = self._stored_path(digest)
+
+            if existing and os.path.isfile(existing):
+                try:
+                    os.link(existing, dst)
+                except OSError:
+                    self._copy(existing, dst)
+            else:
+                self._copy(src, dst)
+
+        self._remember(src, stat_result, digest, dst)
+        return dst
+
+    def find(self, name: str) -> str | None:
+        """Stored path of the newest file sent under ``name``"""
+        if not self.base_dir:
+            return None
+
+        db = get_db()
+        cur = db.cursor()
+        cur.execute("SELECT path FROM outgoing_media_names WHERE name = ?", (name,))
+        row = cur.fetchone()
+        db.close()
+
+        if not row:
+            return None
+        root = os.path.realpath(self.base_dir)
+        path = os.path.realpath(row[0])
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        return path
+
+    def _copy(self, src: str, dst: str):
+        # Copy under a temporary name first so concurrent sends never see
+        # a half-written file.
+        tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _known_digest(self, src: str, stat_result: os.stat_result) -> str | None:
+        db = get_db()
+        cur = db.cursor()
+        cur.execute(
+            "SELECT digest FROM outgoing_media_sources "
+            "WHERE source_path = ? AND size = ? AND mtime_ns = ?",
+            (src, stat_result.st_size, stat_result.st_mtime_ns),
+        )
+        row = cur.fetchone()
+        db.close()
+        return row[0] if row else None
+
+    def _stored_path(self, digest: str) -> str | None:
+        db = get_db()
+        cur = db.cursor()
+        cur.execute("SELECT path FROM outgoing_media WHERE digest = ?", (digest,))
+        row = cur.fetchone()
+        db.close()
+        return row[0] if row else None
+
+    def _remember(self, src: str, stat_result: os.stat_result, digest: str, dst: str):
+        now = int(time.time() * 1000)
+
+        db = get_db()
+        cur = db.cursor()
+        cur.execute(
+            """
+            INSERT INTO outgoing_media_sources (source_path, size, mtime_ns, digest)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(source_path) DO UPDATE SET
+                size = excluded.size,
+                mtime_ns = excluded.mtime_ns,
+                digest = excluded.digest
+            """,
+            (src, stat_result.st_size, stat_result.st_mtime_ns, digest),
+        )
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO outgoing_media (
+                digest, size, mime, path, first_seen, first_seen_str
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                digest,
+                stat_result.st_size,
+                mimetypes.guess_type(dst)[0],
+                dst,
+                now,
+                format_timestamp(now),
+            ),
+        )
+        cur.execute(
+            """
+            INSERT INTO outgoing_media_names (name, path, stored_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                path = excluded.path,
+                stored_at = excluded.stored_at
+            """,
+            (os.path.basename(dst), dst, now),
+        )
+        db.commit()
+        db.close()
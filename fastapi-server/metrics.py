@@ -0,0 +1,166 @@
+import bisect
+import os
+import threading
+
+# Seconds; covers sub-millisecond SQLite writes up to slow Node media sends.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, *extra: str) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    parts.extend(label for label in extra if label)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, const: str = "") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key, const)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, const: str = "") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, const, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key, const)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """Read at scrape time: ``fn()`` returns ``{label_values_tuple: value}``.
+
+    Used for numbers another component already tracks (pool sizes,
+    checkout counters), so they are exported without double bookkeeping.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: tuple, fn, metric_type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+        self.metric_type = metric_type
+
+    def render(self, const: str = "") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Metric {self.name} collection failed:", e)
+            return lines
+        for key, value in sorted(values.items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key, const)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Every FastAPI worker process keeps its own values, and a scrape
+        # reaches whichever worker accepts it; the label keeps each worker's
+        # series apart so rate() and sum() see monotonic counters.
+        const = f'worker="{os.getpid()}"'
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(const))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "FastAPI request latency by route template",
+    ("method", "route", "status"),
+))
+DB_OP_SECONDS = registry.register(Histogram(
+    "db_op_duration_seconds",
+    "db_ops write latency by function and engine",
+    ("op", "engine"),
+))
+NODE_REQUEST_SECONDS = registry.register(Histogram(
+    "node_request_duration_seconds",
+    "Baileys server call latency up to response headers",
+    ("method", "path", "status"),
+))
+NODE_REQUEST_ERRORS = registry.register(Counter(
+    "node_request_errors_total",
+    "Baileys server calls that failed or answered with an error status",
+    ("method", "path", "reason"),
+))
+WEBHOOK_EVENTS = registry.register(Counter(
+    "webhook_events_total",
+    "Webhook events received by type and endpoint kind",
+    ("type", "source"),
+))
@@ -0,0 +1,864 @@
+import os
+import sqlite3
+import time
+from db import get_db, get_pg_db, postgres_configured, is_tiered, ENGINE, SEARCH_LANGUAGE
+
+# Schema changes are ordered, numbered steps. Each engine records the steps
+# it has applied in schema_version, so a startup against a current schema
+# costs one query. Append new steps; never edit or renumber applied ones.
+# Steps are written to also succeed on databases created before versioning
+# existed (IF NOT EXISTS, column checks).
+
+MIGRATION_LOCK_KEY = "schema_migrations"
+
+SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT,
+    applied_at BIGINT
+)
+"""
+
+MESSAGE_INDEXES = [
+    # History pages sort rows without a timestamp as 0, so they stay
+    # reachable through the cursor; these match that ORDER BY.
+    "CREATE INDEX IF NOT EXISTS idx_messages_contact_sort ON messages (contact_id, COALESCE(timestamp, 0), id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_sort ON messages (COALESCE(timestamp, 0), id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_status ON messages (status)",
+    "CREATE INDEX IF NOT EXISTS idx_contacts_phone ON contacts (phone)",
+]
+
+# Workers only ever scan rows that are still waiting to be dispatched.
+OUTBOX_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) "
+    "WHERE status IN ('pending', 'sending')"
+)
+
+# Finds an older undelivered row for the same recipient when claiming.
+OUTBOX_RECIPIENT_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox (recipient, id) "
+    "WHERE status IN ('pending', 'sending')"
+)
+
+# External-content FTS5 index over messages.content, kept in sync by triggers
+# so every write path (single inserts, batches, outbox) is covered.
+MESSAGES_FTS_SQLITE = [
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+]
+
+# Tiered engine: every inserted or updated contact/message row is queued in
+# ship_log for shipper.py. The triggers only exist while the engine is
+# "tiered" (see set_change_tracking), so other engines pay nothing.
+SHIP_TRIGGERS_SQLITE = {
+    f"ship_log_{table}_{event[0].lower()}": f"""
+    CREATE TRIGGER IF NOT EXISTS ship_log_{table}_{event[0].lower()} AFTER {event} ON {table} BEGIN
+        INSERT INTO ship_log (tbl, row_id, queued_at)
+        VALUES ('{table}', new.id, CAST(strftime('%s', 'now') AS INTEGER));
+    END
+    """
+    for table in ("contacts", "messages")
+    for event in ("INSERT", "UPDATE")
+}
+
+# conversations holds one inbox row per contact, maintained by triggers on
+# messages so every write path (webhooks, batches, outbox, imports, the
+# tiered shipper) updates it in the same transaction as the message. The
+# "last_*" columns follow the message with the highest timestamp, so an
+# import of old history never replaces the latest message. Counters are not
+# reduced when retention archives old months.
+CONVERSATION_PREVIEW_CHARS = 200
+CONVERSATION_LAST_COLUMNS = (
+    "last_message_id", "last_direction", "last_message_type",
+    "last_preview", "last_status", "last_timestamp",
+)
+CONVERSATION_UPSERT_SET = ",\n".join(
+    [
+        f"{name}_count = conversations.{name}_count + excluded.{name}_count"
+        for name in ("incoming", "outgoing", "unread")
+    ]
+    + [
+        f"{column} = CASE WHEN excluded.last_timestamp >= conversations.last_timestamp "
+        f"THEN excluded.{column} ELSE conversations.{column} END"
+        for column in CONVERSATION_LAST_COLUMNS
+    ]
+)
+CONVERSATION_INSERT_COLUMNS = (
+    "contact_id, " + ", ".join(CONVERSATION_LAST_COLUMNS)
+    + ", incoming_count, outgoing_count, unread_count"
+)
+CONVERSATIONS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_conversations_recent "
+    "ON conversations (last_timestamp, contact_id)"
+)
+
+CONVERSATIONS_SQLITE = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS conversations_ai AFTER INSERT ON messages
+    WHEN new.contact_id IS NOT NULL BEGIN
+        INSERT INTO conversations ({CONVERSATION_INSERT_COLUMNS})
+        VALUES (
+            new.contact_id, new.message_id, new.direction, new.message_type,
+            substr(new.content, 1, {CONVERSATION_PREVIEW_CHARS}), new.status,
+            COALESCE(new.timestamp, 0),
+            new.direction IS 'in', new.direction IS 'out',
+            new.direction IS 'in' AND new.status IS NOT 'read'
+        )
+        ON CONFLICT (contact_id) DO UPDATE SET {CONVERSATION_UPSERT_SET};
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS conversations_au AFTER UPDATE OF status ON messages
+    WHEN new.contact_id IS NOT NULL AND old.status IS NOT new.status BEGIN
+        UPDATE conversations SET
+            unread_count = unread_count
+                + (new.direction IS 'in' AND new.status IS NOT 'read')
+                - (old.direction IS 'in' AND old.status IS NOT 'read'),
+            last_status = CASE WHEN last_message_id = new.message_id
+                THEN new.status ELSE last_status END
+        WHERE contact_id = new.contact_id;
+    END
+    """,
+]
+
+# Postgres uses statement-level triggers with transition tables, so a COPY
+# or multi-row insert updates each conversation once instead of per row.
+# Rows being moved between partitions (bridge.skip_dedup) are already counted.
+_PG_UNREAD = "CASE WHEN {t}.direction = 'in' AND {t}.status IS DISTINCT FROM 'read' THEN 1 ELSE 0 END"
+
+CONVERSATIONS_PG_FUNCTIONS = [
+    f"""
+    CREATE OR REPLACE FUNCTION conversations_after_insert() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('bridge.skip_dedup', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        INSERT INTO conversations ({CONVERSATION_INSERT_COLUMNS})
+        SELECT l.contact_id, l.message_id, l.direction, l.message_type,
+               left(l.content, {CONVERSATION_PREVIEW_CHARS}), l.status,
+               COALESCE(l.timestamp, 0),
+               a.incoming, a.outgoing, a.unread
+        FROM (
+            SELECT contact_id,
+                   count(*) FILTER (WHERE direction = 'in') AS incoming,
+                   count(*) FILTER (WHERE direction = 'out') AS outgoing,
+                   sum({_PG_UNREAD.format(t="new_rows")}) AS unread
+            FROM new_rows WHERE contact_id IS NOT NULL GROUP BY contact_id
+        ) a
+        JOIN (
+            SELECT DISTINCT ON (contact_id) *
+            FROM new_rows WHERE contact_id IS NOT NULL
+            ORDER BY contact_id, COALESCE(timestamp, 0) DESC, id DESC
+        ) l ON l.contact_id = a.contact_id
+        -- Lock conversations in a fixed order so concurrent batches cannot deadlock.
+        ORDER BY l.contact_id
+        ON CONFLICT (contact_id) DO UPDATE SET {CONVERSATION_UPSERT_SET};
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION conversations_after_update() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('bridge.skip_dedup', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        PERFORM 1 FROM conversations
+        WHERE contact_id IN (
+            SELECT n.contact_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.status IS DISTINCT FROM o.status
+        )
+        ORDER BY contact_id
+        FOR UPDATE;
+
+        UPDATE conversations c SET unread_count = c.unread_count + d.delta
+        FROM (
+            SELECT n.contact_id,
+                   sum({_PG_UNREAD.format(t="n")} - {_PG_UNREAD.format(t="o")}) AS delta
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.status IS DISTINCT FROM o.status AND n.contact_id IS NOT NULL
+            GROUP BY n.contact_id
+        ) d
+        WHERE c.contact_id = d.contact_id AND d.delta <> 0;
+
+        UPDATE conversations c SET last_status = n.status
+        FROM new_rows n
+        WHERE c.contact_id = n.contact_id
+          AND c.last_message_id = n.message_id
+          AND c.last_status IS DISTINCT FROM n.status;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# Re-run after messages is rebuilt as a partitioned table (partitions.py).
+CONVERSATIONS_PG_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS conversations_ai ON messages",
+    "CREATE TRIGGER conversations_ai AFTER INSERT ON messages "
+    "REFERENCING NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION conversations_after_insert()",
+    "DROP TRIGGER IF EXISTS conversations_au ON messages",
+    "CREATE TRIGGER conversations_au AFTER UPDATE ON messages "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION conversations_after_update()",
+]
+
+MESSAGES_FTS_PG = [
+    f"""
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('{SEARCH_LANGUAGE}'::regconfig, coalesce(content, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_messages_content_tsv ON messages USING GIN (content_tsv)",
+]
+
+
+# ============================================================
+# SQLITE STEPS
+# ============================================================
+
+def _sqlite_add_column(cur, table: str, column: str, column_type: str):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def sqlite_base_tables(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS login_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        jid TEXT,
+        lid TEXT,
+        phone TEXT,
+        status TEXT,
+        created_at INTEGER
+    )
+    """)
+    _sqlite_add_column(cur, "login_sessions", "created_at_str", "TEXT")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        jid TEXT UNIQUE,
+        phone TEXT,
+        name TEXT,
+        profile_pic TEXT,
+        last_seen_at INTEGER,
+        is_online INTEGER,
+        created_at INTEGER,
+        updated_at INTEGER
+    )
+    """)
+    _sqlite_add_column(cur, "contacts", "last_seen_at_str", "TEXT")
+    _sqlite_add_column(cur, "contacts", "created_at_str", "TEXT")
+    _sqlite_add_column(cur, "contacts", "updated_at_str", "TEXT")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id TEXT UNIQUE,
+        contact_id INTEGER,
+        direction TEXT,
+        message_type TEXT,
+        content TEXT,
+        media_path TEXT,
+        timestamp INTEGER,
+        status TEXT,
+        created_at INTEGER,
+        FOREIGN KEY(contact_id) REFERENCES contacts(id)
+    )
+    """)
+    _sqlite_add_column(cur, "messages", "timestamp_str", "TEXT")
+    _sqlite_add_column(cur, "messages", "created_at_str", "TEXT")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS message_comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER,
+        comment TEXT,
+        created_at INTEGER,
+        FOREIGN KEY(message_id) REFERENCES messages(id)
+    )
+    """)
+    _sqlite_add_column(cur, "message_comments", "created_at_str", "TEXT")
+
+
+def sqlite_message_indexes(cur):
+    for statement in MESSAGE_INDEXES:
+        cur.execute(statement)
+
+
+def sqlite_outbox(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id TEXT UNIQUE,
+        kind TEXT,
+        payload TEXT,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at INTEGER,
+        last_error TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        created_at_str TEXT
+    )
+    """)
+    cur.execute(OUTBOX_INDEX)
+
+
+def sqlite_outgoing_media(cur):
+    # Outgoing media lives on this host's disk, so its index stays in the
+    # local SQLite file even when messages go to Postgres.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outgoing_media (
+        digest TEXT PRIMARY KEY,
+        size INTEGER,
+        mime TEXT,
+        path TEXT,
+        first_seen INTEGER,
+        first_seen_str TEXT
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outgoing_media_sources (
+        source_path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        digest TEXT
+    )
+    """)
+
+
+def sqlite_messages_fts(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+    existed = cur.fetchone() is not None
+
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        print("SQLite FTS5 unavailable, message search disabled:", e)
+        return
+
+    for statement in MESSAGES_FTS_SQLITE:
+        cur.execute(statement)
+
+    if not existed:
+        # Index the messages stored before search existed.
+        cur.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def sqlite_ship_log(cur):
+    # AUTOINCREMENT so sequence numbers are never reused once shipped rows
+    # are deleted; ship_state.last_seq stays meaningful.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ship_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        queued_at INTEGER
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ship_state (
+        target TEXT PRIMARY KEY,
+        last_seq INTEGER,
+        shipped_rows INTEGER DEFAULT 0,
+        last_shipped_at INTEGER,
+        lease_owner TEXT,
+        lease_until INTEGER
+    )
+    """)
+
+
+def sqlite_conversations(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS conversations (
+        contact_id INTEGER PRIMARY KEY REFERENCES contacts(id),
+        last_message_id TEXT,
+        last_direction TEXT,
+        last_message_type TEXT,
+        last_preview TEXT,
+        last_status TEXT,
+        last_timestamp INTEGER NOT NULL DEFAULT 0,
+        incoming_count INTEGER NOT NULL DEFAULT 0,
+        outgoing_count INTEGER NOT NULL DEFAULT 0,
+        unread_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cur.execute(CONVERSATIONS_INDEX)
+    for statement in CONVERSATIONS_SQLITE:
+        cur.execute(statement)
+
+    # Summarize the messages stored before the table existed.
+    cur.execute(f"""
+    INSERT OR IGNORE INTO conversations ({CONVERSATION_INSERT_COLUMNS})
+    SELECT l.contact_id, l.message_id, l.direction, l.message_type,
+           substr(l.content, 1, {CONVERSATION_PREVIEW_CHARS}), l.status,
+           COALESCE(l.timestamp, 0), a.incoming, a.outgoing, a.unread
+    FROM (
+        SELECT contact_id,
+               sum(direction IS 'in') AS incoming,
+               sum(direction IS 'out') AS outgoing,
+               sum(direction IS 'in' AND status IS NOT 'read') AS unread
+        FROM messages WHERE contact_id IS NOT NULL GROUP BY contact_id
+    ) a
+    JOIN (
+        SELECT *, row_number() OVER (
+            PARTITION BY contact_id ORDER BY COALESCE(timestamp, 0) DESC, id DESC
+        ) AS rn
+        FROM messages WHERE contact_id IS NOT NULL
+    ) l ON l.contact_id = a.contact_id AND l.rn = 1
+    """)
+
+
+def sqlite_whatsapp_lookups(cur):
+    # onWhatsApp answers keyed by the number that was asked, so numbers that
+    # are not on WhatsApp need no contact row.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS whatsapp_lookups (
+        phone TEXT PRIMARY KEY,
+        jid TEXT,
+        on_whatsapp INTEGER,
+        is_business INTEGER,
+        checked_at INTEGER
+    )
+    """)
+
+
+def sqlite_outgoing_media_names(cur):
+    # /media/{filename} looks outgoing files up by name; the newest file
+    # stored under a name wins.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outgoing_media_names (
+        name TEXT PRIMARY KEY,
+        path TEXT,
+        stored_at INTEGER
+    )
+    """)
+    cur.execute("SELECT path, first_seen FROM outgoing_media ORDER BY first_seen")
+    for path, first_seen in cur.fetchall():
+        cur.execute(
+            "INSERT OR REPLACE INTO outgoing_media_names (name, path, stored_at) VALUES (?, ?, ?)",
+            (os.path.basename(path), path, first_seen),
+        )
+
+
+def sqlite_outbox_recipients(cur):
+    _sqlite_add_column(cur, "outbox", "recipient", "TEXT")
+    cur.execute(
+        "UPDATE outbox SET recipient = json_extract(payload, '$.to') WHERE recipient IS NULL"
+    )
+    cur.execute(OUTBOX_RECIPIENT_INDEX)
+
+
+def sqlite_event_log(cur):
+    # Every stored webhook event, in commit order; each worker's event hub
+    # tails it so /events sees what the other workers stored.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS event_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        jid TEXT,
+        phone TEXT,
+        data TEXT NOT NULL,
+        created_at INTEGER
+    )
+    """)
+
+
+def sqlite_online_contacts_index(cur):
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_contacts_online "
+        "ON contacts (last_seen_at) WHERE is_online = 1"
+    )
+
+
+SQLITE_MIGRATIONS = [
+    (1, "base tables", sqlite_base_tables),
+    (2, "message indexes", sqlite_message_indexes),
+    (3, "outbox", sqlite_outbox),
+    (4, "outgoing media store", sqlite_outgoing_media),
+    (5, "messages full-text index", sqlite_messages_fts),
+    (6, "ship log", sqlite_ship_log),
+    (7, "conversations", sqlite_conversations),
+    (8, "whatsapp lookups", sqlite_whatsapp_lookups),
+    (9, "outgoing media names", sqlite_outgoing_media_names),
+    (10, "outbox recipients", sqlite_outbox_recipients),
+    (11, "event log", sqlite_event_log),
+    (12, "online contacts index", sqlite_online_contacts_index),
+]
+
+
+# ============================================================
+# POSTGRES STEPS
+# ============================================================
+
+def pg_base_tables(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS login_sessions (
+        id SERIAL PRIMARY KEY,
+        jid TEXT,
+        lid TEXT,
+        phone TEXT,
+        status TEXT,
+        created_at BIGINT,
+        created_at_str TEXT
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS contacts (
+        id SERIAL PRIMARY KEY,
+        jid TEXT UNIQUE,
+        phone TEXT,
+        name TEXT,
+        profile_pic TEXT,
+        last_seen_at BIGINT,
+        is_online BOOLEAN,
+        created_at BIGINT,
+        updated_at BIGINT
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id SERIAL PRIMARY KEY,
+        message_id TEXT UNIQUE,
+        contact_id INTEGER REFERENCES contacts(id),
+        direction TEXT,
+        message_type TEXT,
+        content TEXT,
+        media_path TEXT,
+        timestamp BIGINT,
+        status TEXT,
+        created_at BIGINT,
+        timestamp_str TEXT,
+        created_at_str TEXT
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS message_comments (
+        id SERIAL PRIMARY KEY,
+        message_id INTEGER REFERENCES messages(id),
+        comment TEXT,
+        created_at BIGINT,
+        created_at_str TEXT
+    )
+    """)
+
+    cur.execute("ALTER TABLE login_sessions ADD COLUMN IF NOT EXISTS created_at_str TEXT")
+    cur.execute("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS last_seen_at_str TEXT")
+    cur.execute("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS created_at_str TEXT")
+    cur.execute("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS updated_at_str TEXT")
+    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS timestamp_str TEXT")
+    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS created_at_str TEXT")
+    cur.execute("ALTER TABLE message_comments ADD COLUMN IF NOT EXISTS created_at_str TEXT")
+
+
+def pg_message_indexes(cur):
+    for statement in MESSAGE_INDEXES:
+        cur.execute(statement)
+
+
+def pg_outbox(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        message_id TEXT UNIQUE,
+        kind TEXT,
+        payload TEXT,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at BIGINT,
+        last_error TEXT,
+        created_at BIGINT,
+        updated_at BIGINT,
+        created_at_str TEXT
+    )
+    """)
+    cur.execute(OUTBOX_INDEX)
+
+
+def pg_messages_fts(cur):
+    for statement in MESSAGES_FTS_PG:
+        cur.execute(statement)
+
+
+def pg_conversations(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS conversations (
+        contact_id INTEGER PRIMARY KEY REFERENCES contacts(id),
+        last_message_id TEXT,
+        last_direction TEXT,
+        last_message_type TEXT,
+        last_preview TEXT,
+        last_status TEXT,
+        last_timestamp BIGINT NOT NULL DEFAULT 0,
+        incoming_count INTEGER NOT NULL DEFAULT 0,
+        outgoing_count INTEGER NOT NULL DEFAULT 0,
+        unread_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cur.execute(CONVERSATIONS_INDEX)
+    for statement in CONVERSATIONS_PG_FUNCTIONS + CONVERSATIONS_PG_TRIGGERS:
+        cur.execute(statement)
+
+    # The triggers above lock messages until this step commits, so no write
+    # can slip between the backfill and the first trigger run.
+    cur.execute(f"""
+    INSERT INTO conversations ({CONVERSATION_INSERT_COLUMNS})
+    SELECT l.contact_id, l.message_id, l.direction, l.message_type,
+           left(l.content, {CONVERSATION_PREVIEW_CHARS}), l.status,
+           COALESCE(l.timestamp, 0), a.incoming, a.outgoing, a.unread
+    FROM (
+        SELECT contact_id,
+               count(*) FILTER (WHERE direction = 'in') AS incoming,
+               count(*) FILTER (WHERE direction = 'out') AS outgoing,
+               sum({_PG_UNREAD.format(t="messages")}) AS unread
+        FROM messages WHERE contact_id IS NOT NULL GROUP BY contact_id
+    ) a
+    JOIN (
+        SELECT DISTINCT ON (contact_id) *
+        FROM messages WHERE contact_id IS NOT NULL
+        ORDER BY contact_id, COALESCE(timestamp, 0) DESC, id DESC
+    ) l ON l.contact_id = a.contact_id
+    ON CONFLICT (contact_id) DO NOTHING
+    """)
+
+
+def pg_whatsapp_lookups(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS whatsapp_lookups (
+        phone TEXT PRIMARY KEY,
+        jid TEXT,
+        on_whatsapp BOOLEAN,
+        is_business BOOLEAN,
+        checked_at BIGINT
+    )
+    """)
+
+
+def pg_outbox_recipients(cur):
+    cur.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS recipient TEXT")
+    cur.execute("UPDATE outbox SET recipient = payload::json->>'to' WHERE recipient IS NULL")
+    cur.execute(OUTBOX_RECIPIENT_INDEX)
+
+
+def pg_event_log(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS event_log (
+        id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        jid TEXT,
+        phone TEXT,
+        data TEXT NOT NULL,
+        created_at BIGINT
+    )
+    """)
+
+
+def pg_online_contacts_index(cur):
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_contacts_online "
+        "ON contacts (last_seen_at) WHERE is_online"
+    )
+
+
+PG_MIGRATIONS = [
+    (1, "base tables", pg_base_tables),
+    (2, "message indexes", pg_message_indexes),
+    (3, "outbox", pg_outbox),
+    (4, "messages full-text index", pg_messages_fts),
+    (5, "conversations", pg_conversations),
+    (6, "whatsapp lookups", pg_whatsapp_lookups),
+    (7, "outbox recipients", pg_outbox_recipients),
+    (8, "event log", pg_event_log),
+    (9, "online contacts index", pg_online_contacts_index),
+]
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+
+def _current_version(cur) -> int:
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def _record(cur, version: int, name: str, pg: bool):
+    ph = "%s" if pg else "?"
+    cur.execute(
+        f"INSERT INTO schema_version (version, name, applied_at) VALUES ({ph}, {ph}, {ph})",
+        (version, name, int(time.time() * 1000)),
+    )
+
+
+def _migrate_sqlite() -> list[int]:
+    db = get_db()
+    applied = []
+    try:
+        cur = db.cursor()
+        try:
+            if _current_version(cur) >= SQLITE_MIGRATIONS[-1][0]:
+                return applied
+        except sqlite3.OperationalError:
+            pass  # no schema_version yet
+
+        # BEGIN IMMEDIATE takes the write lock up front, so a second worker
+        # waits here and then sees the steps already applied.
+        db.commit()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(SCHEMA_VERSION_TABLE)
+        current = _current_version(cur)
+
+        for version, name, step in SQLITE_MIGRATIONS:
+            if version <= current:
+                continue
+            step(cur)
+            _record(cur, version, name, pg=False)
+            applied.append(version)
+
+        db.commit()
+        return applied
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _migrate_pg() -> list[int]:
+    pg = get_pg_db()
+    applied = []
+    try:
+        cur = pg.cursor()
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        if cur.fetchone()[0] and _current_version(cur) >= PG_MIGRATIONS[-1][0]:
+            pg.rollback()
+            return applied
+        pg.rollback()
+
+        # Session lock: concurrent workers queue here instead of racing on
+        # DDL locks, then find nothing left to do.
+        cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (MIGRATION_LOCK_KEY,))
+        try:
+            cur.execute(SCHEMA_VERSION_TABLE)
+            pg.commit()
+            current = _current_version(cur)
+
+            for version, name, step in PG_MIGRATIONS:
+                if version <= current:
+                    continue
+                step(cur)
+                _record(cur, version, name, pg=True)
+                pg.commit()
+                applied.append(version)
+        except Exception:
+            pg.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (MIGRATION_LOCK_KEY,))
+            pg.commit()
+        return applied
+    finally:
+        pg.close()
+
+
+def set_change_tracking(enabled: bool):
+    """Create or drop the ship_log triggers to match the engine"""
+    db = get_db()
+    try:
+        cur = db.cursor()
+        names = list(SHIP_TRIGGERS_SQLITE)
+        cur.execute(
+            f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+            f"AND name IN ({', '.join('?' for _ in names)})",
+            names,
+        )
+        if (cur.fetchone()[0] == len(names)) == enabled:
+            db.commit()
+            return
+
+        db.commit()
+        cur.execute("BEGIN IMMEDIATE")
+        if enabled:
+            for statement in SHIP_TRIGGERS_SQLITE.values():
+                cur.execute(statement)
+            cur.execute("SELECT 1 FROM ship_state WHERE target = 'postgres'")
+            if cur.fetchone() is None:
+                # First start in tiered mode: queue what is already stored.
+                for table in ("contacts", "messages"):
+                    cur.execute(
+                        f"INSERT INTO ship_log (tbl, row_id, queued_at) "
+                        f"SELECT '{table}', id, CAST(strftime('%s', 'now') AS INTEGER) "
+                        f"FROM {table} ORDER BY id"
+                    )
+                cur.execute(
+                    "INSERT INTO ship_state (target, last_seq, shipped_rows) "
+                    "VALUES ('postgres', 0, 0)"
+                )
+        else:
+            for name in names:
+                cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cur.execute("SELECT count(*) FROM ship_log")
+            pending = cur.fetchone()[0]
+            if pending:
+                print(f"Tiered engine disabled with {pending} changes not shipped to Postgres")
+            # Switching back to tiered later re-queues everything.
+            cur.execute("DELETE FROM ship_log")
+            cur.execute("DELETE FROM ship_state")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def init_db():
+    """Bring SQLite (always) and Postgres (when configured) up to the latest schema"""
+    applied = _migrate_sqlite()
+    if applied:
+        print("SQLite schema migrations applied:", applied)
+
+    set_change_tracking(is_tiered())
+
+    if not postgres_configured():
+        if ENGINE != "sqlite":
+            print(f"engine is {ENGINE!r} but Postgres is not configured; using SQLite")
+        return
+
+    try:
+        applied = _migrate_pg()
+        if applied:
+            print("Postgres schema migrations applied:", applied)
+    except Exception as e:
+        print("Postgres init failed:", e)
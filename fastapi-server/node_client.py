@@ -0,0 +1,82 @@
+import re
+import time
+import httpx
+from config import (
+    NODE_BASE_URL,
+    NODE_TIMEOUT,
+    NODE_CONNECT_TIMEOUT,
+    NODE_MAX_CONNECTIONS,
+    NODE_MAX_KEEPALIVE_CONNECTIONS,
+    NODE_KEEPALIVE_EXPIRY,
+)
+from metrics import NODE_REQUEST_SECONDS, NODE_REQUEST_ERRORS
+
+_client: httpx.AsyncClient | None = None
+
+_STATIC_SEGMENT = re.compile(r"^[a-z][a-z-]*$")
+
+
+def node_route(path: str) -> str:
+    """Collapse phone numbers, jids and ids in a Node URL path to {param}"""
+    return "/".join(
+        segment if not segment or _STATIC_SEGMENT.match(segment) else "{param}"
+        for segment in path.split("/")
+    )
+
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        method = request.method
+        path = node_route(request.url.path)
+        start = time.perf_counter()
+
+        try:
+            response = await super().handle_async_request(request)
+        except Exception as e:
+            NODE_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=method, path=path, status="error"
+            )
+            NODE_REQUEST_ERRORS.inc(method=method, path=path, reason=e.__class__.__name__)
+            raise
+
+        NODE_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=method,
+            path=path,
+            status=str(response.status_code),
+        )
+        if response.status_code >= 400:
+            NODE_REQUEST_ERRORS.inc(
+                method=method, path=path, reason=f"http_{response.status_code}"
+            )
+        return response
+
+
+def node_timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(seconds, connect=min(seconds, NODE_CONNECT_TIMEOUT))
+
+
+def get_node_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for the Baileys server, created lazily"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=NODE_BASE_URL,
+            timeout=node_timeout(NODE_TIMEOUT),
+            # Limits live on the transport once a custom one is passed.
+            transport=MeteredTransport(
+                limits=httpx.Limits(
+                    max_connections=NODE_MAX_CONNECTIONS,
+                    max_keepalive_connections=NODE_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=NODE_KEEPALIVE_EXPIRY,
+                ),
+            ),
+        )
+    return _client
+
+
+async def close_node_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
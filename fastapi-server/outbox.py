@@ -0,0 +1,109 @@
+import asyncio
+import random
+import time
+import httpx
+from starlette.concurrency import run_in_threadpool
+from config import (
+    NODE_TIMEOUT,
+    NODE_SEND_MEDIA_TIMEOUT,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_BACKOFF_MAX,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_POLL_INTERVAL,
+)
+from db_ops import claim_outbox, complete_outbox, retry_outbox, dead_letter_outbox
+from node_client import get_node_client, node_timeout
+
+OUTBOX_ROUTES = {
+    "text": ("/send", NODE_TIMEOUT),
+    "media": ("/send/media", NODE_SEND_MEDIA_TIMEOUT),
+}
+
+# Node answers these when the request itself is wrong (missing fields, file
+# not found); retrying cannot help.
+PERMANENT_STATUS_CODES = (400, 404, 422)
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxDispatcher:
+    """Pool of asyncio workers that drain the outbox table into the Baileys server"""
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._tasks = []
+        self._wakeup = None
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"outbox-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        # A send cut short here is retried once its lease expires.
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self):
+        """Wake idle workers right away instead of at the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        lease_ms = OUTBOX_LEASE_SECONDS * 1000
+
+        while True:
+            self._wakeup.clear()
+
+            try:
+                rows = await run_in_threadpool(claim_outbox, 1, lease_ms)
+            except Exception as e:
+                print("Outbox claim failed:", e)
+                rows = []
+
+            if not rows:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for row in rows:
+                try:
+                    await self._dispatch(row)
+                except Exception as e:
+                    print("Outbox dispatch bookkeeping failed:", e)
+
+    async def _dispatch(self, row: dict):
+        path, timeout = OUTBOX_ROUTES[row["kind"]]
+
+        try:
+            r = await get_node_client().post(
+                path, json=row["payload"], timeout=node_timeout(timeout)
+            )
+            if r.status_code in PERMANENT_STATUS_CODES:
+                await run_in_threadpool(
+                    dead_letter_outbox, row, f"HTTP {r.status_code}: {r.text[:500]}"
+                )
+                return
+            r.raise_for_status()
+        except httpx.HTTPError as e:
+            error = str(e) or e.__class__.__name__
+            if row["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                await run_in_threadpool(dead_letter_outbox, row, error)
+            else:
+                next_attempt_at = int((time.time() + backoff_seconds(row["attempts"])) * 1000)
+                await run_in_threadpool(retry_outbox, row, error, next_attempt_at)
+            return
+
+        await run_in_threadpool(complete_outbox, row)
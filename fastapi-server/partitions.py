@@ -0,0 +1,615 @@
+import calendar
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from db import config, get_db, get_pg_db, has_postgres, postgres_configured, SEARCH_LANGUAGE
+from migrations import MESSAGE_INDEXES, MESSAGES_FTS_PG, CONVERSATIONS_PG_TRIGGERS
+from db_ops import HISTORY_MAX_LIMIT, decode_cursor, encode_cursor
+
+MESSAGE_PARTITIONING = bool(config.get("message_partitioning", False))
+PARTITION_PREMAKE_MONTHS = int(config.get("partition_premake_months", 2))
+# 0 keeps everything. Otherwise whole months older than this many months
+# are detached (Postgres) / moved to an archive file (SQLite), or dropped.
+RETENTION_MONTHS = int(config.get("retention_months", 0))
+RETENTION_ACTION = config.get("retention_action", "archive")
+ARCHIVE_DIR = config.get("archive_dir", "data/archive")
+PARTITION_MAINTENANCE_HOURS = float(config.get("partition_maintenance_hours", 24))
+
+ARCHIVE_BATCH_SIZE = 5000
+KEY_PRUNE_BATCH_SIZE = 50000
+MAINTENANCE_LOCK_KEY = "messages_partition_maintenance"
+
+MESSAGE_COPY_COLUMNS = (
+    "id, message_id, contact_id, direction, message_type, content, media_path, "
+    "timestamp, status, created_at, timestamp_str, created_at_str"
+)
+
+# Partitioned messages cannot carry a unique index on message_id alone, so
+# a BEFORE INSERT trigger claims the id in message_keys and skips the row
+# when it was already stored. Moving rows between partitions sets
+# bridge.skip_dedup so their keys are not claimed twice.
+MESSAGE_DEDUP_PG = [
+    """
+    CREATE TABLE IF NOT EXISTS message_keys (
+        message_id TEXT PRIMARY KEY,
+        timestamp BIGINT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_message_keys_ts ON message_keys (timestamp)",
+    """
+    CREATE OR REPLACE FUNCTION messages_dedup() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.message_id IS NULL
+           OR current_setting('bridge.skip_dedup', true) = 'on' THEN
+            RETURN NEW;
+        END IF;
+        INSERT INTO message_keys (message_id, timestamp)
+        VALUES (NEW.message_id, NEW.timestamp)
+        ON CONFLICT DO NOTHING;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# A foreign key to a partitioned table needs a unique key that includes the
+# partition column, which references by message id alone cannot use. Such
+# keys are replaced by this trigger on the referencing table during the
+# conversion; it rejects ids that are not in messages.
+MESSAGE_REFERENCE_CHECK_PG = """
+CREATE OR REPLACE FUNCTION messages_reference_check() RETURNS trigger AS $$
+DECLARE
+    ref BIGINT;
+BEGIN
+    EXECUTE format('SELECT ($1).%I', TG_ARGV[0]) INTO ref USING NEW;
+    IF ref IS NOT NULL AND NOT EXISTS (SELECT 1 FROM messages WHERE id = ref) THEN
+        RAISE foreign_key_violation USING MESSAGE = format(
+            '%s.%s = %s is not present in messages', TG_TABLE_NAME, TG_ARGV[0], ref
+        );
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+PARTITIONED_MESSAGE_INDEXES = MESSAGE_INDEXES[:3] + [
+    "CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages (message_id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_id ON messages (id)",
+    MESSAGES_FTS_PG[1],
+]
+
+
+# ============================================================
+# PERIODS
+# ============================================================
+
+def month_of(ts_ms: int) -> tuple[int, int]:
+    d = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+    return d.year, d.month
+
+
+def add_months(year: int, month: int, n: int) -> tuple[int, int]:
+    index = year * 12 + (month - 1) + n
+    return index // 12, index % 12 + 1
+
+
+def month_bounds(year: int, month: int) -> tuple[int, int]:
+    """[start, end) of a UTC month in epoch milliseconds"""
+    start = calendar.timegm((year, month, 1, 0, 0, 0)) * 1000
+    next_year, next_month = add_months(year, month, 1)
+    end = calendar.timegm((next_year, next_month, 1, 0, 0, 0)) * 1000
+    return start, end
+
+
+def period_name(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}"
+
+
+def parse_period(period: str) -> tuple[int, int]:
+    try:
+        year, month = (int(part) for part in period.split("-", 1))
+        if not 1 <= month <= 12:
+            raise ValueError
+        return year, month
+    except Exception:
+        raise ValueError(f"Invalid period {period!r}, expected YYYY-MM")
+
+
+def partition_table(year: int, month: int) -> str:
+    return f"messages_p{year:04d}{month:02d}"
+
+
+def retention_cutoff() -> tuple[int, int] | None:
+    """First month that is kept, or None when retention is off"""
+    if RETENTION_MONTHS <= 0:
+        return None
+    return add_months(*month_of(int(time.time() * 1000)), -RETENTION_MONTHS)
+
+
+# ============================================================
+# POSTGRES
+# ============================================================
+
+def _pg_is_partitioned(cur) -> bool:
+    cur.execute(
+        "SELECT c.relkind FROM pg_class c "
+        "WHERE c.oid = to_regclass('messages')"
+    )
+    row = cur.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def _pg_table_exists(cur, name: str) -> bool:
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+
+def _pg_attached_partitions(cur) -> list[str]:
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+        """
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _pg_create_partition(cur, year: int, month: int):
+    name = partition_table(year, month)
+    if _pg_table_exists(cur, name):
+        return
+
+    start, end = month_bounds(year, month)
+
+    cur.execute(
+        "SELECT 1 FROM messages_default WHERE timestamp >= %s AND timestamp < %s LIMIT 1",
+        (start, end),
+    )
+    if cur.fetchone() is None:
+        cur.execute(
+            f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM ({start}) TO ({end})"
+        )
+        return
+
+    # Rows for this month already landed in the default partition; Postgres
+    # refuses the new partition until they are moved out of it.
+    cur.execute("SET LOCAL bridge.skip_dedup = 'on'")
+    cur.execute("ALTER TABLE messages DETACH PARTITION messages_default")
+    cur.execute(
+        f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM ({start}) TO ({end})"
+    )
+    cur.execute(
+        f"""
+        INSERT INTO messages ({MESSAGE_COPY_COLUMNS})
+        SELECT {MESSAGE_COPY_COLUMNS} FROM messages_default
+        WHERE timestamp >= %s AND timestamp < %s
+        """,
+        (start, end),
+    )
+    cur.execute(
+        "DELETE FROM messages_default WHERE timestamp >= %s AND timestamp < %s",
+        (start, end),
+    )
+    cur.execute("ALTER TABLE messages ATTACH PARTITION messages_default DEFAULT")
+    cur.execute("SET LOCAL bridge.skip_dedup = 'off'")
+
+
+def _pg_message_references(cur) -> list[tuple[str, str, str, int]]:
+    """Foreign keys pointing at messages: (constraint, table, column, column count)"""
+    cur.execute(
+        """
+        SELECT quote_ident(con.conname), con.conrelid::regclass::text,
+               a.attname, cardinality(con.conkey)
+        FROM pg_constraint con
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+        WHERE con.contype = 'f' AND con.confrelid = 'messages'::regclass
+        """
+    )
+    return cur.fetchall()
+
+
+def _pg_convert(cur):
+    """Rebuild the plain messages table as a monthly range-partitioned one"""
+    references = _pg_message_references(cur)
+    for constraint, table, column, columns in references:
+        if columns != 1:
+            raise RuntimeError(
+                f"Cannot partition messages: foreign key {constraint} on {table} "
+                "spans several columns; drop it first"
+            )
+
+    print("Converting messages to a partitioned table")
+
+    cur.execute("SELECT pg_get_serial_sequence('messages', 'id')")
+    sequence = cur.fetchone()[0]
+    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    cur.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+
+    for statement in MESSAGE_DEDUP_PG:
+        cur.execute(statement)
+
+    cur.execute(f"""
+    CREATE TABLE messages (
+        id BIGINT NOT NULL DEFAULT nextval('{sequence}'),
+        message_id TEXT,
+        contact_id INTEGER REFERENCES contacts(id),
+        direction TEXT,
+        message_type TEXT,
+        content TEXT,
+        media_path TEXT,
+        timestamp BIGINT,
+        status TEXT,
+        created_at BIGINT,
+        timestamp_str TEXT,
+        created_at_str TEXT,
+        content_tsv tsvector GENERATED ALWAYS AS
+            (to_tsvector('{SEARCH_LANGUAGE}'::regconfig, coalesce(content, ''))) STORED
+    ) PARTITION BY RANGE (timestamp)
+    """)
+    cur.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+    cur.execute(
+        "CREATE TRIGGER messages_dedup BEFORE INSERT ON messages "
+        "FOR EACH ROW EXECUTE FUNCTION messages_dedup()"
+    )
+
+    cur.execute("SELECT min(timestamp), max(timestamp) FROM messages_unpartitioned")
+    low, high = cur.fetchone()
+    if low is not None:
+        year, month = month_of(low)
+        last = month_of(high)
+        while (year, month) <= last:
+            _pg_create_partition(cur, year, month)
+            year, month = add_months(year, month, 1)
+
+    cur.execute(
+        f"""
+        INSERT INTO messages ({MESSAGE_COPY_COLUMNS})
+        SELECT {MESSAGE_COPY_COLUMNS} FROM messages_unpartitioned ORDER BY id
+        """
+    )
+    # Only the foreign keys handled below are dropped; any other dependent
+    # object makes the DROP fail and the whole conversion roll back.
+    if references:
+        cur.execute(MESSAGE_REFERENCE_CHECK_PG)
+    for constraint, table, column, _ in references:
+        print(f"Replacing foreign key {constraint} on {table} with a trigger")
+        cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {constraint}")
+        cur.execute(
+            f"CREATE TRIGGER {constraint}_check BEFORE INSERT OR UPDATE ON {table} "
+            "FOR EACH ROW EXECUTE FUNCTION messages_reference_check(%s)",
+            (column,),
+        )
+    cur.execute("DROP TABLE messages_unpartitioned")
+    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+
+    # Created after the copy: those rows are already in conversations.
+    for statement in CONVERSATIONS_PG_TRIGGERS:
+        cur.execute(statement)
+
+    for statement in PARTITIONED_MESSAGE_INDEXES:
+        cur.execute(statement)
+
+
+def _pg_apply_retention(cur, cutoff: tuple[int, int]) -> list[str]:
+    removed = []
+    cutoff_ms = month_bounds(*cutoff)[0]
+
+    for name in sorted(_pg_attached_partitions(cur)):
+        if not name.startswith("messages_p"):
+            continue
+        year, month = int(name[10:14]), int(name[14:16])
+        if month_bounds(year, month)[1] > cutoff_ms:
+            continue
+
+        cur.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        if RETENTION_ACTION == "drop":
+            cur.execute(f"DROP TABLE {name}")
+        removed.append(name)
+
+    # Keys of retired months only guard against very late redeliveries;
+    # prune them in bounded batches.
+    while True:
+        cur.execute(
+            """
+            DELETE FROM message_keys WHERE message_id IN (
+                SELECT message_id FROM message_keys WHERE timestamp < %s LIMIT %s
+            )
+            """,
+            (cutoff_ms, KEY_PRUNE_BATCH_SIZE),
+        )
+        if cur.rowcount < KEY_PRUNE_BATCH_SIZE:
+            break
+
+    return removed
+
+
+def _pg_maintain() -> dict:
+    pg = get_pg_db()
+    try:
+        cur = pg.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (MAINTENANCE_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            pg.rollback()
+            return {"skipped": "maintenance running in another process"}
+
+        converted = False
+        if not _pg_is_partitioned(cur):
+            _pg_convert(cur)
+            converted = True
+
+        year, month = month_of(int(time.time() * 1000))
+        for n in range(-1, PARTITION_PREMAKE_MONTHS + 1):
+            _pg_create_partition(cur, *add_months(year, month, n))
+
+        cutoff = retention_cutoff()
+        removed = _pg_apply_retention(cur, cutoff) if cutoff else []
+
+        pg.commit()
+        return {"converted": converted, "retired": removed}
+    except Exception:
+        pg.rollback()
+        raise
+    finally:
+        pg.close()
+
+
+# ============================================================
+# SQLITE ARCHIVES
+# ============================================================
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.messages (
+    id INTEGER PRIMARY KEY,
+    message_id TEXT UNIQUE,
+    contact_id INTEGER,
+    jid TEXT,
+    phone TEXT,
+    name TEXT,
+    direction TEXT,
+    message_type TEXT,
+    content TEXT,
+    media_path TEXT,
+    timestamp INTEGER,
+    timestamp_str TEXT,
+    status TEXT,
+    created_at INTEGER,
+    created_at_str TEXT
+)
+"""
+
+
+def archive_path(year: int, month: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"messages_{year:04d}_{month:02d}.db")
+
+
+def _sqlite_archive_month(db, year: int, month: int, keep_copy: bool) -> int:
+    """Move (or delete) one month of messages in bounded batches"""
+    start, end = month_bounds(year, month)
+    cur = db.cursor()
+    moved = 0
+
+    def next_batch() -> list[int]:
+        # Rows still queued for the tiered shipper stay until shipped.
+        # COALESCE matches idx_messages_sort; undated rows are never archived.
+        cur.execute(
+            "SELECT id FROM messages "
+            "WHERE COALESCE(timestamp, 0) >= ? AND COALESCE(timestamp, 0) < ? "
+            "AND timestamp IS NOT NULL "
+            "AND id NOT IN (SELECT row_id FROM ship_log WHERE tbl = 'messages') "
+            "LIMIT ?",
+            (start, end, ARCHIVE_BATCH_SIZE),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+    ids = next_batch()
+    if not ids:
+        # No archive file for a month without messages to move.
+        return 0
+
+    if keep_copy:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        db.commit()
+        cur.execute("ATTACH DATABASE ? AS archive", (archive_path(year, month),))
+        cur.execute(ARCHIVE_SCHEMA)
+
+    try:
+        while ids:
+            placeholders = ", ".join("?" for _ in ids)
+            if keep_copy:
+                cur.execute(
+                    f"""
+                    INSERT OR IGNORE INTO archive.messages
+                    SELECT m.id, m.message_id, m.contact_id, c.jid, c.phone, c.name,
+                           m.direction, m.message_type, m.content, m.media_path,
+                           m.timestamp, m.timestamp_str, m.status,
+                           m.created_at, m.created_at_str
+                    FROM main.messages m
+                    LEFT JOIN main.contacts c ON c.id = m.contact_id
+                    WHERE m.id IN ({placeholders})
+                    """,
+                    ids,
+                )
+            cur.execute(f"DELETE FROM main.messages WHERE id IN ({placeholders})", ids)
+            db.commit()
+            moved += len(ids)
+            ids = next_batch()
+    finally:
+        if keep_copy:
+            db.commit()
+            cur.execute("DETACH DATABASE archive")
+
+    return moved
+
+
+def _sqlite_maintain() -> dict:
+    cutoff = retention_cutoff()
+    if cutoff is None:
+        return {"retired": []}
+
+    db = get_db()
+    try:
+        cur = db.cursor()
+        cur.execute(
+            "SELECT min(timestamp) FROM messages "
+            "WHERE COALESCE(timestamp, 0) < ? AND timestamp IS NOT NULL",
+            (month_bounds(*cutoff)[0],),
+        )
+        low = cur.fetchone()[0]
+        retired = []
+
+        if low is not None:
+            year, month = month_of(low)
+            while (year, month) < cutoff:
+                moved = _sqlite_archive_month(
+                    db, year, month, keep_copy=RETENTION_ACTION != "drop"
+                )
+                if moved:
+                    retired.append({"period": period_name(year, month), "messages": moved})
+                year, month = add_months(year, month, 1)
+
+        return {"retired": retired}
+    finally:
+        db.close()
+
+
+# ============================================================
+# MAINTENANCE
+# ============================================================
+
+def run_maintenance() -> dict:
+    """Create upcoming partitions and apply the retention policy"""
+    if postgres_configured():
+        result = _pg_maintain() if MESSAGE_PARTITIONING else {"partitioning": False}
+        if has_postgres():
+            return result
+        # Tiered engine: Postgres and the local SQLite file both keep messages.
+        return {"postgres": result, "sqlite": _sqlite_maintain()}
+    return _sqlite_maintain()
+
+
+class PartitionMaintainer:
+    """Runs run_maintenance() at startup and then every ``interval_hours``"""
+
+    def __init__(self, interval_hours: float, name: str = "partition-maintenance"):
+        self.interval = max(60.0, interval_hours * 3600)
+        self.name = name
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.last_result = run_maintenance()
+            except Exception as e:
+                print(f"{self.name} failed:", e)
+            if self._stop.wait(self.interval):
+                return
+
+
+# ============================================================
+# ARCHIVE READS
+# ============================================================
+
+def list_archives() -> list[dict]:
+    if has_postgres():
+        pg = get_pg_db()
+        try:
+            cur = pg.cursor()
+            attached = set(_pg_attached_partitions(cur)) if _pg_is_partitioned(cur) else set()
+            cur.execute(
+                "SELECT tablename FROM pg_tables "
+                "WHERE schemaname = current_schema() AND tablename ~ '^messages_p[0-9]{6}$'"
+            )
+            names = sorted(row[0] for row in cur.fetchall() if row[0] not in attached)
+        finally:
+            pg.close()
+        return [
+            {"period": f"{name[10:14]}-{name[14:16]}", "table": name}
+            for name in names
+        ]
+
+    archives = []
+    for path in sorted(glob.glob(os.path.join(ARCHIVE_DIR, "messages_*_*.db"))):
+        stem = os.path.basename(path)[len("messages_"):-len(".db")]
+        year, _, month = stem.partition("_")
+        archives.append({"period": f"{year}-{month}", "path": path})
+    return archives
+
+
+def fetch_archived_messages(period: str, cursor: str | None = None, limit: int = 50) -> dict | None:
+    """Newest-first page of one archived month, or None if it was not archived"""
+    year, month = parse_period(period)
+    limit = max(1, min(int(limit), HISTORY_MAX_LIMIT))
+    params = []
+    where = ""
+
+    if has_postgres():
+        if period not in {a["period"] for a in list_archives()}:
+            return None
+        ph = "%s"
+        if cursor:
+            where = f"WHERE (COALESCE(m.timestamp, 0), m.id) < ({ph}, {ph})"
+            params.extend(decode_cursor(cursor))
+        sql = f"""
+            SELECT m.id, m.message_id, m.contact_id, c.jid, c.phone, c.name,
+                   m.direction, m.message_type, m.content, m.media_path,
+                   m.timestamp, m.timestamp_str, m.status
+            FROM {partition_table(year, month)} m
+            LEFT JOIN contacts c ON c.id = m.contact_id
+            {where}
+            ORDER BY COALESCE(m.timestamp, 0) DESC, m.id DESC LIMIT {ph}
+        """
+        conn = get_pg_db()
+    else:
+        path = archive_path(year, month)
+        if not os.path.isfile(path):
+            return None
+        if cursor:
+            where = "WHERE (timestamp, id) < (?, ?)"
+            params.extend(decode_cursor(cursor))
+        sql = f"""
+            SELECT id, message_id, contact_id, jid, phone, name,
+                   direction, message_type, content, media_path,
+                   timestamp, timestamp_str, status
+            FROM messages {where}
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+        """
+        # Archives are opened read-only on demand, never kept attached.
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+
+    params.append(limit + 1)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        columns = [col[0] for col in cur.description]
+        rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+
+    return {"period": period, "messages": rows, "next_cursor": next_cursor}
@@ -0,0 +1,163 @@
+import threading
+import time
+from db import config
+
+PRESENCE_FLUSH_INTERVAL_MS = int(config.get("presence_flush_interval_ms", 1000))
+# A jid without presence updates for this long is forgotten; its state is
+# unknown again rather than stuck at its last "online".
+PRESENCE_IDLE_TTL_SECONDS = float(config.get("presence_idle_ttl_seconds", 600))
+
+
+class PresenceAggregator:
+    """Keeps the newest presence state per jid and flushes changes in bulk.
+
+    Presence events are last-write-wins by ``last_seen_at``: an update older
+    than the state already held for its jid is dropped, and several updates
+    for one jid between two flushes collapse into a single row. Entries idle
+    for ``idle_ttl`` seconds are no longer served and are evicted once stored.
+    """
+
+    def __init__(self, flush_fn, interval_ms: int, idle_ttl: float = PRESENCE_IDLE_TTL_SECONDS,
+                 name: str = "presence-flusher"):
+        self.flush_fn = flush_fn
+        self.interval = max(1, interval_ms) / 1000.0
+        self.idle_ttl = idle_ttl
+        self.name = name
+        self._state = {}
+        # jid -> monotonic time of its last accepted update
+        self._touched = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.superseded = 0
+        self.flushed = 0
+        self.evicted = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def update(self, row: dict):
+        jid = row.get("jid")
+        if not jid:
+            return
+
+        if row.get("last_seen_at") is None:
+            row = {**row, "last_seen_at": int(time.time() * 1000)}
+
+        with self._lock:
+            self.received += 1
+            current = self._state.get(jid)
+
+            if current is not None:
+                if row["last_seen_at"] < current["last_seen_at"]:
+                    self.superseded += 1
+                    return
+                row = {
+                    **row,
+                    "phone": row.get("phone") or current.get("phone"),
+                    "name": row.get("name") or current.get("name"),
+                }
+
+            if jid in self._dirty:
+                self.superseded += 1
+
+            self._state[jid] = row
+            self._touched[jid] = time.monotonic()
+            self._dirty[jid] = row
+
+        if not self.running:
+            self.flush()
+
+    def _fresh(self, jid: str, now: float) -> bool:
+        return now - self._touched.get(jid, now) < self.idle_ttl
+
+    def get(self, jid: str):
+        now = time.monotonic()
+        with self._lock:
+            if not self._fresh(jid, now):
+                return None
+            return self._state.get(jid)
+
+    def online(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                row for jid, row in self._state.items()
+                if row.get("is_online") and self._fresh(jid, now)
+            ]
+
+    def recent(self) -> dict:
+        """jid -> latest row for every contact updated within the idle TTL"""
+        now = time.monotonic()
+        with self._lock:
+            return {jid: row for jid, row in self._state.items() if self._fresh(jid, now)}
+
+    def evict_idle(self) -> int:
+        """Drop idle entries that are already stored"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                jid for jid in self._state
+                if not self._fresh(jid, now) and jid not in self._dirty
+            ]
+            for jid in idle:
+                del self._state[jid]
+                del self._touched[jid]
+            self.evicted += len(idle)
+        return len(idle)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+
+        if not dirty:
+            return
+
+        try:
+            stored = self.flush_fn([("presence", row) for row in dirty.values()]) is not False
+        except Exception as e:
+            print(f"{self.name} flush of {len(dirty)} rows failed:", e)
+            stored = False
+
+        if not stored:
+            with self._lock:
+                # Keep the failed rows for the next flush unless newer ones arrived.
+                for jid, row in dirty.items():
+                    self._dirty.setdefault(jid, row)
+            return
+
+        with self._lock:
+            self.flushed += len(dirty)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked": len(self._state),
+                "pending": len(self._dirty),
+                "received": self.received,
+                "superseded": self.superseded,
+                "flushed": self.flushed,
+                "evicted": self.evicted,
+            }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+            self.evict_idle()
@@ -0,0 +1,312 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from db import config, get_db, get_pg_db, is_tiered
+from db_ops import copy_messages_pg, execute_values, MESSAGE_COLUMNS
+from metrics import registry, Counter, CallbackMetric
+
+# Tiered engine: webhook writes commit to local SQLite and triggers queue the
+# changed rows in ship_log (see migrations.set_change_tracking). This thread
+# copies them to Postgres in batches and deletes them from ship_log only after
+# Postgres committed, so an outage or a slow link delays shipping but never
+# loses rows or slows down the webhooks. Applying a batch twice is harmless.
+SHIP_INTERVAL_MS = int(config.get("ship_interval_ms", 1000))
+SHIP_BATCH_ROWS = int(config.get("ship_batch_rows", 2000))
+SHIP_LEASE_SECONDS = float(config.get("ship_lease_seconds", 30))
+SHIP_BACKOFF_MAX_SECONDS = float(config.get("ship_backoff_max_seconds", 60))
+
+CONTACT_COLUMNS = (
+    "jid", "phone", "name", "profile_pic", "last_seen_at", "is_online",
+    "created_at", "updated_at", "last_seen_at_str", "created_at_str", "updated_at_str",
+)
+
+# Several instances may ship into the same database, so fields are merged
+# rather than overwritten: names and phones are only filled in, and presence
+# follows whichever copy was updated last.
+SHIP_CONTACTS_PG = f"""
+    INSERT INTO contacts ({", ".join(CONTACT_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (jid) DO UPDATE SET
+        phone = COALESCE(EXCLUDED.phone, contacts.phone),
+        name = COALESCE(EXCLUDED.name, contacts.name),
+        profile_pic = COALESCE(EXCLUDED.profile_pic, contacts.profile_pic),
+        last_seen_at = GREATEST(EXCLUDED.last_seen_at, contacts.last_seen_at),
+        last_seen_at_str = CASE
+            WHEN EXCLUDED.last_seen_at >= COALESCE(contacts.last_seen_at, 0)
+            THEN EXCLUDED.last_seen_at_str ELSE contacts.last_seen_at_str END,
+        is_online = CASE
+            WHEN EXCLUDED.updated_at >= COALESCE(contacts.updated_at, 0)
+            THEN EXCLUDED.is_online ELSE contacts.is_online END,
+        created_at = LEAST(EXCLUDED.created_at, contacts.created_at),
+        created_at_str = COALESCE(contacts.created_at_str, EXCLUDED.created_at_str),
+        updated_at = GREATEST(EXCLUDED.updated_at, contacts.updated_at),
+        updated_at_str = CASE
+            WHEN EXCLUDED.updated_at >= COALESCE(contacts.updated_at, 0)
+            THEN EXCLUDED.updated_at_str ELSE contacts.updated_at_str END
+    RETURNING jid, id
+"""
+
+# Receipts update rows that were shipped earlier.
+SHIP_MESSAGES_UPDATE_PG = """
+    UPDATE messages m SET
+        status = s.status,
+        content = s.content,
+        media_path = s.media_path
+    FROM staging_messages s
+    WHERE m.message_id = s.message_id
+      AND (m.status IS DISTINCT FROM s.status
+           OR m.content IS DISTINCT FROM s.content
+           OR m.media_path IS DISTINCT FROM s.media_path)
+"""
+
+ROWS_SHIPPED = registry.register(Counter(
+    "shipper_rows_shipped_total",
+    "Rows copied from SQLite to Postgres by the tiered engine",
+    ("table",),
+))
+ROWS_SKIPPED = registry.register(Counter(
+    "shipper_rows_skipped_total",
+    "Changed rows the tiered engine could not ship (messages without a message_id)",
+    ("table",),
+))
+
+
+def _select_in(cur, sql: str, ids) -> list[tuple]:
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), 900):
+        chunk = ids[i:i + 900]
+        cur.execute(sql.format(ids=", ".join("?" for _ in chunk)), chunk)
+        rows.extend(cur.fetchall())
+    return rows
+
+
+def _read_batch(limit: int):
+    """Pending ship_log entries, the current rows they point at and the
+    local ids of messages that cannot be shipped"""
+    db = get_db()
+    try:
+        cur = db.cursor()
+        cur.execute("SELECT seq, tbl, row_id FROM ship_log ORDER BY seq LIMIT ?", (limit,))
+        log = cur.fetchall()
+        if not log:
+            return None, [], [], []
+
+        message_ids = {row_id for _, tbl, row_id in log if tbl == "messages"}
+        contact_ids = {row_id for _, tbl, row_id in log if tbl == "contacts"}
+
+        rows = _select_in(
+            cur,
+            f"SELECT id, {MESSAGE_COLUMNS} FROM messages "
+            "WHERE id IN ({ids})",
+            message_ids,
+        )
+        # Rows without a message_id cannot be deduplicated on a retry.
+        messages = [row[1:] for row in rows if row[1] is not None]
+        unshippable = sorted(row[0] for row in rows if row[1] is None)
+        contact_ids |= {row[1] for row in messages if row[1] is not None}
+        contacts = _select_in(
+            cur,
+            f"SELECT id, {', '.join(CONTACT_COLUMNS)} FROM contacts "
+            "WHERE jid IS NOT NULL AND id IN ({ids})",
+            contact_ids,
+        )
+        db.commit()
+        return log[-1][0], contacts, messages, unshippable
+    finally:
+        db.close()
+
+
+def _write_batch(contacts: list[tuple], messages: list[tuple]):
+    pg = get_pg_db()
+    try:
+        cur = pg.cursor()
+        pg_ids = {}
+
+        if contacts:
+            values = [
+                (*row[1:6], None if row[6] is None else bool(row[6]), *row[7:])
+                for row in contacts
+            ]
+            returned = execute_values(
+                cur, SHIP_CONTACTS_PG, values, page_size=len(values), fetch=True
+            )
+            by_jid = dict(returned)
+            pg_ids = {row[0]: by_jid.get(row[1]) for row in contacts}
+
+        if messages:
+            copy_messages_pg(
+                cur, ((row[0], pg_ids.get(row[1]), *row[2:]) for row in messages)
+            )
+            cur.execute(SHIP_MESSAGES_UPDATE_PG)
+
+        pg.commit()
+    except Exception:
+        pg.rollback()
+        raise
+    finally:
+        pg.close()
+
+
+def ship_batch(limit: int = SHIP_BATCH_ROWS) -> int:
+    """Copy up to ``limit`` queued changes to Postgres; returns the entries consumed"""
+    last_seq, contacts, messages, unshippable = _read_batch(limit)
+    if last_seq is None:
+        return 0
+
+    if contacts or messages:
+        _write_batch(contacts, messages)
+
+    db = get_db()
+    try:
+        cur = db.cursor()
+        cur.execute("DELETE FROM ship_log WHERE seq <= ?", (last_seq,))
+        consumed = cur.rowcount
+        cur.execute(
+            "UPDATE ship_state SET last_seq = ?, shipped_rows = shipped_rows + ?, "
+            "last_shipped_at = ? WHERE target = 'postgres'",
+            (last_seq, len(contacts) + len(messages), int(time.time() * 1000)),
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    if contacts:
+        ROWS_SHIPPED.inc(len(contacts), table="contacts")
+    if messages:
+        ROWS_SHIPPED.inc(len(messages), table="messages")
+    if unshippable:
+        ROWS_SKIPPED.inc(len(unshippable), table="messages")
+        print(
+            f"Shipper skipped {len(unshippable)} messages without a message_id "
+            f"(local ids {unshippable[:10]}{' ...' if len(unshippable) > 10 else ''})"
+        )
+    return consumed
+
+
+def backlog() -> dict:
+    """Queued changes and the age of the oldest one"""
+    if not is_tiered():
+        return {}
+    db = get_db()
+    try:
+        cur = db.cursor()
+        cur.execute("SELECT count(*), min(queued_at) FROM ship_log")
+        pending, oldest = cur.fetchone()
+        cur.execute(
+            "SELECT last_seq, shipped_rows, last_shipped_at, lease_owner "
+            "FROM ship_state WHERE target = 'postgres'"
+        )
+        state = cur.fetchone() or (None, None, None, None)
+        db.commit()
+    finally:
+        db.close()
+    return {
+        "pending": pending,
+        "lag_seconds": max(0, int(time.time()) - oldest) if oldest else 0,
+        "last_seq": state[0],
+        "shipped_rows": state[1],
+        "last_shipped_at": state[2],
+        "lease_owner": state[3],
+    }
+
+
+registry.register(CallbackMetric(
+    "shipper_pending_changes",
+    "Changes waiting in the local SQLite ship_log (tiered engine)",
+    (),
+    lambda: {(): backlog().get("pending", 0)} if is_tiered() else {},
+))
+
+
+class PostgresShipper:
+    """Background thread shipping ship_log to Postgres.
+
+    Worker processes share one SQLite file; a lease in ship_state lets a
+    single process ship at a time and hands over when it stops or dies.
+    """
+
+    def __init__(self, interval_ms: int = SHIP_INTERVAL_MS, name: str = "postgres-shipper"):
+        self.interval = max(0.05, interval_ms / 1000)
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.failures = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self._release()
+        except Exception as e:
+            print(f"{self.name} lease release failed:", e)
+
+    def stats(self) -> dict:
+        return {
+            **backlog(),
+            "owner": self.owner,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def _lease(self, cur, until_ms: int, only_mine: bool = False) -> bool:
+        now = int(time.time() * 1000)
+        condition = "lease_owner = ?" if only_mine else (
+            "(lease_owner = ? OR COALESCE(lease_until, 0) < ?)"
+        )
+        params = (self.owner,) if only_mine else (self.owner, now)
+        cur.execute(
+            f"UPDATE ship_state SET lease_owner = ?, lease_until = ? "
+            f"WHERE target = 'postgres' AND {condition}",
+            (self.owner, until_ms, *params),
+        )
+        return cur.rowcount == 1
+
+    def _acquire(self) -> bool:
+        db = get_db()
+        try:
+            until = int((time.time() + SHIP_LEASE_SECONDS) * 1000)
+            held = self._lease(db.cursor(), until)
+            db.commit()
+            return held
+        finally:
+            db.close()
+
+    def _release(self):
+        db = get_db()
+        try:
+            self._lease(db.cursor(), 0, only_mine=True)
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self):
+        delay = 0.0
+        while not self._stop.wait(delay):
+            try:
+                if not self._acquire():
+                    delay = SHIP_LEASE_SECONDS / 2
+                    continue
+                consumed = ship_batch()
+                self.failures = 0
+                self.last_error = None
+                # Keep going without a pause while there is a backlog.
+                delay = 0.0 if consumed >= SHIP_BATCH_ROWS else self.interval
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                delay = min(SHIP_BACKOFF_MAX_SECONDS, self.interval * 2 ** self.failures)
+                print(f"{self.name} failed (retrying in {delay:.1f}s):", e)
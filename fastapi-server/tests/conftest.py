@@ -0,0 +1,137 @@
+"""Shared fixtures: every test gets fresh databases in a temporary directory.
+
+SQLite tests always run. Postgres tests run only when TEST_POSTGRES_DSN
+points at a scratch database; its public schema is dropped before each
+test.
+
+    cd fastapi-server && python -m pytest
+    TEST_POSTGRES_DSN=postgresql://postgres@localhost/bridge_test python -m pytest
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+FASTAPI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_POSTGRES_DSN = os.getenv("TEST_POSTGRES_DSN")
+
+# db.py reads db_config.json relative to the working directory, and relative
+# paths in it (media, archives) resolve against it; run from a scratch copy
+# so the tests never touch the real data directory.
+WORK_DIR = tempfile.mkdtemp(prefix="bridge-tests-")
+with open(os.path.join(FASTAPI_DIR, "db_config.json")) as f:
+    _config = json.load(f)
+_config.update(
+    engine="sqlite",
+    postgres_dsn=None,
+    sqlite_path=os.path.join(WORK_DIR, "data", "whatsapp.db"),
+    base_path=os.path.join(WORK_DIR, "media"),
+    archive_dir=os.path.join(WORK_DIR, "archive"),
+)
+with open(os.path.join(WORK_DIR, "db_config.json"), "w") as f:
+    json.dump(_config, f)
+os.environ.pop("POSTGRES_DSN", None)
+os.chdir(WORK_DIR)
+sys.path.insert(0, FASTAPI_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+from contact_cache import contact_cache  # noqa: E402
+
+
+def use_engine(engine: str, sqlite_path: str, postgres_dsn: str | None = None):
+    db.close_all_connections()
+    contact_cache.clear()
+
+    db.DB_PATH = sqlite_path
+    db.POSTGRES_DSN = postgres_dsn
+    db.ENGINE = engine
+
+    migrations.init_db()
+
+
+def _wipe_postgres():
+    import psycopg2  # type: ignore
+
+    conn = psycopg2.connect(TEST_POSTGRES_DSN)
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("DROP SCHEMA public CASCADE")
+        cur.execute("CREATE SCHEMA public")
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """The sqlite engine on an empty database; yields the file path"""
+    path = str(tmp_path / "whatsapp.db")
+    use_engine("sqlite", path)
+    yield path
+    db.close_all_connections()
+
+
+@pytest.fixture
+def pg_db(tmp_path):
+    """The postgres engine on an empty scratch database"""
+    if not TEST_POSTGRES_DSN:
+        pytest.skip("TEST_POSTGRES_DSN is not set")
+    db.close_all_connections()
+    _wipe_postgres()
+    use_engine("postgres", str(tmp_path / "whatsapp.db"), TEST_POSTGRES_DSN)
+    yield TEST_POSTGRES_DSN
+    db.close_all_connections()
+
+
+@pytest.fixture
+def tiered_db(tmp_path):
+    """The tiered engine: SQLite in front, the scratch Postgres behind it"""
+    if not TEST_POSTGRES_DSN:
+        pytest.skip("TEST_POSTGRES_DSN is not set")
+    db.close_all_connections()
+    _wipe_postgres()
+    path = str(tmp_path / "whatsapp.db")
+    use_engine("tiered", path, TEST_POSTGRES_DSN)
+    yield path
+    db.close_all_connections()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def engine_db(request):
+    """Runs the test once per engine; the Postgres run needs TEST_POSTGRES_DSN"""
+    return request.getfixturevalue("sqlite_db" if request.param == "sqlite" else "pg_db")
+
+
+def message(message_id: str, jid: str = "919000000001@s.whatsapp.net", **fields) -> dict:
+    """A stored-message row as the webhooks build it"""
+    return {
+        "message_id": message_id,
+        "jid": jid,
+        "phone": None,
+        "name": None,
+        "direction": "in",
+        "message_type": "text",
+        "content": "hello",
+        "media_path": None,
+        "timestamp": 1_700_000_000_000,
+        "status": "received",
+        **fields,
+    }
+
+
+def query(sql: str, params=()) -> list[tuple]:
+    """Run a read on the active engine and return plain tuples"""
+    if db.has_postgres():
+        conn = db.get_pg_db()
+        sql = sql.replace("?", "%s")
+    else:
+        conn = db.get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,136 @@
+import json
+import time
+
+import db_ops
+from contact_cache import contact_cache
+from conftest import message, query
+
+JID = "919000000001@s.whatsapp.net"
+
+
+def status_of(message_id: str) -> str:
+    return query("SELECT status FROM messages WHERE message_id = ?", (message_id,))[0][0]
+
+
+def apply(events) -> bool:
+    """apply_events as the write buffer sees it: a raise counts as False"""
+    try:
+        return db_ops.apply_events(events)
+    except RuntimeError:
+        return False
+
+
+# ---------- receipts ----------
+
+def test_receipts_never_move_a_status_backwards(engine_db):
+    db_ops.apply_events([("message", message("m1", direction="out", status="sent"))])
+
+    db_ops.apply_events([("receipt", {"message_id": "m1", "status": "read"})])
+    db_ops.apply_events([("receipt", {"message_id": "m1", "status": "delivered"})])
+    db_ops.update_message_status("m1", "sent")
+
+    assert status_of("m1") == "read"
+
+
+def test_receipts_in_one_batch_keep_the_furthest_status(engine_db):
+    db_ops.apply_events([
+        ("message", message("m1", direction="out", status="sent")),
+        ("receipt", {"message_id": "m1", "status": "read"}),
+        ("receipt", {"message_id": "m1", "status": "delivered"}),
+        ("receipt", {"message_id": "m1", "status": "played"}),
+    ])
+
+    assert status_of("m1") == "read"
+
+
+def test_unknown_receipt_status_is_ignored(engine_db):
+    db_ops.apply_events([("message", message("m1", direction="out", status="sent"))])
+
+    db_ops.apply_events([("receipt", {"message_id": "m1", "status": "played"})])
+
+    assert status_of("m1") == "sent"
+
+
+def test_redelivered_message_is_stored_once(engine_db):
+    db_ops.apply_events([("message", message("m1"))])
+    db_ops.apply_events([("message", message("m1", content="edited"))])
+
+    assert query("SELECT content FROM messages") == [("hello",)]
+
+
+# ---------- contact cache ----------
+
+def test_rolled_back_contacts_are_not_cached(engine_db, monkeypatch):
+    # The third row re-reads the contact the first one inserted in the same
+    # transaction; it must not reach the cache if that transaction fails.
+    batch = [
+        ("message", message("m1", JID)),
+        ("message", message("m2", JID, name="Alice")),
+        ("message", message("m3", JID, phone="919000000001", name="Alice")),
+    ]
+
+    def fail(cur, events, pg):
+        raise RuntimeError("event log unavailable")
+
+    monkeypatch.setattr(db_ops, "_log_events", fail)
+    assert not apply(batch)
+    assert contact_cache.peek(JID) is None
+    assert query("SELECT count(*) FROM contacts") == [(0,)]
+
+    monkeypatch.undo()
+    assert db_ops.apply_events(batch)
+    [(contact_id,)] = query("SELECT id FROM contacts WHERE jid = ?", (JID,))
+    assert contact_cache.peek(JID) == (contact_id, "919000000001", "Alice")
+
+
+def test_contact_filled_in_by_a_message_leaves_the_cache(engine_db):
+    db_ops.upsert_contact(JID)
+    db_ops.upsert_contact(JID)
+    assert contact_cache.peek(JID)[2] is None
+
+    db_ops.apply_events([("message", message("m1", JID, name="Alice"))])
+
+    cached = contact_cache.peek(JID)
+    assert cached is None or cached[2] == "Alice"
+    assert query("SELECT name FROM contacts WHERE jid = ?", (JID,)) == [("Alice",)]
+
+
+# ---------- event log ----------
+
+def test_stored_events_are_logged_in_commit_order(engine_db):
+    db_ops.apply_events([
+        ("message", message("m1", JID)),
+        ("receipt", {"message_id": "m1", "status": "read", "jid": JID}),
+    ])
+    db_ops.apply_events([("message", message("m2", JID))])
+
+    rows = db_ops.fetch_event_log(0, 10)
+    assert [row["kind"] for row in rows] == ["message", "receipt", "message"]
+    assert [json.loads(row["data"])["message_id"] for row in rows] == ["m1", "m1", "m2"]
+    assert rows[0]["id"] < rows[1]["id"] < rows[2]["id"]
+    assert db_ops.fetch_event_log(rows[1]["id"], 10) == rows[2:]
+
+
+def test_event_log_is_trimmed_to_the_newest_rows(engine_db):
+    for i in range(5):
+        db_ops.apply_events([("message", message(f"m{i}"))])
+
+    db_ops.trim_event_log(2)
+
+    rows = db_ops.fetch_recent_event_log(10)
+    assert [json.loads(row["data"])["message_id"] for row in rows] == ["m3", "m4"]
+
+
+# ---------- presence ----------
+
+def test_older_presence_does_not_overwrite_a_newer_one(engine_db):
+    now = int(time.time() * 1000)
+    db_ops.apply_events([("presence", {"jid": JID, "is_online": True, "last_seen_at": now})])
+    db_ops.apply_events([
+        ("presence", {"jid": JID, "is_online": False, "last_seen_at": now - 5000})
+    ])
+
+    presence = db_ops.fetch_presence(JID, 600)
+    assert presence["is_online"] is True
+    assert presence["last_seen_at"] == now
+    assert [row["jid"] for row in db_ops.fetch_online_presences(600)] == [JID]
@@ -0,0 +1,172 @@
+import threading
+
+import pytest
+
+import db
+from conftest import query
+
+
+def counters(engine: str) -> dict:
+    return dict(db.pool_stats()[engine])
+
+
+def delta(before: dict, after: dict, key: str) -> int:
+    return after[key] - before[key]
+
+
+# ---------- SQLite ----------
+
+def test_sqlite_nested_checkouts_share_one_connection(sqlite_db):
+    before = counters("sqlite")
+
+    outer = db.get_db()
+    inner = db.get_db()
+    assert inner._conn is outer._conn
+    inner.close()
+    outer.close()
+
+    after = counters("sqlite")
+    assert delta(before, after, "checkouts") == 2
+    assert delta(before, after, "checkins") == 2
+
+
+def test_sqlite_second_close_is_not_counted(sqlite_db):
+    before = counters("sqlite")
+
+    conn = db.get_db()
+    conn.close()
+    conn.close()
+
+    assert delta(before, counters("sqlite"), "checkins") == 1
+
+
+def test_sqlite_only_the_outermost_close_rolls_back(sqlite_db):
+    outer = db.get_db()
+    inner = db.get_db()
+    inner.execute("INSERT INTO contacts (jid) VALUES ('919000000001@s.whatsapp.net')")
+    inner.close()
+    assert outer.in_transaction
+
+    outer.close()
+    assert query("SELECT count(*) FROM contacts") == [(0,)]
+
+
+def test_sqlite_connections_are_per_thread(sqlite_db):
+    conn = db.get_db()
+    seen = []
+
+    def other_thread():
+        other = db.get_db()
+        seen.append(other._conn)
+        other.close()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    thread.join()
+
+    assert seen[0] is not conn._conn
+    conn.close()
+
+
+def test_sqlite_close_all_connections_reopens(sqlite_db):
+    conn = db.get_db()
+    first = conn._conn
+    conn.close()
+
+    db.close_all_connections()
+
+    conn = db.get_db()
+    assert conn._conn is not first
+    assert conn.execute("SELECT 1").fetchone() == (1,)
+    conn.close()
+
+
+# ---------- Postgres pool ----------
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    created = []
+
+    def connect(self):
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    monkeypatch.setattr(db.PgPool, "_connect", connect)
+    pool = db.PgPool("postgresql://unused", minconn=1, maxconn=2, timeout=0.05)
+    pool.created = created
+    return pool
+
+
+def test_pg_pool_reuses_returned_connections(fake_pool):
+    fake_pool.prefill()
+    assert fake_pool.stats() == {"size": 1, "idle": 1, "in_use": 0, "max": 2}
+
+    conn = fake_pool.getconn()
+    assert conn is fake_pool.created[0]
+    fake_pool.putconn(conn)
+
+    assert conn.rollbacks == 1
+    assert fake_pool.getconn() is conn
+    assert len(fake_pool.created) == 1
+
+
+def test_pg_pool_times_out_when_exhausted(fake_pool):
+    before = counters("postgres")
+
+    first = fake_pool.getconn()
+    fake_pool.getconn()
+    with pytest.raises(db.PgPoolTimeout):
+        fake_pool.getconn()
+
+    after = counters("postgres")
+    assert delta(before, after, "timeouts") == 1
+    assert delta(before, after, "checkouts") == 2
+    assert fake_pool.stats()["in_use"] == 2
+
+    fake_pool.putconn(first)
+    assert fake_pool.getconn() is first
+
+
+def test_pg_pool_waiter_gets_a_connection_returned_by_another_thread(fake_pool):
+    fake_pool.timeout = 5
+    first = fake_pool.getconn()
+    fake_pool.getconn()
+
+    timer = threading.Timer(0.05, fake_pool.putconn, (first,))
+    timer.start()
+    assert fake_pool.getconn() is first
+    timer.join()
+
+
+def test_pg_pool_discards_closed_connections(fake_pool):
+    before = counters("postgres")
+
+    conn = fake_pool.getconn()
+    conn.closed = 1
+    fake_pool.putconn(conn)
+
+    assert fake_pool.stats()["size"] == 0
+    assert delta(before, counters("postgres"), "discarded") == 1
+    assert fake_pool.getconn() is not conn
+
+
+def test_pg_pooled_connection_rolls_back_on_close(pg_db):
+    conn = db.get_pg_db()
+    conn.cursor().execute("INSERT INTO contacts (jid) VALUES ('919000000001@s.whatsapp.net')")
+    conn.close()
+
+    assert query("SELECT count(*) FROM contacts") == [(0,)]
+    assert db.pool_stats()["postgres"]["in_use"] == 0
@@ -0,0 +1,86 @@
+import json
+import threading
+
+import db
+import migrations
+from conftest import query, use_engine
+
+
+def versions() -> list[int]:
+    return [row[0] for row in query("SELECT version FROM schema_version ORDER BY version")]
+
+
+def sqlite_columns(table: str) -> set[str]:
+    return {row[1] for row in query(f"PRAGMA table_info({table})")}
+
+
+def test_steps_are_numbered_without_gaps():
+    for steps in (migrations.SQLITE_MIGRATIONS, migrations.PG_MIGRATIONS):
+        assert [version for version, _, _ in steps] == list(range(1, len(steps) + 1))
+        assert len({name for _, name, _ in steps}) == len(steps)
+
+
+def test_fresh_sqlite_database_gets_every_step(sqlite_db):
+    assert versions() == [version for version, _, _ in migrations.SQLITE_MIGRATIONS]
+    assert "recipient" in sqlite_columns("outbox")
+    assert not {column for column in sqlite_columns("contacts") if column.startswith("wa_")}
+
+
+def test_up_to_date_sqlite_database_applies_nothing(sqlite_db):
+    assert migrations._migrate_sqlite() == []
+    assert versions() == [version for version, _, _ in migrations.SQLITE_MIGRATIONS]
+
+
+def test_sqlite_upgrade_runs_only_the_missing_steps(tmp_path, monkeypatch):
+    all_steps = migrations.SQLITE_MIGRATIONS
+    monkeypatch.setattr(migrations, "SQLITE_MIGRATIONS", all_steps[:7])
+    use_engine("sqlite", str(tmp_path / "whatsapp.db"))
+
+    # An outbox row queued before recipients were tracked.
+    conn = db.get_db()
+    conn.execute(
+        "INSERT INTO outbox (message_id, kind, payload, status, attempts, next_attempt_at) "
+        "VALUES ('o1', 'text', ?, 'pending', 0, 0)",
+        (json.dumps({"to": "919000000001@s.whatsapp.net", "message": "hi"}),),
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(migrations, "SQLITE_MIGRATIONS", all_steps)
+    assert migrations._migrate_sqlite() == [version for version, _, _ in all_steps[7:]]
+    assert query("SELECT recipient FROM outbox") == [("919000000001@s.whatsapp.net",)]
+    db.close_all_connections()
+
+
+def test_concurrent_sqlite_migrations_apply_each_step_once(tmp_path):
+    use_engine("sqlite", str(tmp_path / "first.db"))
+    db.close_all_connections()
+    db.DB_PATH = str(tmp_path / "shared.db")
+
+    results = []
+    barrier = threading.Barrier(3)
+
+    def migrate():
+        barrier.wait()
+        results.append(migrations._migrate_sqlite())
+
+    threads = [threading.Thread(target=migrate) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    applied = sorted(version for result in results for version in result)
+    assert applied == [version for version, _, _ in migrations.SQLITE_MIGRATIONS]
+    db.close_all_connections()
+
+
+def test_fresh_postgres_database_gets_every_step(pg_db):
+    assert versions() == [version for version, _, _ in migrations.PG_MIGRATIONS]
+    assert migrations._migrate_pg() == []
+    columns = {
+        row[0] for row in query(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'contacts'"
+        )
+    }
+    assert not {column for column in columns if column.startswith("wa_")}
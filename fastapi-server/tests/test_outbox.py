@@ -0,0 +1,122 @@
+import threading
+
+import db_ops
+from conftest import message, query
+
+A = "919000000001@s.whatsapp.net"
+B = "919000000002@s.whatsapp.net"
+LEASE_MS = 60_000
+
+
+def enqueue(message_id: str, jid: str):
+    db_ops.enqueue_outbox(
+        message(message_id, jid, direction="out"), "text", {"to": jid, "message": "hi"}
+    )
+
+
+def claim(limit: int = 10) -> list[dict]:
+    return db_ops.claim_outbox(limit, LEASE_MS)
+
+
+def expire_leases():
+    db_ops._write(lambda cur, pg: cur.execute("UPDATE outbox SET next_attempt_at = 0"))
+
+
+def status_of(message_id: str) -> str:
+    return query("SELECT status FROM messages WHERE message_id = ?", (message_id,))[0][0]
+
+
+def test_enqueue_stores_a_queued_message_and_a_pending_row(engine_db):
+    enqueue("o1", A)
+
+    entry = db_ops.fetch_outbox_entry("o1")
+    assert entry["status"] == "pending"
+    assert entry["attempts"] == 0
+    assert entry["payload"] == {"to": A, "message": "hi"}
+    assert status_of("o1") == "queued"
+
+
+def test_claimed_rows_are_leased(engine_db):
+    enqueue("o1", A)
+
+    [row] = claim()
+    assert row["message_id"] == "o1"
+    assert row["attempts"] == 1
+    assert db_ops.fetch_outbox_entry("o1")["status"] == "sending"
+    assert claim() == []
+
+
+def test_expired_lease_is_claimed_again(engine_db):
+    enqueue("o1", A)
+    claim()
+
+    expire_leases()
+
+    [row] = claim()
+    assert row["message_id"] == "o1"
+    assert row["attempts"] == 2
+
+
+def test_one_message_per_recipient_in_queue_order(engine_db):
+    enqueue("o1", A)
+    enqueue("o2", A)
+    enqueue("o3", B)
+
+    first = {row["message_id"]: row for row in claim()}
+    assert sorted(first) == ["o1", "o3"]
+    assert claim() == []
+
+    # A retry keeps its place: o2 still waits behind it.
+    db_ops.retry_outbox(first["o1"], "timeout", 0)
+    [retried] = claim()
+    assert retried["message_id"] == "o1"
+
+    db_ops.complete_outbox(retried)
+    assert [row["message_id"] for row in claim()] == ["o2"]
+    assert status_of("o1") == "sent"
+
+
+def test_dead_letter_and_requeue(engine_db):
+    enqueue("o1", A)
+    [row] = claim()
+
+    db_ops.dead_letter_outbox(row, "rejected")
+    assert db_ops.fetch_outbox_entry("o1")["status"] == "dead"
+    assert status_of("o1") == "failed"
+
+    # A dead row no longer holds back the recipient's newer messages.
+    enqueue("o2", A)
+    [newer] = claim()
+    assert newer["message_id"] == "o2"
+
+    assert db_ops.requeue_outbox("o1")
+    entry = db_ops.fetch_outbox_entry("o1")
+    assert (entry["status"], entry["attempts"]) == ("pending", 0)
+    assert status_of("o1") == "queued"
+    assert not db_ops.requeue_outbox("o1")
+
+
+def test_concurrent_claims_never_hand_out_a_row_twice(engine_db):
+    jids = [f"9190000001{i:02d}@s.whatsapp.net" for i in range(20)]
+    for i, jid in enumerate(jids):
+        enqueue(f"o{i}", jid)
+
+    claimed = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            rows = claim(3)
+            if not rows:
+                return
+            with lock:
+                claimed.extend(row["message_id"] for row in rows)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(f"o{i}" for i in range(20))
+    assert db_ops.outbox_counts() == {"sending": 20}
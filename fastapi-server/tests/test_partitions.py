@@ -0,0 +1,127 @@
+import os
+import time
+
+import pytest
+
+import db_ops
+import migrations
+import partitions
+from conftest import message, query
+
+A = "919000000001@s.whatsapp.net"
+DAY_MS = 86_400_000
+
+
+@pytest.fixture
+def retention(monkeypatch, tmp_path):
+    """Keep the current and the previous month"""
+    monkeypatch.setattr(partitions, "RETENTION_MONTHS", 1)
+    monkeypatch.setattr(partitions, "RETENTION_ACTION", "archive")
+    monkeypatch.setattr(partitions, "ARCHIVE_DIR", str(tmp_path / "archive"))
+
+
+def message_ids() -> list[str]:
+    return sorted(row[0] for row in query("SELECT message_id FROM messages"))
+
+
+# ---------- SQLite archives ----------
+
+def test_sqlite_retention_archives_old_months(sqlite_db, retention):
+    now = int(time.time() * 1000)
+    old = now - 100 * DAY_MS
+    db_ops.apply_events([
+        ("message", message("old", A, timestamp=old)),
+        ("message", message("new", A, timestamp=now)),
+        ("message", message("undated", A, timestamp=None)),
+    ])
+
+    result = partitions.run_maintenance()
+
+    period = partitions.period_name(*partitions.month_of(old))
+    assert result == {"retired": [{"period": period, "messages": 1}]}
+    assert message_ids() == ["new", "undated"]
+    assert [archive["period"] for archive in partitions.list_archives()] == [period]
+
+    page = partitions.fetch_archived_messages(period)
+    assert [(row["message_id"], row["jid"]) for row in page["messages"]] == [("old", A)]
+
+    assert partitions.run_maintenance() == {"retired": []}
+
+
+def test_sqlite_retention_drop_keeps_no_copy(sqlite_db, retention, monkeypatch):
+    monkeypatch.setattr(partitions, "RETENTION_ACTION", "drop")
+    old = int(time.time() * 1000) - 100 * DAY_MS
+    db_ops.apply_events([("message", message("old", A, timestamp=old))])
+
+    partitions.run_maintenance()
+
+    assert message_ids() == []
+    assert not os.path.exists(partitions.ARCHIVE_DIR)
+
+
+def test_sqlite_retention_waits_for_unshipped_rows(sqlite_db, retention):
+    migrations.set_change_tracking(True)
+    old = int(time.time() * 1000) - 100 * DAY_MS
+    db_ops.apply_events([("message", message("old", A, timestamp=old))])
+
+    assert partitions.run_maintenance() == {"retired": []}
+    assert message_ids() == ["old"]
+
+
+# ---------- Postgres conversion ----------
+
+@pytest.fixture
+def partitioning(monkeypatch):
+    monkeypatch.setattr(partitions, "MESSAGE_PARTITIONING", True)
+
+
+def is_partitioned() -> bool:
+    return query("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')") == [("p",)]
+
+
+def test_postgres_conversion_keeps_rows_and_references(pg_db, partitioning):
+    import psycopg2  # type: ignore
+
+    now = int(time.time() * 1000)
+    db_ops.apply_events([
+        ("message", message("old", A, timestamp=now - 100 * DAY_MS)),
+        ("message", message("new", A, timestamp=now)),
+    ])
+    db_ops._write(lambda cur, pg: cur.execute(
+        "CREATE TABLE notes (id SERIAL PRIMARY KEY, message_ref BIGINT REFERENCES messages(id))"
+    ))
+    db_ops._write(lambda cur, pg: cur.execute(
+        "INSERT INTO notes (message_ref) SELECT id FROM messages WHERE message_id = 'old'"
+    ))
+
+    assert partitions.run_maintenance()["converted"] is True
+
+    assert is_partitioned()
+    assert message_ids() == ["new", "old"]
+    assert query("SELECT count(*) FROM notes") == [(1,)]
+    with pytest.raises(psycopg2.Error):
+        db_ops._write(lambda cur, pg: cur.execute("INSERT INTO notes (message_ref) VALUES (-1)"))
+
+    # Redeliveries are still deduplicated across partitions.
+    db_ops.apply_events([("message", message("old", A, timestamp=now - 100 * DAY_MS))])
+    db_ops.apply_events([("message", message("later", A, timestamp=now))])
+    assert message_ids() == ["later", "new", "old"]
+
+    assert partitions.run_maintenance()["converted"] is False
+
+
+def test_postgres_conversion_refuses_multi_column_references(pg_db, partitioning):
+    db_ops.apply_events([("message", message("m1", A))])
+    db_ops._write(lambda cur, pg: cur.execute(
+        "ALTER TABLE messages ADD CONSTRAINT messages_id_message_id UNIQUE (id, message_id)"
+    ))
+    db_ops._write(lambda cur, pg: cur.execute(
+        "CREATE TABLE pairs (a BIGINT, b TEXT, FOREIGN KEY (a, b) "
+        "REFERENCES messages (id, message_id))"
+    ))
+
+    with pytest.raises(RuntimeError, match="several columns"):
+        partitions.run_maintenance()
+
+    assert not is_partitioned()
+    assert message_ids() == ["m1"]
@@ -0,0 +1,116 @@
+import pytest
+
+import db
+import db_ops
+import migrations
+import shipper
+from shipper import PostgresShipper, ROWS_SKIPPED
+from conftest import message, query
+
+A = "919000000001@s.whatsapp.net"
+B = "919000000002@s.whatsapp.net"
+
+
+@pytest.fixture
+def ship_state(sqlite_db):
+    """A SQLite database with change tracking on, as the tiered engine sets it up"""
+    migrations.set_change_tracking(True)
+    return sqlite_db
+
+
+def expire_lease():
+    conn = db.get_db()
+    conn.execute("UPDATE ship_state SET lease_until = 0")
+    conn.commit()
+    conn.close()
+
+
+def pg_query(sql: str, params=()) -> list[tuple]:
+    conn = db.get_pg_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+# ---------- lease ----------
+
+def test_only_one_shipper_holds_the_lease(ship_state):
+    first, second = PostgresShipper(), PostgresShipper()
+
+    assert first._acquire()
+    assert not second._acquire()
+    assert first._acquire()  # renewal
+
+
+def test_expired_lease_moves_to_another_shipper(ship_state):
+    first, second = PostgresShipper(), PostgresShipper()
+    assert first._acquire()
+
+    expire_lease()
+
+    assert second._acquire()
+    assert not first._acquire()
+
+
+def test_release_only_drops_the_own_lease(ship_state):
+    first, second = PostgresShipper(), PostgresShipper()
+    assert first._acquire()
+
+    second._release()
+    assert not second._acquire()
+
+    first._release()
+    assert second._acquire()
+
+
+def test_changes_are_queued_in_ship_log(ship_state):
+    db_ops.apply_events([("message", message("m1", A))])
+
+    assert sorted(query("SELECT tbl FROM ship_log")) == [("contacts",), ("messages",)]
+
+
+# ---------- shipping (needs Postgres) ----------
+
+def test_ship_batch_copies_rows_to_postgres(tiered_db):
+    db_ops.apply_events([
+        ("message", message("m1", A, direction="out", status="sent")),
+        ("message", message("m2", B)),
+        ("receipt", {"message_id": "m1", "status": "read"}),
+    ])
+
+    assert shipper.ship_batch() > 0
+    assert shipper.backlog()["pending"] == 0
+
+    rows = pg_query(
+        "SELECT m.message_id, m.status, c.jid FROM messages m "
+        "JOIN contacts c ON c.id = m.contact_id ORDER BY m.message_id"
+    )
+    assert rows == [("m1", "read", A), ("m2", "received", B)]
+
+
+def test_shipping_the_same_rows_again_changes_nothing(tiered_db):
+    db_ops.apply_events([("message", message("m1", A)), ("message", message("m2", A))])
+    shipper.ship_batch()
+
+    conn = db.get_db()
+    conn.execute("INSERT INTO ship_log (tbl, row_id) SELECT 'messages', id FROM messages")
+    conn.commit()
+    conn.close()
+    shipper.ship_batch()
+
+    assert pg_query("SELECT count(*) FROM messages") == [(2,)]
+    assert pg_query("SELECT count(*) FROM contacts") == [(1,)]
+
+
+def test_messages_without_an_id_stay_local(tiered_db):
+    before = ROWS_SKIPPED._values.get(("messages",), 0)
+    db_ops.apply_events([("message", message("m1", A)), ("message", message(None, A))])
+
+    shipper.ship_batch()
+
+    assert pg_query("SELECT message_id FROM messages") == [("m1",)]
+    assert ROWS_SKIPPED._values.get(("messages",), 0) - before == 1
+    assert shipper.backlog()["pending"] == 0
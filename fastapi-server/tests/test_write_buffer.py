@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+
+import write_buffer
+from write_buffer import WriteBuffer, WRITE_BUFFER_EVENTS_LOST
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delays(monkeypatch):
+    monkeypatch.setattr(write_buffer, "WRITE_BUFFER_RETRY_DELAYS", (0, 0, 0))
+
+
+class Store:
+    """flush_fn that fails while ``failures`` last and on batches holding a poisoned event"""
+
+    def __init__(self, poisoned=(), failures: int = 0, raises: bool = False):
+        self.poisoned = set(poisoned)
+        self.failures = failures
+        self.raises = raises
+        self.stored = []
+        self.calls = 0
+
+    def __call__(self, batch):
+        self.calls += 1
+        if self.failures or self.poisoned.intersection(batch):
+            self.failures = max(0, self.failures - 1)
+            if self.raises:
+                raise RuntimeError("constraint failed")
+            return False
+        self.stored.extend(batch)
+        return True
+
+
+def events(n: int) -> list[tuple]:
+    return [("message", i) for i in range(n)]
+
+
+def lost_total() -> float:
+    return WRITE_BUFFER_EVENTS_LOST._values.get((), 0)
+
+
+def run(buffer: WriteBuffer, items):
+    buffer.start()
+    for event in items:
+        buffer.add(event)
+    buffer.stop()
+
+
+def test_batches_are_flushed_in_order():
+    store = Store()
+    buffer = WriteBuffer(store, max_events=4, interval_ms=5)
+
+    run(buffer, events(10))
+
+    assert store.stored == events(10)
+    assert buffer.lost == 0
+
+
+def test_transient_failure_is_retried():
+    store = Store(failures=2)
+    buffer = WriteBuffer(store, max_events=10, interval_ms=1000)
+
+    run(buffer, events(10))
+
+    assert store.stored == events(10)
+    assert buffer.lost == 0
+
+
+@pytest.mark.parametrize("raises", [False, True])
+def test_failing_batch_is_split_until_the_bad_event_is_isolated(raises):
+    store = Store(poisoned={("message", 5)}, raises=raises)
+    buffer = WriteBuffer(store, max_events=10, interval_ms=1000)
+    before = lost_total()
+
+    run(buffer, events(10))
+
+    assert store.stored == [event for event in events(10) if event[1] != 5]
+    assert buffer.lost == 1
+    assert lost_total() - before == 1
+
+
+def test_add_writes_through_when_not_started():
+    store = Store()
+    buffer = WriteBuffer(store, max_events=10, interval_ms=1000)
+
+    buffer.add(("message", 0))
+
+    assert store.stored == [("message", 0)]
+    assert buffer.pending() == 0
+
+
+def test_try_add_refuses_instead_of_blocking_when_full():
+    release = threading.Event()
+    flushing = threading.Event()
+    stored = []
+
+    def slow_store(batch):
+        flushing.set()
+        release.wait(5)
+        stored.extend(batch)
+
+    buffer = WriteBuffer(slow_store, max_events=1, interval_ms=0)
+    assert not buffer.try_add(("message", 0))
+
+    buffer.start()
+    buffer.add(("message", 0))
+    assert flushing.wait(5)
+    accepted = [
+        event for event in events(buffer.max_pending + 2)[1:] if buffer.try_add(event)
+    ]
+    assert len(accepted) == buffer.max_pending
+
+    release.set()
+    buffer.stop()
+    assert stored == [("message", 0), *accepted]
@@ -0,0 +1,149 @@
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+from db import config
+from metrics import registry, Counter
+
+WRITE_BUFFER_ENABLED = bool(config.get("write_buffer_enabled", True))
+WRITE_BUFFER_MAX_EVENTS = int(config.get("write_buffer_max_events", 500))
+WRITE_BUFFER_INTERVAL_MS = int(config.get("write_buffer_interval_ms", 50))
+# Seconds to wait before each retry of a failed batch; after the last one
+# the batch is split to isolate the rows that keep failing.
+WRITE_BUFFER_RETRY_DELAYS = (0.1, 0.5, 2.0)
+
+WRITE_BUFFER_EVENTS_LOST = registry.register(Counter(
+    "write_buffer_events_lost_total",
+    "Buffered webhook events dropped after every retry failed",
+))
+
+
+class WriteBuffer:
+    """Collects events in memory and hands them to ``flush_fn`` in batches.
+
+    A batch is flushed once ``max_events`` events are pending or
+    ``interval_ms`` have passed since the first pending event, whichever
+    comes first. ``add()`` blocks while ``max_pending`` events are already
+    waiting, so a stalled database applies backpressure instead of growing
+    memory without bound; async callers use ``put()``, which waits in the
+    threadpool instead of the event loop.
+
+    ``flush_fn`` reports failure by raising or returning False. A failed
+    batch is retried, then split in halves until the failing events are
+    isolated; only those are dropped and counted.
+    """
+
+    def __init__(self, flush_fn, max_events: int, interval_ms: int, name: str = "write-buffer"):
+        self.flush_fn = flush_fn
+        self.max_events = max(1, max_events)
+        self.interval = max(0, interval_ms) / 1000.0
+        self.max_pending = self.max_events * 10
+        self.name = name
+        self._events = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.lost = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def add(self, event):
+        if not self.running:
+            self._flush([event])
+            return
+
+        with self._cond:
+            while len(self._events) >= self.max_pending and not self._stopping:
+                self._cond.wait()
+            self._events.append(event)
+            if len(self._events) == 1 or len(self._events) >= self.max_events:
+                self._cond.notify_all()
+
+    def try_add(self, event) -> bool:
+        """Queue ``event`` unless that would block; False if it was not queued"""
+        if not self.running:
+            return False
+        with self._cond:
+            if len(self._events) >= self.max_pending:
+                return False
+            self._events.append(event)
+            if len(self._events) == 1 or len(self._events) >= self.max_events:
+                self._cond.notify_all()
+        return True
+
+    async def put(self, event):
+        """``add()`` for the event loop: never blocks it on a full buffer or a direct write"""
+        if not self.try_add(event):
+            await run_in_threadpool(self.add, event)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._events)
+
+    def _apply(self, batch) -> bool:
+        try:
+            if self.flush_fn(batch) is not False:
+                return True
+            print(f"{self.name} flush of {len(batch)} events failed")
+        except Exception as e:
+            print(f"{self.name} flush of {len(batch)} events failed:", e)
+        return False
+
+    def _flush(self, batch):
+        if not batch or self._apply(batch):
+            return
+        for delay in WRITE_BUFFER_RETRY_DELAYS:
+            time.sleep(delay)
+            if self._apply(batch):
+                return
+        self._split(batch)
+
+    def _split(self, batch):
+        if len(batch) == 1:
+            self.lost += 1
+            WRITE_BUFFER_EVENTS_LOST.inc()
+            print(f"{self.name} dropped event after retries:", batch[0][0])
+            return
+        # In order, so a receipt still follows the message it refers to.
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            if not self._apply(half):
+                self._split(half)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._events and not self._stopping:
+                    self._cond.wait()
+
+                deadline = time.monotonic() + self.interval
+                while len(self._events) < self.max_events and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._events[: self.max_events]
+                del self._events[: self.max_events]
+                self._cond.notify_all()
+
+                if self._stopping and not batch:
+                    return
+
+            self._flush(batch)
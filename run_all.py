@@ -20,7 +20,7 @@ processes = []
 REQUIRED_PY_PACKAGES = [
     "fastapi",
     "uvicorn",
-    "requests",
+    "httpx",
     "psycopg2-binary",
     "python-dotenv",
 ]
@@ -115,6 +115,14 @@ def stop_all():
             pass
 
 
+def fastapi_worker_count() -> int:
+    """FASTAPI_WORKERS, or one worker per CPU"""
+    workers = os.getenv("FASTAPI_WORKERS")
+    if workers:
+        return max(1, int(workers))
+    return os.cpu_count() or 1
+
+
 # -----------------------------
 # Main
 # -----------------------------
@@ -141,10 +149,13 @@ def main():
         node_port = os.getenv("NODE_PORT", "3000")
         fastapi_host = os.getenv("FASTAPI_HOST", "127.0.0.1")
         fastapi_port = os.getenv("FASTAPI_PORT", "3002")
+        production = os.getenv("RUN_MODE", "development").lower() == "production"
+        fastapi_workers = fastapi_worker_count() if production else 1
 
         print("\n Starting services...\n")
         print(f" Baileys on port {node_port}")
-        print(f" FastAPI on {fastapi_host}:{fastapi_port}\n")
+        print(f" FastAPI on {fastapi_host}:{fastapi_port}", end="")
+        print(f" ({fastapi_workers} workers)\n" if production else " (development, --reload)\n")
 
         env_node = os.environ.copy()
         env_node["NODE_PORT"] = node_port
@@ -163,14 +174,21 @@ def main():
 
         fastapi_cmd = (
             f'"{sys.executable}" -m uvicorn main:app '
-            f'--host {fastapi_host} --port {fastapi_port} --reload'
+            f'--host {fastapi_host} --port {fastapi_port}'
         )
+        if production:
+            fastapi_cmd += f" --workers {fastapi_workers}"
+        else:
+            fastapi_cmd += " --reload"
+
+        env_fastapi = os.environ.copy()
+        env_fastapi["FASTAPI_WORKERS"] = str(fastapi_workers)
 
         fastapi = start_process(
             fastapi_cmd,
             FASTAPI_DIR,
             "FastAPI Server",
-            env=os.environ.copy(),
+            env=env_fastapi,
         )
         processes.append(fastapi)
 